@@ -43,12 +43,18 @@ function start {
 }
 
 function stop {
-    docker kill $CONTAINER_NAME
+    # in-flight requests are answered first, DRAIN_TIMEOUT of the settings
+    docker stop -t 35 $CONTAINER_NAME
 }
 
 function restart {
     network_available
-    docker restart $CONTAINER_NAME
+    docker restart -t 35 $CONTAINER_NAME
+}
+
+function reload {
+    # workers are replaced one at a time, without refusing any connection
+    docker kill -s HUP $CONTAINER_NAME
 }
 
 function kill {
@@ -65,6 +71,7 @@ Parameters:
     'stop': stop services
     'kill': kill services
     'restart': stop and start again services
+    'reload': restart the worker processes one at a time, without downtime
     'build': create service images
     'remove': remove service images
     'logs': output service logs
@@ -89,6 +96,9 @@ then
         'restart')
             restart
         ;;
+        'reload')
+            reload
+        ;;
         'stop')
             stop
         ;;
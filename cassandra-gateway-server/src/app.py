@@ -2,16 +2,23 @@
 # -*- coding: utf-8 -*-
 
 import os
-import signal
 import logging
 import configparser
 from tornado import web
+from handlers.BaseHandler import BaseHandler
+from handlers.BaseQueryHandler import warm_up_templates
+from handlers.BaseTagHandler import tag_index
 from handlers.QueryHandler import QueryHandler
 from handlers.HealthHandler import HealthHandler
 from handlers.VersionHandler import VersionHandler
+from handlers.MetricsHandler import MetricsHandler
 from handlers.AnnotationsHandler import AnnotationsHandler
+from handlers.TagKeysHandler import TagKeysHandler
+from handlers.TagValuesHandler import TagValuesHandler
+from handlers.SearchHandler import SearchHandler
 from tools import server
-from tools.CassandraClient import Client
+from tools.Compression import ResponseCompression
+from tools.CassandraClient import Client, cassandra_warm_up_queries
 
 abs_path = os.path.abspath(__file__)
 d_name = os.path.dirname(abs_path)
@@ -36,33 +43,57 @@ logging.basicConfig(filename=logfile, level=verbosity, format=log_format)
 logger = logging.getLogger(__name__)
 
 
-def main():
+def make_app():
     """
-    main method.
-
-    :return:
+    :return: the application serving the gateway API
     """
     app_settings = {}
 
-    application = web.Application([
+    return web.Application([
             (r'/version', VersionHandler),
             (r'/health', HealthHandler),
+            (r'/metrics', MetricsHandler),
             (r'/query', QueryHandler),
             (r'/annotations', AnnotationsHandler),
-        ], **app_settings)
+            (r'/tag-keys', TagKeysHandler),
+            (r'/tag-values', TagValuesHandler),
+            (r'/search', SearchHandler),
+        ], transforms=[ResponseCompression], **app_settings)
+
+
+def main():
+    """
+    main method.
+
+    :return:
+    """
+    # cold start, the imports included: measured from the process start
+    started = server.process_start()
 
-    server.start_http(app=application)
-    logger.info('Started, ready to serve')
+    # SIGTERM or SIGINT: in-flight requests are answered before exiting, SIGHUP: workers restarted one at a time
+    server.start_http(
+        app=make_app(),
+        warm_up=warm_up,
+        in_flight=lambda: BaseHandler.requests_in_flight,
+        on_stop=stop,
+        started=started
+    )
+
+
+async def warm_up():
+    """
+    Connect to cassandra and prepare the configured queries, in each worker before it serves requests.
+    """
+    templates = warm_up_templates(cassandra_warm_up_queries)
+    await Client.warm_up(templates)
+    logger.info(f'Cassandra session opened, {len(templates)} queries prepared')
+    tag_index.start()
 
 
-def stop(*_):
+def stop():
     logger.info("Stopping")
     Client.close_connection()
-    server.stop_all()
-    exit(0)
 
 
 if __name__ == '__main__':
-    signal.signal(signal.SIGINT, stop)
-    signal.signal(signal.SIGTERM, stop)
     main()
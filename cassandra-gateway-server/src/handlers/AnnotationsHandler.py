@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import logging
 from cassandra import DriverException, Unauthorized
-from tornado.escape import json_encode
-from handlers.BaseQueryHandler import BaseQueryHandler
+from handlers.BaseQueryHandler import BaseQueryHandler, cancel_on_close
 from tools.CassandraClient import Client
+from tools.Metrics import Metrics
+from tools.Partitions import TooManyPartitions
+from tools.ResultPage import get_column_names
 
 logger = logging.getLogger(__name__)
 
@@ -15,11 +18,20 @@ class AnnotationsHandler(BaseQueryHandler):
     def _parse_results(name: str, rows):
         results = []
 
+        column_names = get_column_names(rows)
+        if not column_names:
+            return results
+
+        timestamp_column = column_names.index('timestamp')
+        title_column = column_names.index('title')
+        tags_column = column_names.index('tags')
+        text_column = column_names.index('text')
+
         for row in rows:
-            timestamp = row.timestamp
-            title = row.title
-            tags = row.tags
-            text = row.text
+            timestamp = row[timestamp_column]
+            title = row[title_column]
+            tags = row[tags_column]
+            text = row[text_column]
 
             results.append(
                 {
@@ -33,7 +45,21 @@ class AnnotationsHandler(BaseQueryHandler):
 
         return results
 
-    def post(self):
+    def _refuse(self, status: int):
+        """
+        Answer with an error status, or drop the connection once annotations were sent:
+        the status is gone with them and the client must not take the truncated array for a complete answer.
+
+        :param status: the HTTP status of the error
+        """
+        if self.json_array_started:
+            logger.error(f'Answer interrupted after its first annotations, closing the connection ({status})')
+            self.request.connection.close()
+        else:
+            self.set_status(status)
+
+    @cancel_on_close
+    async def post(self):
 
         annotation = self.args.get('annotation')
 
@@ -53,24 +79,33 @@ class AnnotationsHandler(BaseQueryHandler):
             return
 
         try:
-            cassandra_client = Client.get_client()
+            cassandra_client = await Client.get_client()
         except DriverException as e:
             logger.error(f'The query got refused because of a cassandra driver error: {e}')
             self.set_status(503)
             return
 
-        request = request.replace('$startTime', self.start_time)
-        request = request.replace('$endTime', self.end_time)
-
         logger.debug(f'Executing: {request}')
 
         try:
-            rows = cassandra_client.execute(request)
-            results = self._parse_results(name, rows)
+            _, pages = await self._prepare_pages(cassandra_client, request, self.start_time, self.end_time)
+            # annotations are sent one page at a time
+            pages = self._timed_pages(pages, Metrics.query_labels(self.handler_name, 'annotation', 'none'))
+            async for page in self._pages_before_deadline(pages):
+                await self._write_json_items(self._parse_results(name, page))
+        except TooManyPartitions as e:
+            logger.info(f'The query got refused, its time range is too large: {e}')
+            self._refuse(400)
+            return
         except Unauthorized as e:
             logger.warning(f'The query got refused because of authorization reasons: {e}')
-            self.set_status(403)
+            self._refuse(403)
             return
-
-        self.set_header('Content-Type', 'application/json')
-        self.write(json_encode(results))
+        except asyncio.TimeoutError:
+            logger.warning('The query got cancelled, the request deadline expired')
+            Metrics.increment('cassandra_gateway_cancelled_requests_total', self.handler_name, 'deadline')
+            if not self.json_array_started:
+                self.set_status(504)
+                return
+
+        self._finish_json_array()
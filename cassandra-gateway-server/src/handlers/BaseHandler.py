@@ -4,6 +4,8 @@ import os
 import logging
 import configparser
 from tornado import web
+from tools.Metrics import Metrics
+from tools.Partitions import check_granularity
 
 logger = logging.getLogger(__name__)
 
@@ -19,9 +21,96 @@ settings = config['API']
 allow_CORS = settings.getboolean('ALLOW_CORS', fallback=False)
 CORS_domain = settings.get('CORS_DOMAIN', fallback='*')
 
+# seconds a query request may run, 0 for no deadline, a `X-Request-Timeout` header can shorten it
+request_deadline = settings.getfloat('REQUEST_DEADLINE', fallback=30)
+
+max_parallel_targets = settings.getint('MAX_PARALLEL_TARGETS', fallback=8)  # targets queried at once per request
+aggregation_engine = settings.get('AGGREGATION_ENGINE', fallback='numpy')  # 'numpy' (when installed) or 'python'
+default_fill = settings.get('FILL', fallback='none')  # empty intervals: 'none', 'null', 'previous' or 'zero'
+# series not aggregated by time intervals are reduced to the `maxDataPoints` of the request: 'lttb', 'minmax' or 'none'
+default_downsampling = settings.get('DOWNSAMPLING', fallback='lttb')
+
+# aggregate on the cassandra side when the query allows it
+aggregation_pushdown = settings.getboolean('AGGREGATION_PUSHDOWN', fallback=False)
+pushdown_max_intervals = settings.getint('PUSHDOWN_MAX_INTERVALS', fallback=2000)  # above, aggregated by the gateway
+pushdown_parallel_queries = settings.getint('PUSHDOWN_PARALLEL_QUERIES', fallback=16)  # intervals queried at once
+
+# ad hoc filters on primary key columns are bound into the queries when cassandra can apply them without
+# ALLOW FILTERING, the other ones are applied by the gateway
+filter_pushdown = settings.getboolean('FILTER_PUSHDOWN', fallback=True)
+
+# aggregated intervals kept in memory, 0 to disable the cache
+result_cache_size = settings.getint('RESULT_CACHE_SIZE', fallback=0) * 2 ** 20  # in bytes
+result_cache_horizon = settings.getfloat('RESULT_CACHE_HORIZON', fallback=300) * 1000  # in milliseconds
+result_cache_backend = settings.get('RESULT_CACHE_BACKEND', fallback='memory')  # 'memory' or 'shared' by workers
+result_cache_shards = settings.getint('RESULT_CACHE_SHARDS', fallback=16)  # locked separately, 'shared' only
+
+# results of more than RESULT_EXECUTOR_THRESHOLD rows are parsed and aggregated off the event loop,
+# by a 'thread' or 'process' executor, 'none' to always process them on the event loop
+result_executor = settings.get('RESULT_EXECUTOR', fallback='thread')
+result_executor_threshold = settings.getint('RESULT_EXECUTOR_THRESHOLD', fallback=100000)  # in rows
+result_executor_workers = settings.getint('RESULT_EXECUTOR_WORKERS', fallback=2)  # per worker process
+
+# identical queries asked at the same time by several requests are executed once
+single_flight = settings.getboolean('SINGLE_FLIGHT', fallback=True)
+
+# query requests served at once by each worker process, 0 for no limit (default), the other ones wait in a short queue
+admission_slots = settings.getint('ADMISSION_SLOTS', fallback=0)
+admission_queue_size = settings.getint('ADMISSION_QUEUE_SIZE', fallback=64)  # above, requests are rejected
+admission_queue_timeout = settings.getfloat('ADMISSION_QUEUE_TIMEOUT', fallback=2)  # in seconds, then rejected
+admission_reject_status = settings.getint('ADMISSION_REJECT_STATUS', fallback=503)  # 503 or 429
+admission_retry_after = settings.getint('ADMISSION_RETRY_AFTER', fallback=1)  # in seconds
+admission_reserved_slots = settings.getint('ADMISSION_RESERVED_SLOTS', fallback=0)  # for small time ranges only
+admission_small_range = settings.getfloat('ADMISSION_SMALL_RANGE', fallback=21600) * 1e6  # in microseconds
+
+# `$computedDates`: keys of the time partitions covering the queried time range
+partition_granularity = settings.get('PARTITION_GRANULARITY', fallback='day')  # 'day' or 'hour'
+partition_format = settings.get('PARTITION_FORMAT', fallback=None)  # strftime format, '%Y-%m-%d' for days
+partition_split = settings.getboolean('PARTITION_SPLIT', fallback=True)  # a query per partition, for `IN` queries
+partition_parallel_queries = settings.getint('PARTITION_PARALLEL_QUERIES', fallback=8)  # partitions queried at once
+partition_max_count = settings.getint('PARTITION_MAX_COUNT', fallback=1000)  # per query, 0 for no limit
+check_granularity(partition_granularity)
+
+# distinct values of the partition key columns and of TAG_INDEX_COLUMNS, for /tag-values and /search
+tag_index_columns = [name.strip() for name in settings.get('TAG_INDEX_COLUMNS', fallback='name').split(',')
+                     if name.strip()]
+tag_index_max_values = settings.getint('TAG_INDEX_MAX_VALUES', fallback=10000)  # per column
+tag_index_max_rows = settings.getint('TAG_INDEX_MAX_ROWS', fallback=100000)  # read per table column
+tag_index_refresh_interval = settings.getfloat('TAG_INDEX_REFRESH_INTERVAL', fallback=300)  # in seconds, 0 disables
+tag_index_shared_size = settings.getint('TAG_INDEX_SHARED_SIZE', fallback=16) * 2 ** 20  # in bytes, 0 to not share
+
 
 class BaseHandler(web.RequestHandler):
 
+    # requests being served by this process, waited for before it exits
+    requests_in_flight = 0
+
+    @property
+    def handler_name(self):
+        """
+        Name of the handler in the metrics: 'query' for QueryHandler, ...
+        """
+        return type(self).__name__.replace('Handler', '').lower()
+
+    def prepare(self):
+        Metrics.start()
+        Metrics.increment('cassandra_gateway_requests_in_flight', self.handler_name)
+        BaseHandler.requests_in_flight += 1
+        self.in_flight = True
+
+    def _leave_flight(self):
+        if getattr(self, 'in_flight', False):
+            Metrics.increment('cassandra_gateway_requests_in_flight', self.handler_name, value=-1)
+            BaseHandler.requests_in_flight -= 1
+            self.in_flight = False
+
+    def on_finish(self):
+        self._leave_flight()
+        Metrics.increment('cassandra_gateway_responses_total', self.handler_name, str(self.get_status()))
+
+    def on_connection_close(self):
+        self._leave_flight()
+
     def data_received(self, chunk):
         """
         Override.
@@ -37,7 +126,7 @@ class BaseHandler(web.RequestHandler):
         """
         if allow_CORS:
             self.set_header('Access-Control-Allow-Origin', CORS_domain)
-            self.set_header('Access-Control-Allow-Headers', 'x-requested-with')
+            self.set_header('Access-Control-Allow-Headers', 'x-requested-with, x-request-timeout')
             self.set_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
 
     def options(self):
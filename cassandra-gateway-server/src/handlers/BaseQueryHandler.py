@@ -1,12 +1,86 @@
 # -*- coding: utf-8 -*-
 
+import time
+import asyncio
 import logging
+import functools
 from datetime import datetime
 from tornado.escape import json_decode
-from handlers.BaseHandler import BaseHandler
+from handlers.BaseHandler import BaseHandler, partition_format, partition_granularity, partition_parallel_queries
+from handlers.BaseHandler import partition_max_count, partition_split, request_deadline
+from handlers.BaseHandler import admission_queue_size, admission_queue_timeout, admission_reject_status
+from handlers.BaseHandler import admission_reserved_slots, admission_retry_after, admission_slots
+from handlers.BaseHandler import admission_small_range
+from tools.Admission import AdmissionControl
+from tools.CassandraClient import Client, iterate_pages
+from tools.Frames import ARROW_CONTENT_TYPE, ArrowStream, to_frame
+from tools.JsonEncoder import iter_encode_items
+from tools.Metrics import Metrics
+from tools.Partitions import compute_partitions, iterate_partitions, split_partitions
+from tools.StatementCache import bind_macros
 
 logger = logging.getLogger(__name__)
 
+# answer bytes buffered before being sent to the client
+FLUSH_SIZE = 64 * 1024
+
+# query slots of this worker process, shared by its query requests
+admission = None
+if admission_slots:
+    admission = AdmissionControl(
+        admission_slots,
+        admission_queue_size,
+        admission_queue_timeout,
+        admission_reserved_slots
+    )
+    Metrics.add_collector(lambda: [
+        ('cassandra_gateway_admission_slots_used', (), admission.in_flight),
+        ('cassandra_gateway_admission_queue_depth', (), admission.queued),
+    ] + [
+        ('cassandra_gateway_rejected_requests_total', (reason,), count)
+        for reason, count in admission.rejected.items()
+    ])
+
+
+def warm_up_templates(queries: list):
+    """
+    Templates prepared by the query handlers for queries, to prepare them ahead of the first requests.
+
+    :param queries: queries, with their macros
+    :return: the query templates, with bind markers
+    """
+    macros = {'startTime': None, 'endTime': None, 'computedDates': None}
+    templates = []
+    for query in queries:
+        single_partition = split_partitions(query) if partition_split else None
+        if single_partition is None:
+            templates.append(bind_macros(query, macros)[0])
+        else:
+            templates.append(bind_macros(single_partition, dict(macros, computedDate=None))[0])
+    return templates
+
+
+def cancel_on_close(method):
+    """
+    Run a handler method as a task, cancelled as soon as the client disconnects.
+
+    Queries still running are cancelled along, no more result page is fetched.
+    """
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if self.client_closed:
+            return
+        self.work = asyncio.ensure_future(method(self, *args, **kwargs))
+        try:
+            await self.work
+        except asyncio.CancelledError:
+            if not self.client_closed:
+                raise
+            logger.debug('Client disconnected, queries cancelled')
+            Metrics.increment('cassandra_gateway_cancelled_requests_total', self.handler_name, 'disconnected')
+
+    return wrapper
+
 
 class BaseQueryHandler(BaseHandler):
 
@@ -14,7 +88,18 @@ class BaseQueryHandler(BaseHandler):
         # we don't care about streamed data
         pass
 
-    def prepare(self):
+    async def prepare(self):
+        super().prepare()
+        self.json_array_started = False
+        # 'json': Grafana series and tables, 'frames': Grafana data frames, 'arrow': data frames as an Arrow stream
+        self.response_format = 'json'
+        self.arrow_stream = None
+        self.encode_duration = 0
+        self.response_bytes = 0
+        self.client_closed = False
+        self.work = None
+        self.admitted = False
+        self.deadline = self._compute_deadline()
         self.args = {}
         if self.request.headers['Content-Type'] in (
             'application/x-json',
@@ -22,6 +107,80 @@ class BaseQueryHandler(BaseHandler):
         ):
             self.args = json_decode(self.request.body)
 
+        if admission:
+            await self._admit()
+
+    async def _admit(self):
+        """
+        Wait for a query slot of this worker, the request is rejected if none gets free soon enough.
+        """
+        self.small = bool(self._extract_time_range() and self.end_time - self.start_time <= admission_small_range)
+        self.work = asyncio.ensure_future(admission.acquire(self.small))
+        try:
+            self.admitted = await self.work
+        except asyncio.CancelledError:
+            if not self.client_closed:
+                raise
+            Metrics.increment('cassandra_gateway_cancelled_requests_total', self.handler_name, 'disconnected')
+            self.finish()
+            return
+        finally:
+            self.work = None
+
+        if not self.admitted:
+            logger.warning('The request got rejected, no query slot is free')
+            self.set_status(admission_reject_status)
+            self.set_header('Retry-After', str(admission_retry_after))
+            self.finish()
+
+    def _compute_deadline(self):
+        """
+        :return: event loop time the request has to be answered by, None if it has no deadline
+        """
+        timeout = request_deadline
+        header = self.request.headers.get('X-Request-Timeout')
+        if header:
+            try:
+                timeout = min(timeout, float(header)) if timeout else float(header)
+            except ValueError:
+                logger.debug(f'Invalid X-Request-Timeout header ignored: {header}')
+        if not timeout:
+            return None
+        return asyncio.get_event_loop().time() + timeout
+
+    async def _before_deadline(self, awaitable):
+        """
+        Await something, cancelled when the request deadline expires.
+
+        :param awaitable: a coroutine or future
+        :return: its result
+        :raise asyncio.TimeoutError: when the deadline expired
+        """
+        if self.deadline is None:
+            return await awaitable
+        return await asyncio.wait_for(awaitable, self.deadline - asyncio.get_event_loop().time())
+
+    async def _pages_before_deadline(self, pages):
+        """
+        Go through result pages as long as the request deadline is not expired.
+
+        :param pages: the result pages, an async iterator
+        :raise asyncio.TimeoutError: when the deadline expired while waiting for a page
+        """
+        iterator = pages.__aiter__()
+        while True:
+            try:
+                page = await self._before_deadline(iterator.__anext__())
+            except StopAsyncIteration:
+                return
+            yield page
+
+    def on_connection_close(self):
+        self.client_closed = True
+        if getattr(self, 'work', None):
+            self.work.cancel()
+        super().on_connection_close()
+
     def _extract_time_range(self):
         time_range = self.args.get('range')
 
@@ -37,7 +196,177 @@ class BaseQueryHandler(BaseHandler):
         from_datetime = datetime.fromisoformat(raw_from.replace('Z', ''))
         to_datetime = datetime.fromisoformat(raw_to.replace('Z', ''))
 
-        self.start_time = str(int(from_datetime.timestamp() * 1e6))  # timestamp in microseconds
-        self.end_time = str(int(to_datetime.timestamp() * 1e6))  # timestamp in microseconds
+        self.start_time = int(from_datetime.timestamp() * 1e6)  # timestamp in microseconds
+        self.end_time = int(to_datetime.timestamp() * 1e6)  # timestamp in microseconds
+
+        # values bound to the `$macro` of queries
+        self.macros = {
+            'startTime': self.start_time,
+            'endTime': self.end_time
+        }
 
         return True
+
+    def _range_macros(self, query: str, start_time: int, end_time: int, query_macros: dict = None):
+        """
+        :param query: the query, with its macros
+        :param start_time: start of the queried time range, in microseconds
+        :param end_time: end of the queried time range, in microseconds
+        :param query_macros: values of the macros of this query only
+        :return: the values bound to the macros of the query over this time range
+        :raise TooManyPartitions: if `$computedDates` would cover more than PARTITION_MAX_COUNT partitions
+        """
+        macros = dict(self.macros, **(query_macros or {}), startTime=start_time, endTime=end_time)
+        if '$computedDates' in query:
+            macros['computedDates'] = compute_partitions(
+                start_time, end_time, partition_granularity, partition_format, partition_max_count
+            )
+        return macros
+
+    async def _prepare_pages(self, cassandra_client, query: str, start_time: int, end_time: int,
+                             query_macros: dict = None):
+        """
+        Prepare a query over a time range.
+
+        A query selecting its partitions by `IN $computedDates` is split into a query per partition,
+        run concurrently, their pages come in the partitions order.
+
+        :param cassandra_client: the cassandra session
+        :param query: the query, with its macros
+        :param start_time: start of the queried time range, in microseconds
+        :param end_time: end of the queried time range, in microseconds
+        :param query_macros: values of the macros of this query only
+        :return: the prepared statement and an async iterator over the result pages
+        """
+        macros = self._range_macros(query, start_time, end_time, query_macros)
+        single_partition = split_partitions(query) if partition_split else None
+
+        if single_partition is None:
+            statement, parameters = await Client.prepare(cassandra_client, query, macros)
+            return statement, iterate_pages(cassandra_client, statement, parameters)
+
+        partitions = macros.pop('computedDates')
+        statement, _ = await Client.prepare(cassandra_client, single_partition, dict(macros, computedDate=None))
+        parameters_list = [
+            bind_macros(single_partition, dict(macros, computedDate=partition))[1] for partition in partitions
+        ]
+        return statement, iterate_partitions(cassandra_client, statement, parameters_list, partition_parallel_queries)
+
+    @staticmethod
+    async def _timed_pages(pages, labels: tuple):
+        """
+        Go through result pages, recording the time spent waiting for them, the time spent handling them
+        and the rows read.
+
+        :param pages: the result pages, an async iterator
+        :param labels: labels of the query metrics
+        """
+        cql_duration = parse_duration = rows = 0
+        waiting = time.perf_counter()
+        try:
+            async for page in pages:
+                received = time.perf_counter()
+                cql_duration += received - waiting
+                rows += len(page)
+                yield page
+                waiting = time.perf_counter()
+                parse_duration += waiting - received
+        finally:
+            Metrics.observe('cassandra_gateway_cql_duration_seconds', cql_duration, *labels)
+            Metrics.observe('cassandra_gateway_parse_duration_seconds', parse_duration, *labels)
+            Metrics.observe('cassandra_gateway_rows', rows, *labels)
+
+    async def _write_json_items(self, items: list):
+        """
+        Send items of the JSON array answer to the client right away.
+
+        :param items: the next items of the answer
+        """
+        if not items:
+            return
+
+        if self.json_array_started:
+            self.write(b',')
+        else:
+            self.set_header('Content-Type', 'application/json')
+            self.write(b'[')
+            self.json_array_started = True
+
+        buffered = 0
+        started = time.perf_counter()
+        for chunk in iter_encode_items(items):
+            self.write(chunk)
+            buffered += len(chunk)
+            if buffered >= FLUSH_SIZE:
+                self.encode_duration += time.perf_counter() - started
+                self.response_bytes += buffered
+                await self.flush()
+                buffered = 0
+                started = time.perf_counter()
+        self.encode_duration += time.perf_counter() - started
+        self.response_bytes += buffered
+        await self.flush()
+
+    async def _write_arrow_items(self, items: list):
+        """
+        Send series of the Arrow stream answer to the client right away.
+
+        :param items: the next series of the answer
+        """
+        if self.arrow_stream is None:
+            self.set_header('Content-Type', ARROW_CONTENT_TYPE)
+            self.arrow_stream = ArrowStream()
+        started = time.perf_counter()
+        data = self.arrow_stream.write(items)
+        self.encode_duration += time.perf_counter() - started
+        self.response_bytes += len(data)
+        self.write(data)
+        await self.flush()
+
+    async def _write_results(self, items: list):
+        """
+        Send target results to the client right away, in the answer format of the request.
+
+        :param items: the next target results
+        """
+        if self.response_format == 'arrow':
+            await self._write_arrow_items(items)
+            return
+        if self.response_format == 'frames':
+            started = time.perf_counter()
+            items = [to_frame(item) for item in items]
+            self.encode_duration += time.perf_counter() - started
+        await self._write_json_items(items)
+
+    def _finish_results(self):
+        """
+        Close the answer.
+        """
+        if self.response_format != 'arrow':
+            self._finish_json_array()
+            return
+        if self.arrow_stream is None:
+            self.set_header('Content-Type', ARROW_CONTENT_TYPE)
+            self.arrow_stream = ArrowStream()
+        data = self.arrow_stream.close()
+        self.response_bytes += len(data)
+        self.write(data)
+
+    def on_finish(self):
+        if getattr(self, 'admitted', False):
+            admission.release(self.small)
+            self.admitted = False
+        if self.json_array_started or getattr(self, 'arrow_stream', None) is not None:
+            Metrics.observe('cassandra_gateway_json_encode_duration_seconds', self.encode_duration, self.handler_name)
+            Metrics.observe('cassandra_gateway_response_bytes', self.response_bytes, self.handler_name)
+        super().on_finish()
+
+    def _finish_json_array(self):
+        """
+        Close the JSON array answer.
+        """
+        if not self.json_array_started:
+            self.set_header('Content-Type', 'application/json')
+            self.write(b'[')
+            self.json_array_started = True
+        self.write(b']')
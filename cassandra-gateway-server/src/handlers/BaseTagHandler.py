@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from tornado.escape import json_decode
+from handlers.BaseHandler import BaseHandler, request_deadline, tag_index_columns, tag_index_max_rows
+from handlers.BaseHandler import tag_index_max_values, tag_index_refresh_interval, tag_index_shared_size
+from tools import server
+from tools.JsonEncoder import encode
+from tools.TagIndex import IndexStore, TagIndex
+
+logger = logging.getLogger(__name__)
+
+# distinct column values, refreshed in the background by the first worker process and shared with the other ones
+tag_index_store = None
+if tag_index_refresh_interval and tag_index_shared_size and server.worker_count() > 1:
+    tag_index_store = IndexStore(tag_index_shared_size)
+tag_index = TagIndex(tag_index_columns, tag_index_max_values, tag_index_max_rows, tag_index_refresh_interval,
+                     tag_index_store)
+
+
+class BaseTagHandler(BaseHandler):
+    """
+    Answer from the cluster metadata and the tag index, without querying cassandra.
+    """
+
+    def data_received(self, _):
+        # we don't care about streamed data
+        pass
+
+    def prepare(self):
+        super().prepare()
+        self.args = {}
+        if self.request.headers.get('Content-Type') in (
+            'application/x-json',
+            'application/json'
+        ) and self.request.body:
+            self.args = json_decode(self.request.body)
+        tag_index.start()
+
+    @staticmethod
+    async def _index_ready():
+        """
+        Wait for the first refresh of the index, at most until the request deadline.
+        """
+        try:
+            await asyncio.wait_for(tag_index.ready(), request_deadline or None)
+        except asyncio.TimeoutError:
+            logger.warning('The tag index is not built yet, answering without it')
+
+    def _write_json(self, value):
+        self.set_header('Content-Type', 'application/json')
+        self.write(encode(value))
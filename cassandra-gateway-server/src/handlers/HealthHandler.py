@@ -2,6 +2,7 @@
 
 import logging
 from cassandra import DriverException, cluster
+from tools import server
 from tools.CassandraClient import Client
 from handlers.BaseHandler import BaseHandler
 
@@ -15,9 +16,18 @@ class HealthHandler(BaseHandler):
         pass
 
     async def get(self):
+        if server.draining:
+            # stopping, load balancers should stop sending requests here
+            self.set_status(503)
+            return
+
         try:
-            Client.get_client()
-        except OSError or DriverException or cluster.NoHostAvailable:
+            await Client.get_client()
+        except (OSError, DriverException, cluster.NoHostAvailable):
+            self.set_status(503)
+            return
+
+        if not Client.is_healthy():
             self.set_status(503)
             return
 
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from handlers.BaseHandler import BaseHandler
+from tools.Metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsHandler(BaseHandler):
+
+    def data_received(self, _):
+        # we don't care about streamed data
+        pass
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(Metrics.collect())
@@ -1,181 +1,339 @@
 # -*- coding: utf-8 -*-
 
+import time
+import asyncio
 import logging
-from cassandra import DriverException, Unauthorized
-from tornado.escape import json_encode
-from handlers.BaseQueryHandler import BaseQueryHandler
-from tools.CassandraClient import Client
+from cassandra import DriverException, InvalidRequest, Unauthorized
+from cassandra.cluster import NoHostAvailable
+from handlers.BaseHandler import aggregation_engine, aggregation_pushdown, default_downsampling, default_fill
+from handlers.BaseHandler import filter_pushdown
+from handlers.BaseHandler import max_parallel_targets
+from handlers.BaseHandler import pushdown_max_intervals, pushdown_parallel_queries
+from handlers.BaseHandler import result_cache_backend, result_cache_horizon, result_cache_shards, result_cache_size
+from handlers.BaseHandler import result_executor, result_executor_threshold, result_executor_workers, single_flight
+from handlers.BaseQueryHandler import BaseQueryHandler, cancel_on_close
+from tools.CassandraClient import Client, execute_async
+from tools.Filters import parse_filters, plan_filters
+from tools.Frames import ARROW_CONTENT_TYPE, pyarrow
+from tools.Metrics import Metrics
+from tools.Partitions import TooManyPartitions
+from tools.Pushdown import plan_pushdown
+from tools.ResultCache import MemoryBackend, ResultCache
+from tools.ResultPage import get_column_types
+from tools.ResultStage import ResultStage
+from tools.SharedCache import SharedMemoryBackend
+from tools.SingleFlight import SingleFlight
+from tools.StatementCache import bind_macros, get_table_metadata
+from tools.TimeSeries import ChangesAggregator, TableBuilder, TimeserieBuilder, compute_aggregation, fill_datapoints
 
 logger = logging.getLogger(__name__)
 
+# aggregated series of the past time intervals, shared by the requests served by this process,
+# or by every worker process when the shared backend is created before they get forked
+result_cache = None
+if result_cache_size:
+    if result_cache_backend == 'shared':
+        result_cache = ResultCache(SharedMemoryBackend(result_cache_size, result_cache_shards), result_cache_horizon)
+    else:
+        result_cache = ResultCache(MemoryBackend(result_cache_size), result_cache_horizon)
+
+# target queries in flight, shared by the requests served by this process
+query_flights = SingleFlight()
+Metrics.add_collector(lambda: [
+    ('cassandra_gateway_queries_total', ('executed',), query_flights.executed),
+    ('cassandra_gateway_queries_total', ('coalesced',), query_flights.coalesced),
+])
+
 
 class QueryHandler(BaseQueryHandler):
 
     @staticmethod
     def _parse_results_as_timeserie(rows):
-        results = []
-
-        entries = {}
-
-        for row in rows:
-            timestamp = row.timestamp
-            name = row.name
-
-            if row.value is None:
-                continue
-
-            try:
-                value = float(row.value)
-            except ValueError or TypeError:
-                value = str(row.value)
-
-            if name not in entries:
-                entries[name] = {
-                    'target': row.name,
-                    'datapoints': [
-                        # an entry is: [ value (float), timestamp in milliseconds (int)]
-                    ]
-                }
-
-            entries[name]['datapoints'].append([
-                value,
-                timestamp / 1000  # convert our timestamp in microsecond into a millisecond one
-            ])
-
-        for entry in entries.values():
-            results.append(entry)
-
-        return results
+        builder = TimeserieBuilder()
+        builder.add_rows(rows)
+        return builder.results()
 
     @staticmethod
     def _parse_results_as_table(rows):
-        result = {
-            'columns': [],
-            'rows': [],
-            'type': 'table'
-        }
-
-        for row in rows:
-            if not result['columns']:
-                for column in list(row._fields):
-                    result['columns'].append(
-                        {
-                            'text': column,
-                            'type': 'string'
-                        }
-                    )
-            value_list = []
-            for column in list(row._fields):
-                value = getattr(row, column)
-                if column == 'timestamp':
-                    value = int(value) / 1000
-                value_list.append(value)
-            result['rows'].append(value_list)
-
-        return [result]
+        builder = TableBuilder()
+        builder.add_rows(rows)
+        return builder.results()
 
     @staticmethod
     def _compute_aggregation(points: list, method):
-        if method == 'sum':
-            return sum(points)
-        elif method == 'minimum':
-            return min(points)
-        elif method == 'maximum':
-            return max(points)
-        elif method == 'and':
-            return all(points)
-        elif method == 'or':
-            return any(points)
-        elif method == 'count':
-            return len(points)
-        # default is average
-        return sum(points) / len(points)
-
-    def _aggregate_datapoint(self, entry_results, method):
-        start_interval_timestamp = 0
-        end_interval_timestamp = 0
-        interval_ms = self.args.get('intervalMs')
-
-        buffer = []
-
-        new_datapoints = []
-
-        for (value, timestamp) in entry_results:
-
-            if not start_interval_timestamp:
-                # start with first value timestamp
-                start_interval_timestamp = timestamp
-                end_interval_timestamp = start_interval_timestamp + interval_ms
-
-            # verify we are not in a new interval
-            if timestamp >= end_interval_timestamp:
-                # store last interval average
-                if buffer:
-                    new_datapoints.append([
-                        self._compute_aggregation(buffer, method),
-                        timestamp
-                    ])
-
-                # reset buffers
-                buffer = []
-
-                # increment interval start timestamp as much as needed
-                while timestamp >= end_interval_timestamp:
-                    start_interval_timestamp += interval_ms
-                    end_interval_timestamp = start_interval_timestamp + interval_ms
-
-            # aggregate values in the same interval
-            try:
-                buffer.append(value)
-            except ValueError or TypeError:
-                # you can't aggregate str
-                return entry_results
-
-        return new_datapoints
+        return compute_aggregation(points, method)
 
     @staticmethod
     def _aggregate_datapoint_changes(entry_results):
-
-        last_value = None
-
-        new_datapoints = []
-
+        aggregator = ChangesAggregator()
         for (value, timestamp) in entry_results:
+            aggregator.add(value, timestamp)
+        return aggregator.finish()
 
-            if value == last_value:
-                continue
-
-            new_datapoints.append([
-                value,
-                timestamp
-            ])
-
-            last_value = value
+    @staticmethod
+    def _error_result(target: dict, message: str):
+        ref_id = target.get('refId')
+        return {
+            'target': ref_id,
+            'refId': ref_id,
+            'datapoints': [],
+            'error': message
+        }
 
-        return new_datapoints
+    def _response_format(self, targets: list):
+        """
+        :return: 'frames' when the request asks for data frames, 'arrow' if the client also accepts an Arrow
+                 stream and every target is a timeserie, 'json' otherwise
+        """
+        if self.args.get('format') != 'frames':
+            return 'json'
+        if (
+            pyarrow
+            and ARROW_CONTENT_TYPE in self.request.headers.get('Accept', '')
+            and all((target.get('type') or 'timeserie') == 'timeserie' for target in targets)
+        ):
+            return 'arrow'
+        return 'frames'
+
+    def _metrics_labels(self, target: dict):
+        return Metrics.query_labels(self.handler_name, target.get('type') or 'timeserie', target.get('aggregation'))
+
+    def _max_points(self):
+        """
+        :return: datapoints a serie of the panel can have at most, None if not given
+        """
+        max_points = self.args.get('maxDataPoints')
+        if isinstance(max_points, bool) or not isinstance(max_points, (int, float)) or max_points <= 0:
+            return None
+        return int(max_points)
+
+    def _make_builder(self, target: dict, statement, fill: str, time_range: tuple):
+        if (target.get('type') or 'timeserie') != 'timeserie':
+            return TableBuilder()
+
+        return TimeserieBuilder(
+            target.get('aggregation'),
+            self.args.get('intervalMs'),
+            aggregation_engine,
+            fill,
+            time_range,
+            get_column_types(statement).get('value'),
+            self._max_points(),
+            target.get('downsampling') or default_downsampling
+        )
+
+    async def _query_pushdown(self, cassandra_client, target: dict, statement, start_time: int, end_time: int,
+                              fill: str, time_range: tuple):
+        """
+        Let cassandra aggregate the values of each interval, when the query allows it.
+
+        :param cassandra_client: the cassandra session
+        :param target: the target to query
+        :param statement: the prepared statement of the target query
+        :param start_time: start of the queried time range, in microseconds
+        :param end_time: end of the queried time range, in microseconds
+        :param fill: how to fill the intervals without datapoint
+        :param time_range: start and end timestamps of the filled time range, in milliseconds
+        :return: the series, None if they have to be aggregated by the gateway
+        """
+        plan = plan_pushdown(
+            target.get('target'),
+            target.get('aggregation'),
+            self.args.get('intervalMs'),
+            get_table_metadata(cassandra_client, statement),
+            get_column_types(statement).get('value')
+        )
+        if not plan:
+            return None
+
+        intervals = plan.intervals(start_time, end_time, pushdown_max_intervals)
+        if intervals is None:
+            return None
+
+        semaphore = asyncio.Semaphore(pushdown_parallel_queries)
+
+        async def query_interval(interval_start, interval_end):
+            async with semaphore:
+                macros = self._range_macros(plan.query, interval_start, interval_end, target.get('macros'))
+                interval_statement, parameters = await Client.prepare(cassandra_client, plan.query, macros)
+                return interval_start, await execute_async(cassandra_client, interval_statement, parameters)
+
+        started = time.perf_counter()
+        tasks = [asyncio.ensure_future(query_interval(*interval)) for interval in intervals]
+        try:
+            answers = [await task for task in tasks]
+        except InvalidRequest as e:
+            logger.info(f'Aggregation not pushed down to cassandra, falling back to the gateway: {e}')
+            plan.reject()
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        labels = self._metrics_labels(target)
+        received = time.perf_counter()
+        Metrics.observe('cassandra_gateway_cql_duration_seconds', received - started, *labels)
+        Metrics.observe('cassandra_gateway_rows', sum(len(rows) for _, rows in answers), *labels)
+
+        results = plan.results(answers, fill, time_range)
+        Metrics.observe('cassandra_gateway_aggregation_duration_seconds', time.perf_counter() - received, *labels)
+        return results
 
-    def _aggregate_results(self, all_results, aggregation):
-        new_results = []
+    async def _query_range(self, cassandra_client, target: dict, start_time: int, end_time: int,
+                           fill: str, time_range: tuple):
+        """
+        Query a target over a time range.
+
+        :param cassandra_client: the cassandra session
+        :param target: the target to query
+        :param start_time: start of the queried time range, bound to `$startTime`, in microseconds
+        :param end_time: end of the queried time range, bound to `$endTime`, in microseconds
+        :param fill: how to fill the intervals without datapoint
+        :param time_range: start and end timestamps of the filled time range, in milliseconds
+        :return: the target results
+        """
+        statement, pages = await self._prepare_pages(
+            cassandra_client, target.get('target'), start_time, end_time, target.get('macros')
+        )
+        builder = self._make_builder(target, statement, fill, time_range)
+        labels = self._metrics_labels(target)
+        filters = target.get('filters')
+
+        # rows filtered by the gateway have to be read, cassandra can not aggregate them
+        if aggregation_pushdown and isinstance(builder, TimeserieBuilder) and not (filters and filters.row_filters):
+            results = await self._query_pushdown(
+                cassandra_client, target, statement, start_time, end_time, fill, time_range
+            )
+            if results is not None:
+                await pages.aclose()
+                return results
+
+        # pages are parsed and aggregated as they come, then released, off the event loop for large results
+        stage = ResultStage(builder, result_executor, result_executor_threshold, result_executor_workers)
+        async for page in self._timed_pages(pages, labels):
+            if filters:
+                page = filters.filter_rows(page)
+            await stage.add_rows(page)
+
+        started = time.perf_counter()
+        results = await stage.results()
+        Metrics.observe('cassandra_gateway_aggregation_duration_seconds', time.perf_counter() - started, *labels)
+        return results
 
-        for result in all_results:
-            target = result['target']
-            datapoints = result['datapoints']
+    async def _query_cached(self, cassandra_client, target: dict):
+        """
+        Query a target, its intervals found in the result cache are not queried again.
 
-            if aggregation == 'on changes':
-                # aggregate by duplicate value
-                datapoints = self._aggregate_datapoint_changes(datapoints)
-            elif aggregation != 'none':
-                # aggregate by time intervals
-                datapoints = self._aggregate_datapoint(datapoints, aggregation)
+        :param cassandra_client: the cassandra session
+        :param target: the target to query
+        :return: the target results
+        """
+        interval_ms = self.args.get('intervalMs')
+        key = ResultCache.make_key(
+            cassandra_client.keyspace,
+            target.get('target'),
+            target.get('aggregation'),
+            interval_ms,
+            self._filters_key(target)
+        )
+
+        cached = result_cache.lookup(key, self.start_time, self.end_time, interval_ms)
+        edges = ResultCache.edges(cached, self.start_time, self.end_time, interval_ms)
+        logger.debug(f'{len(edges)} time ranges to query, {"some" if cached else "no"} intervals cached')
+
+        # edges are left unfilled, the whole range gets filled once merged
+        edge_series = await asyncio.gather(*(
+            self._query_range(cassandra_client, target, start_time, end_time, 'none', None)
+            for start_time, end_time in edges
+        ))
+        series = ResultCache.merge(cached, edge_series, interval_ms)
+        result_cache.store(key, series, self.start_time, self.end_time, interval_ms)
+
+        fill = target.get('fill') or default_fill
+        time_range = (self.start_time / 1000, self.end_time / 1000)  # in milliseconds
+        return [
+            {
+                'target': name,
+                'datapoints': fill_datapoints(datapoints, fill, interval_ms, time_range)
+            } for name, datapoints in series.items() if datapoints
+        ]
+
+    async def _query_series(self, cassandra_client, target: dict):
+        if result_cache and ResultCache.is_cacheable(target, self.args.get('intervalMs')):
+            return await self._query_cached(cassandra_client, target)
+
+        return await self._query_range(
+            cassandra_client,
+            target,
+            self.start_time,
+            self.end_time,
+            target.get('fill') or default_fill,
+            (self.start_time / 1000, self.end_time / 1000)  # in milliseconds
+        )
+
+    def _plan_filters(self, cassandra_client, target: dict):
+        """
+        :return: the target, its query restricted by the ad hoc filters cassandra can apply, along with the
+                 values of the filter macros and the filters left to the gateway
+        """
+        if not self.filters:
+            return target
+
+        plan = plan_filters(target.get('target'), self.filters, cassandra_client, filter_pushdown)
+        Metrics.increment('cassandra_gateway_adhoc_filters_total', 'cassandra', value=len(plan.macros))
+        Metrics.increment('cassandra_gateway_adhoc_filters_total', 'gateway', value=len(plan.row_filters))
+        return dict(target, target=plan.query, macros=plan.macros, filters=plan)
 
-            new_results.append({
-                    'target': target,
-                    'datapoints': datapoints
-            })
+    @staticmethod
+    def _filters_key(target: dict):
+        """
+        :return: identifies the ad hoc filters applied to a target
+        """
+        filters = target.get('filters')
+        if not filters:
+            return ()
+        return tuple(sorted(filters.macros.items())) + filters.key
+
+    def _flight_key(self, cassandra_client, target: dict):
+        """
+        :return: identifies the concurrent queries of a target giving the same results
+        """
+        template, parameters = bind_macros(target.get('target'), dict(self.macros, **target.get('macros', {})))
+        return (
+            cassandra_client.keyspace,
+            template,
+            tuple(parameters),
+            target.get('type') or 'timeserie',
+            target.get('aggregation'),
+            target.get('fill') or default_fill,
+            self.args.get('intervalMs'),
+            self._max_points(),
+            target.get('downsampling') or default_downsampling,
+            self._filters_key(target)
+        )
+
+    async def _query_target(self, cassandra_client, target: dict, semaphore: asyncio.Semaphore):
+        request = target.get('target')
+
+        if not request:
+            return []
+
+        target = self._plan_filters(cassandra_client, target)
+        async with semaphore:
+            logger.debug(f'Executing: {request}')
+            if single_flight:
+                # the same query asked by concurrent requests is executed once, its results are shared
+                target_results = await query_flights.run(
+                    self._flight_key(cassandra_client, target),
+                    lambda: self._query_series(cassandra_client, target)
+                )
+            else:
+                target_results = await self._query_series(cassandra_client, target)
 
-        return new_results
+        return [dict(result, refId=target.get('refId')) for result in target_results]
 
-    def post(self):
+    @cancel_on_close
+    async def post(self):
 
         targets = self.args.get('targets')
 
@@ -187,40 +345,74 @@ class QueryHandler(BaseQueryHandler):
             self.set_status(400)
             return
 
-        results = []
+        # Grafana ad hoc filters, applied to every target
+        self.filters = parse_filters(self.args.get('adhocFilters'))
+        self.response_format = self._response_format(targets)
 
         try:
-            cassandra_client = Client.get_client()
+            cassandra_client = await Client.get_client()
         except DriverException as e:
             logger.error(f'The query got refused because of a cassandra driver error: {e}')
             self.set_status(503)
             return
 
-        for target in targets:
-            request = target.get('target')
-            target_type = target.get('type') or 'timeserie'
-            aggregation = target.get('aggregation')
-
-            request = request.replace('$startTime', self.start_time)
-            request = request.replace('$endTime', self.end_time)
+        # targets are queried concurrently, their results are sent in the targets (refId) order as soon as ready
+        semaphore = asyncio.Semaphore(max_parallel_targets)
+        tasks = [
+            asyncio.ensure_future(self._query_target(cassandra_client, target, semaphore))
+            for target in targets
+        ]
+
+        # errors are held back until a target succeeds, the answer is a 403 if no target is authorized,
+        # a 504 if no target was answered before the deadline and a 400 if every target covers too many partitions
+        errors = []
+        unauthorized = 0
+        expired = 0
+        too_large = 0
+        try:
+            for target, task in zip(targets, tasks):
+                try:
+                    target_results = await self._before_deadline(task)
+                except asyncio.TimeoutError:
+                    logger.warning(f'The query got cancelled, the request deadline expired: {target.get("refId")}')
+                    expired += 1
+                    errors.append(self._error_result(target, 'Deadline exceeded'))
+                    continue
+                except TooManyPartitions as e:
+                    logger.info(f'The query got refused, its time range is too large: {e}')
+                    too_large += 1
+                    errors.append(self._error_result(target, str(e)))
+                    continue
+                except Unauthorized as e:
+                    logger.warning(f'The query got refused because of authorization reasons: {e}')
+                    unauthorized += 1
+                    errors.append(self._error_result(target, str(e)))
+                    continue
+                except (DriverException, NoHostAvailable) as e:
+                    logger.error(f'The query failed because of a cassandra driver error: {e}')
+                    errors.append(self._error_result(target, str(e)))
+                    continue
+
+                await self._write_results(errors + target_results)
+                errors = []
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if expired:
+            Metrics.increment('cassandra_gateway_cancelled_requests_total', self.handler_name, 'deadline')
+
+        if unauthorized == len(targets):
+            self.set_status(403)
+            return
 
-            if not request:
-                continue
+        if expired == len(targets):
+            self.set_status(504)
+            return
 
-            logger.debug(f'Executing: {request}')
+        if too_large == len(targets):
+            self.set_status(400)
+            return
 
-            try:
-                rows = cassandra_client.execute(request)
-                if target_type == 'timeserie':
-                    tmp_results = self._parse_results_as_timeserie(rows)
-                    results.extend(self._aggregate_results(tmp_results, aggregation))
-                else:
-                    tmp_results = self._parse_results_as_table(rows)
-                    results.extend(tmp_results)
-            except Unauthorized as e:
-                logger.warning(f'The query got refused because of authorization reasons: {e}')
-                self.set_status(403)
-                return
-
-        self.set_header('Content-Type', 'application/json')
-        self.write(json_encode(results))
+        await self._write_results(errors)
+        self._finish_results()
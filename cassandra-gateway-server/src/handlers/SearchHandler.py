@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from cassandra import DriverException, cluster
+from handlers.BaseTagHandler import BaseTagHandler, tag_index
+from tools.CassandraClient import Client
+
+logger = logging.getLogger(__name__)
+
+
+class SearchHandler(BaseTagHandler):
+    """
+    Template variable queries: an empty target gives the indexed column names, a column name gives its values.
+    """
+
+    async def post(self):
+        target = (self.args.get('target') or '').strip()
+
+        if target:
+            await self._index_ready()
+            self._write_json(tag_index.values(target))
+            return
+
+        try:
+            session = await Client.get_client()
+        except (OSError, DriverException, cluster.NoHostAvailable) as e:
+            logger.error(f'The search got refused because of a cassandra driver error: {e}')
+            self.set_status(503)
+            return
+
+        self._write_json([key['text'] for key in tag_index.keys(session)])
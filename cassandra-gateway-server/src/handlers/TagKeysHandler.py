@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from cassandra import DriverException, cluster
+from handlers.BaseTagHandler import BaseTagHandler, tag_index
+from tools.CassandraClient import Client
+
+logger = logging.getLogger(__name__)
+
+
+class TagKeysHandler(BaseTagHandler):
+
+    async def post(self):
+        try:
+            session = await Client.get_client()
+        except (OSError, DriverException, cluster.NoHostAvailable) as e:
+            logger.error(f'The tag keys got refused because of a cassandra driver error: {e}')
+            self.set_status(503)
+            return
+
+        self._write_json(tag_index.keys(session))
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from handlers.BaseTagHandler import BaseTagHandler, tag_index
+
+logger = logging.getLogger(__name__)
+
+
+class TagValuesHandler(BaseTagHandler):
+
+    async def post(self):
+        key = self.args.get('key')
+        if not key:
+            self.set_status(400)
+            return
+
+        await self._index_ready()
+        self._write_json([{'text': value} for value in tag_index.values(key)])
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Interval aggregation time of the pure python engine versus the numpy engine.
+
+Usage: SETTINGS_FILE=../settings.ini.default python -m tests.benchmarks.bench_aggregation [points ...]
+"""
+
+import sys
+import time
+import random
+from tools.TimeSeries import IntervalAggregator, NumpyIntervalAggregator, numpy
+
+PAGE_SIZE = 5000
+INTERVAL_MS = 60000
+
+
+def measure(aggregator_class, method: str, values: list, timestamps: list):
+    aggregator = aggregator_class(method, INTERVAL_MS)
+    start = time.perf_counter()
+    for first in range(0, len(values), PAGE_SIZE):
+        aggregator.add_page(values[first:first + PAGE_SIZE], timestamps[first:first + PAGE_SIZE])
+    aggregator.finish()
+    return time.perf_counter() - start
+
+
+def main():
+    if numpy is None:
+        print('numpy is not installed')
+        return
+
+    sizes = [int(size) for size in sys.argv[1:]] or [10 ** 5, 10 ** 6, 10 ** 7]
+
+    for size in sizes:
+        values = [random.random() for _ in range(size)]
+        timestamps = [1579034870000 + i * 100.0 for i in range(size)]  # one point every 100 ms
+        for method in ('sum', 'maximum', 'count', 'average'):
+            python = measure(IntervalAggregator, method, values, timestamps)
+            vectorized = measure(NumpyIntervalAggregator, method, values, timestamps)
+            print(f'{size} points, {method}: python {python:.3f} s, numpy {vectorized:.3f} s '
+                  f'(x{python / vectorized:.1f})')
+
+
+if __name__ == '__main__':
+    main()
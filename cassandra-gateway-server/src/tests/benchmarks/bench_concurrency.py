@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrency of the /query handler with a blocking driver call versus awaited driver futures.
+
+A fake session answers every query after a fixed latency, no cassandra cluster is needed.
+
+Usage: SETTINGS_FILE=../settings.ini.default python -m tests.benchmarks.bench_concurrency [requests] [latency]
+"""
+
+import sys
+import json
+import time
+import asyncio
+from collections import namedtuple
+from unittest import mock
+from tornado import httpclient, httpserver, netutil, web
+from handlers.QueryHandler import QueryHandler
+from tests.fake_cassandra import FakeResponseFuture, FakeSession
+
+Row = namedtuple('Row', ['timestamp', 'name', 'value'])
+
+ROWS = [Row(timestamp=1579034870493109 + i * 1000, name='serie', value=i) for i in range(100)]
+
+
+class BlockingSession(FakeSession):
+    """
+    Session waiting for its result before returning, like the blocking `Session.execute()` did.
+    """
+
+    def execute_async(self, query, parameters=None):
+        time.sleep(self.latency)
+        return FakeResponseFuture(self.pages_factory(query, parameters))
+
+
+async def run(session, requests: int):
+    app = web.Application([(r'/query', QueryHandler)])
+    sockets = netutil.bind_sockets(0, 'localhost')
+    server = httpserver.HTTPServer(app)
+    server.add_sockets(sockets)
+    port = sockets[0].getsockname()[1]
+
+    body = json.dumps({
+        'range': {'from': '2020-01-14T20:00:00.000Z', 'to': '2020-01-14T21:00:00.000Z'},
+        'intervalMs': 1000,
+        'targets': [{'target': 'SELECT timestamp, name, value FROM t', 'type': 'timeserie', 'aggregation': 'none'}]
+    })
+
+    client = httpclient.AsyncHTTPClient(force_instance=True, max_clients=requests)
+    # every request is served at once, whatever ADMISSION_SLOTS is, to measure the driver calls alone
+    with mock.patch('handlers.QueryHandler.Client.get_client', return_value=session), \
+            mock.patch('handlers.BaseQueryHandler.admission', None):
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            client.fetch(
+                f'http://localhost:{port}/query',
+                method='POST',
+                body=body,
+                headers={'Content-Type': 'application/json'},
+                request_timeout=600
+            ) for _ in range(requests)
+        ))
+        duration = time.perf_counter() - start
+
+    client.close()
+    server.stop()
+    return duration
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+
+    def pages_factory(*_):
+        return [ROWS]
+
+    for name, session in (
+        ('blocking execute', BlockingSession(pages_factory, latency=latency)),
+        ('awaited execute_async', FakeSession(pages_factory, latency=latency)),
+    ):
+        duration = asyncio.run(run(session, requests))
+        print(f'{name}: {requests} concurrent requests in {duration:.3f} s ({requests / duration:.1f} req/s)')
+
+
+if __name__ == '__main__':
+    main()
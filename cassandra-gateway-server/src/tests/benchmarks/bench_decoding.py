@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Rows decoded per second by the timeserie and table parsers, on synthetic result pages.
+
+The per-row attribute decoding used before columnar pages is kept here as a reference.
+
+Usage: SETTINGS_FILE=../settings.ini.default python -m tests.benchmarks.bench_decoding [rows] [page size]
+"""
+
+import gc
+import sys
+import time
+from collections import namedtuple
+from itertools import chain
+from tools.ResultPage import ResultPage
+from tools.TimeSeries import TableBuilder, TimeserieBuilder
+
+COLUMNS = ('timestamp', 'name', 'value')
+Row = namedtuple('Row', COLUMNS)
+
+
+def reference_timeserie(rows):
+    entries = {}
+    for row in rows:
+        if row.value is None:
+            continue
+        try:
+            value = float(row.value)
+        except (ValueError, TypeError):
+            value = str(row.value)
+        if row.name not in entries:
+            entries[row.name] = {'target': row.name, 'datapoints': []}
+        entries[row.name]['datapoints'].append([value, row.timestamp / 1000])
+    return list(entries.values())
+
+
+def reference_table(rows):
+    result = {'columns': [], 'rows': [], 'type': 'table'}
+    for row in rows:
+        if not result['columns']:
+            result['columns'] = [{'text': column, 'type': 'string'} for column in row._fields]
+        value_list = []
+        for column in list(row._fields):
+            value = getattr(row, column)
+            if column == 'timestamp':
+                value = int(value) / 1000
+            value_list.append(value)
+        result['rows'].append(value_list)
+    return [result]
+
+
+def make_pages(rows: int, page_size: int, series: int, value):
+    pages = []
+    for first in range(0, rows, page_size):
+        tuples = [
+            (1579034870000000 + i * 1000, f'serie {i % series}', value(i))
+            for i in range(first, min(first + page_size, rows))
+        ]
+        pages.append((ResultPage(COLUMNS, tuples), [Row(*row) for row in tuples]))
+    return pages
+
+
+def rate(parse, pages, rows: int, runs: int = 3):
+    best = None
+    for _ in range(runs):
+        gc.collect()
+        start = time.perf_counter()
+        parse(pages)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return rows / best
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    def columnar(builder_class, **kwargs):
+        def parse(pages):
+            builder = builder_class(**kwargs)
+            for page, _ in pages:
+                builder.add_rows(page)
+            return builder.results()
+        return parse
+
+    def reference(parser):
+        def parse(pages):
+            # the whole result was parsed at once
+            return parser(chain.from_iterable(namedtuples for _, namedtuples in pages))
+        return parse
+
+    for description, series, value, value_type in (
+        ('one serie, int values', 1, int, 'int'),
+        ('one serie, double values', 1, float, 'double'),
+        ('10 series, double values', 10, float, 'double'),
+    ):
+        pages = make_pages(rows, page_size, series, value)
+        # the server releases each page once parsed, keep the collector from scanning the prebuilt ones
+        gc.freeze()
+        print(f'{description}:')
+        print(f'  timeserie reference: {rate(reference(reference_timeserie), pages, rows):,.0f} rows/s')
+        print(f'  timeserie columnar:  '
+              f'{rate(columnar(TimeserieBuilder, value_type=value_type), pages, rows):,.0f} rows/s')
+        print(f'  table reference:     {rate(reference(reference_table), pages, rows):,.0f} rows/s')
+        print(f'  table columnar:      {rate(columnar(TableBuilder), pages, rows):,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
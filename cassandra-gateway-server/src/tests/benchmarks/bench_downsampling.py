@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Downsampling time of raw series, python versus numpy, and the size of the JSON answered with and without it.
+
+Usage: SETTINGS_FILE=../settings.ini.default python -m tests.benchmarks.bench_downsampling [points ...]
+"""
+
+import sys
+import json
+import math
+import time
+import random
+from tools import Downsampling
+from tools.Downsampling import downsample
+
+MAX_DATA_POINTS = 800  # a panel 800 pixels wide
+
+
+def measure(values: list, timestamps: list, mode: str):
+    start = time.perf_counter()
+    kept_values, kept_timestamps = downsample(values, timestamps, MAX_DATA_POINTS, mode)
+    elapsed = time.perf_counter() - start
+    return elapsed, len(json.dumps(list(map(list, zip(kept_values, kept_timestamps)))))
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [10 ** 4, 10 ** 5, 10 ** 6]
+
+    for size in sizes:
+        values = [math.sin(i / 1000) * 100 + random.random() for i in range(size)]
+        timestamps = [1579034870000 + i * 100.0 for i in range(size)]  # one point every 100 ms
+        _, raw_size = measure(values, timestamps, 'none')
+        for mode in ('lttb', 'minmax'):
+            vectorized, kept_size = measure(values, timestamps, mode)
+            numpy = Downsampling.numpy
+            Downsampling.numpy = None
+            try:
+                python, _ = measure(values, timestamps, mode)
+            finally:
+                Downsampling.numpy = numpy
+            print(f'{size} points, {mode}: python {python:.3f} s, numpy {vectorized:.3f} s, '
+                  f'JSON {raw_size / 1024:.0f} KiB -> {kept_size / 1024:.0f} KiB (x{raw_size / kept_size:.0f})')
+
+
+if __name__ == '__main__':
+    main()
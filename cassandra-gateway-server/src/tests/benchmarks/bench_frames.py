@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Encoding time and size of the /query answer: Grafana series versus data frames (JSON and Arrow, with pyarrow),
+uncompressed and with each installed content encoding.
+
+Usage: SETTINGS_FILE=../settings.ini.default python -m tests.benchmarks.bench_frames [points per serie ...]
+"""
+
+import sys
+import time
+import random
+from tools.Compression import COMPRESSORS
+from tools.Frames import ArrowStream, pyarrow, to_frame
+from tools.JsonEncoder import iter_encode_items
+
+SERIES = 4
+
+
+def encode_series(results: list):
+    return [b'[' + b''.join(iter_encode_items(results)) + b']']
+
+
+def encode_frames(results: list):
+    return [b'[' + b''.join(iter_encode_items([to_frame(result) for result in results])) + b']']
+
+
+def encode_arrow(results: list):
+    stream = ArrowStream()
+    return [stream.write(results), stream.close()]
+
+
+def measure(encoder, results: list):
+    start = time.process_time()
+    chunks = encoder(results)
+    encoded = time.process_time() - start
+
+    sizes = {'identity': (sum(map(len, chunks)), 0)}
+    for encoding, compressor_class in COMPRESSORS.items():
+        start = time.process_time()
+        compressor = compressor_class()
+        size = sum(len(compressor.compress(chunk, False)) for chunk in chunks) + len(compressor.compress(b'', True))
+        sizes[encoding] = (size, time.process_time() - start)
+    return encoded, sizes
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [10 ** 3, 10 ** 5]
+    encoders = {'series': encode_series, 'frames': encode_frames}
+    if pyarrow:
+        encoders['arrow'] = encode_arrow
+
+    for size in sizes:
+        results = [
+            {
+                'target': f'serie {serie}',
+                'refId': 'A',
+                # a point every second, the timestamps converted from microseconds
+                'datapoints': [[random.random() * 100, 1579034870000 + i * 1000.123] for i in range(size)]
+            } for serie in range(SERIES)
+        ]
+        _, reference = measure(encode_series, results)
+        for name, encoder in encoders.items():
+            encoded, compressed = measure(encoder, results)
+            print(f'{SERIES} x {size} points, {name}: encoded in {encoded:.3f} s CPU, ' + ', '.join(
+                f'{encoding} {length / 1024:.0f} KiB (x{reference["identity"][0] / length:.1f}, {cpu:.3f} s CPU)'
+                for encoding, (length, cpu) in compressed.items()
+            ))
+
+
+if __name__ == '__main__':
+    main()
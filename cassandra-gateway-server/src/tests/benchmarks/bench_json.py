@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Encoding time and peak memory of a large table answer, single JSON document versus chunked encoding.
+
+Usage: SETTINGS_FILE=../settings.ini.default python -m tests.benchmarks.bench_json [rows]
+"""
+
+import sys
+import time
+import tracemalloc
+from tornado.escape import json_encode
+from tools.JsonEncoder import iter_encode_items
+
+FLUSH_SIZE = 64 * 1024
+
+
+def single_document(results):
+    return len(json_encode(results).encode('utf-8'))
+
+
+def chunked(results):
+    # what is buffered by the handler before each flush
+    written = 0
+    buffered = []
+    for chunk in iter_encode_items(results):
+        buffered.append(chunk)
+        if sum(len(part) for part in buffered) >= FLUSH_SIZE:
+            written += sum(len(part) for part in buffered)
+            buffered = []
+    return written + sum(len(part) for part in buffered) + 2
+
+
+def measure(encode, results):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = encode(results)
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, duration, peak
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    results = [{
+        'columns': [{'text': column, 'type': 'string'} for column in ('timestamp', 'name', 'value')],
+        'rows': [[1579034870493.109 + i, f'serie {i % 50}', i * 0.001] for i in range(rows)],
+        'type': 'table'
+    }]
+
+    for name, encode in (('single document', single_document), ('chunked', chunked)):
+        size, duration, peak = measure(encode, results)
+        print(f'{name}: {size / 2 ** 20:.1f} MiB encoded in {duration:.3f} s, '
+              f'encoding peak memory {peak / 2 ** 20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
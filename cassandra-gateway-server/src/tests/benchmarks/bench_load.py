@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Load test of the gateway: the application of app.py serves concurrent /query and /annotations requests,
+its cassandra session answers synthetic time series after a configurable latency, no cassandra cluster is needed.
+
+The gateway runs in a child process, so its CPU time and peak RSS are measured apart from the load generator.
+Requests are sent by `--concurrency` clients, each one sending its next request once answered,
+for `--warm-up` seconds left out of the measures, then for `--duration` seconds.
+
+The report is a JSON document: requests/s, latency percentiles in milliseconds, CPU time of the gateway per row read
+from cassandra and its peak RSS. With `--output`, it is appended as a line to a file, to track them over time.
+
+Usage: SETTINGS_FILE=../settings.ini.default python -m tests.benchmarks.bench_load [--concurrency 16]
+       [--duration 10] [--rows 10000] [--page-size 5000] [--latency 0.002] [--annotations 0.1] [--output load.jsonl]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import argparse
+import resource
+import subprocess
+from datetime import datetime, timezone
+from unittest import mock
+from tornado import httpclient, netutil
+
+# time range of every request, the synthetic series are spread over it
+RANGE = {'from': '2020-01-14T20:00:00.000Z', 'to': '2020-01-14T21:00:00.000Z'}
+RANGE_MICROSECONDS = (1579032000 * 10 ** 6, 1579035600 * 10 ** 6)
+
+
+def parse_args(argv: list):
+    parser = argparse.ArgumentParser(description='Load test of the gateway against a synthetic cassandra session')
+    parser.add_argument('--concurrency', type=int, default=16, help='clients sending requests at once')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of measured load')
+    parser.add_argument('--warm-up', type=float, default=2, help='seconds of load before measuring')
+    parser.add_argument('--rows', type=int, default=10000, help='rows answered to each time series query')
+    parser.add_argument('--page-size', type=int, default=5000, help='rows per result page')
+    parser.add_argument('--series', type=int, default=4, help='series of the rows of a query')
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds before each result page')
+    parser.add_argument('--annotation-rows', type=int, default=100, help='rows answered to each annotation query')
+    parser.add_argument('--annotations', type=float, default=0.1, help='share of /annotations requests')
+    parser.add_argument('--queries', type=int, default=64, help='distinct queries, identical ones may be coalesced')
+    parser.add_argument('--aggregation', default='average', help='aggregation of the targets')
+    parser.add_argument('--interval-ms', type=int, default=10000, help='intervalMs of the /query requests')
+    parser.add_argument('--max-data-points', type=int, default=800, help='maxDataPoints of the /query requests')
+    parser.add_argument('--format', default=None, help='answer format of the /query requests: frames')
+    parser.add_argument('--no-compression', action='store_true', help='do not accept compressed answers')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the request mix')
+    parser.add_argument('--label', default='', help='label of the run, in the report')
+    parser.add_argument('--output', default=None, help='file the report is appended to, as a JSON line')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def usage():
+    """
+    :return: CPU seconds and peak RSS in KiB of this process
+    """
+    rusage = resource.getrusage(resource.RUSAGE_SELF)
+    return rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss
+
+
+def serve(args):
+    """
+    Child process: serve the gateway application, the cassandra session being synthetic.
+
+    Writes JSON lines on its standard output: the port once listening, the baseline of its measures on SIGUSR1,
+    then its measures once drained on SIGTERM.
+    """
+    import app
+    from handlers.BaseHandler import BaseHandler
+    from tests.fake_cassandra import SyntheticSession
+    from tools import server
+    from tools.CassandraClient import Client
+
+    session = SyntheticSession(
+        args.rows, args.page_size, args.series, args.latency, RANGE_MICROSECONDS, args.annotation_rows
+    )
+    baseline = {}
+
+    def report(**values):
+        print(json.dumps(values), flush=True)
+
+    def measure():
+        cpu, peak_rss = usage()
+        return {'cpu': cpu, 'peak_rss_kib': peak_rss, 'rows': session.rows_read, 'queries': session.queries}
+
+    def start_measures(*_):
+        baseline.update(measure())
+        report(**baseline)
+
+    def stop():
+        current = measure()
+        report(**{name: current[name] - baseline.get(name, 0) for name in ('cpu', 'rows', 'queries')},
+               peak_rss_kib=current['peak_rss_kib'])
+
+    signal.signal(signal.SIGUSR1, start_measures)
+    with mock.patch.object(Client, 'get_client', return_value=session):
+        sockets = netutil.bind_sockets(0, '127.0.0.1')
+        report(port=sockets[0].getsockname()[1])
+        server._serve(app.make_app(), sockets, time.monotonic(), in_flight=lambda: BaseHandler.requests_in_flight,
+                      on_stop=stop)
+
+
+def make_request(args, rng: random.Random, index: int):
+    """
+    :return: the endpoint and the body of a request
+    """
+    if rng.random() < args.annotations:
+        return 'annotations', {
+            'range': RANGE,
+            'annotation': {
+                'name': 'deployments',
+                'query': 'SELECT timestamp, title, tags, text FROM events '
+                         'WHERE timestamp > $startTime AND timestamp < $endTime'
+            }
+        }
+
+    body = {
+        'range': RANGE,
+        'intervalMs': args.interval_ms,
+        'maxDataPoints': args.max_data_points,
+        'targets': [{
+            'refId': 'A',
+            'target': f"SELECT timestamp, name, value FROM metrics WHERE name = 'query {index % args.queries}' "
+                      'AND timestamp > $startTime AND timestamp < $endTime',
+            'type': 'timeserie',
+            'aggregation': args.aggregation
+        }]
+    }
+    if args.format:
+        body['format'] = args.format
+    return 'query', body
+
+
+def percentile(values: list, rank: float):
+    """
+    :param values: sorted values
+    :param rank: from 0 to 100
+    :return: the nearest-rank percentile, None without values
+    """
+    if not values:
+        return None
+    return values[max(0, min(len(values) - 1, int(round(rank / 100 * len(values) + 0.5)) - 1))]
+
+
+def summarize(samples: list, duration: float):
+    """
+    :param samples: (status code, seconds, answer bytes) of the requests
+    :param duration: seconds of load
+    :return: the throughput and latency summary of the requests
+    """
+    latencies = sorted(seconds * 1000 for _, seconds, _ in samples)
+    codes = {}
+    for code, _, _ in samples:
+        codes[str(code)] = codes.get(str(code), 0) + 1
+    return {
+        'requests': len(samples),
+        'errors': sum(count for code, count in codes.items() if code != '200'),
+        'codes': codes,
+        'requests_per_second': len(samples) / duration if duration else None,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else None,
+        },
+        'response_bytes': sum(size for _, _, size in samples),
+    }
+
+
+async def load(args, port: int, seconds: float):
+    """
+    :return: the samples of each endpoint, (status code, seconds, answer bytes) of each request
+    """
+    client = httpclient.AsyncHTTPClient(force_instance=True, max_clients=args.concurrency)
+    rng = random.Random(args.seed)
+    samples = {'query': [], 'annotations': []}
+    deadline = time.perf_counter() + seconds
+    counter = iter(range(sys.maxsize))
+
+    async def run_client():
+        while time.perf_counter() < deadline:
+            endpoint, body = make_request(args, rng, next(counter))
+            started = time.perf_counter()
+            try:
+                response = await client.fetch(
+                    f'http://127.0.0.1:{port}/{endpoint}',
+                    method='POST',
+                    body=json.dumps(body),
+                    headers={'Content-Type': 'application/json'},
+                    decompress_response=not args.no_compression,
+                    request_timeout=120,
+                    raise_error=False
+                )
+                code, size = response.code, len(response.body or b'')
+            except (OSError, httpclient.HTTPClientError):
+                code, size = 599, 0
+            samples[endpoint].append((code, time.perf_counter() - started, size))
+
+    await asyncio.gather(*(run_client() for _ in range(args.concurrency)))
+    client.close()
+    return samples
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    if args.serve:
+        serve(args)
+        return
+
+    child = subprocess.Popen(
+        [sys.executable, '-m', 'tests.benchmarks.bench_load', '--serve'] + sys.argv[1:],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    )
+    try:
+        port = json.loads(child.stdout.readline())['port']
+        if args.warm_up:
+            asyncio.run(load(args, port, args.warm_up))
+
+        child.send_signal(signal.SIGUSR1)
+        json.loads(child.stdout.readline())
+        started = time.perf_counter()
+        samples = asyncio.run(load(args, port, args.duration))
+        duration = time.perf_counter() - started
+
+        child.send_signal(signal.SIGTERM)
+        measures = json.loads(child.stdout.readline())
+        child.wait(timeout=60)
+    finally:
+        if child.poll() is None:
+            child.kill()
+
+    configuration = {
+        name: value for name, value in vars(args).items() if name not in ('output', 'label', 'serve')
+    }
+    report = {
+        'label': args.label,
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'configuration': configuration,
+        'duration_seconds': duration,
+        **summarize(samples['query'] + samples['annotations'], duration),
+        'endpoints': {endpoint: summarize(endpoint_samples, duration)
+                      for endpoint, endpoint_samples in samples.items()},
+        'gateway': {
+            'cpu_seconds': measures['cpu'],
+            'cpu_utilization': measures['cpu'] / duration,
+            'cassandra_queries': measures['queries'],
+            'rows': measures['rows'],
+            'cpu_microseconds_per_row': measures['cpu'] / measures['rows'] * 10 ** 6 if measures['rows'] else None,
+            'peak_rss_mib': measures['peak_rss_kib'] / 1024,
+        },
+    }
+
+    document = json.dumps(report)
+    if args.output:
+        with open(args.output, 'a') as output:
+            output.write(document + '\n')
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
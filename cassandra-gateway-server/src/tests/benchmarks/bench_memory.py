@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Peak memory of an aggregated timeserie query, whole result versus page by page consumption.
+
+A fake session builds synthetic pages on demand, no cassandra cluster is needed.
+
+Usage: SETTINGS_FILE=../settings.ini.default python -m tests.benchmarks.bench_memory [rows] [page size]
+"""
+
+import sys
+import asyncio
+import tracemalloc
+from collections import namedtuple
+from handlers.QueryHandler import QueryHandler
+from tools.CassandraClient import execute_async, iterate_pages
+from tools.TimeSeries import IntervalAggregator, TimeserieBuilder
+from tests.fake_cassandra import FakeSession
+
+Row = namedtuple('Row', ['timestamp', 'name', 'value'])
+
+START = 1579034870000000  # in microseconds
+INTERVAL_MS = 60000
+
+
+class SyntheticPages:
+    """
+    Pages of one sample per second, built when accessed.
+    """
+
+    def __init__(self, rows: int, page_size: int):
+        self.rows = rows
+        self.page_size = page_size
+
+    def __len__(self):
+        return (self.rows + self.page_size - 1) // self.page_size
+
+    def __getitem__(self, index):
+        first = index * self.page_size
+        last = min(first + self.page_size, self.rows)
+        return [Row(timestamp=START + i * 1000000, name='serie', value=i % 100) for i in range(first, last)]
+
+
+async def whole_result(session):
+    rows = await execute_async(session, 'SELECT')
+    results = []
+    for result in QueryHandler._parse_results_as_timeserie(rows):
+        aggregator = IntervalAggregator('average', INTERVAL_MS)
+        for (value, timestamp) in result['datapoints']:
+            aggregator.add(value, timestamp)
+        results.append({'target': result['target'], 'datapoints': aggregator.finish()})
+    return results
+
+
+async def page_by_page(session):
+    builder = TimeserieBuilder('average', INTERVAL_MS)
+    async for page in iterate_pages(session, 'SELECT'):
+        builder.add_rows(page)
+    return builder.results()
+
+
+def measure(consume, rows: int, page_size: int):
+    session = FakeSession(lambda *_: SyntheticPages(rows, page_size))
+    tracemalloc.start()
+    results = asyncio.run(consume(session))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, len(results[0]['datapoints'])
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    for name, consume in (('whole result', whole_result), ('page by page', page_by_page)):
+        peak, points = measure(consume, rows, page_size)
+        print(f'{name}: {rows} rows -> {points} points, peak memory {peak / 2 ** 20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
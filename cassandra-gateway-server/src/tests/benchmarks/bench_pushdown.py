@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Rows shipped to the gateway and answer time of an averaged query, aggregated by the gateway versus by cassandra.
+
+Cassandra is faked: every page, or interval answer, costs a fixed latency.
+
+Usage: SETTINGS_FILE=../settings.ini.default python -m tests.benchmarks.bench_pushdown [hours] [latency in ms]
+"""
+
+import sys
+import time
+import asyncio
+from tests.fake_cassandra import FakeSession
+from tools.CassandraClient import execute_async, iterate_pages
+from tools.Pushdown import plan_pushdown
+from tools.ResultPage import ResultPage
+from tools.TimeSeries import TimeserieBuilder
+
+SERIES = 10
+PAGE_SIZE = 5000
+INTERVAL_MS = 60000
+PARALLEL_QUERIES = 16
+
+QUERY = 'SELECT timestamp, name, value FROM value WHERE serial = 1 AND timestamp > $startTime AND timestamp < $endTime'
+
+
+def make_session(seconds: int, latency: float):
+    # one point per second and serie
+    def pages(query, parameters):
+        start, end = parameters
+        first, last = start // 1000000, -(-end // 1000000)
+        if query.startswith('SELECT name'):
+            count = last - first
+            return [[(f'serie {serie}', float(count), count) for serie in range(SERIES)]]
+        rows = [
+            (second * 1000000, f'serie {serie}', 1.0)
+            for second in range(first, min(last, seconds)) for serie in range(SERIES)
+        ]
+        return [ResultPage(('timestamp', 'name', 'value'), rows[i:i + PAGE_SIZE])
+                for i in range(0, len(rows), PAGE_SIZE)]
+
+    return FakeSession(pages, latency=latency)
+
+
+async def by_gateway(session, end_time: int):
+    builder = TimeserieBuilder('average', INTERVAL_MS, value_type='double')
+    rows = 0
+    async for page in iterate_pages(session, 'raw query', [0, end_time]):
+        rows += len(page)
+        builder.add_rows(page)
+    builder.results()
+    return rows
+
+
+async def by_cassandra(session, end_time: int):
+    table = session.add_table(
+        'metrics', 'value',
+        partition_key=[('serial', 'int'), ('date', 'text')],
+        clustering_key=[('name', 'text'), ('timestamp', 'timestamp')],
+        columns=[('value', 'double')]
+    )
+    plan = plan_pushdown(QUERY, 'average', INTERVAL_MS, table, 'double')
+    semaphore = asyncio.Semaphore(PARALLEL_QUERIES)
+
+    async def query_interval(interval_start, interval_end):
+        async with semaphore:
+            return interval_start, await execute_async(session, plan.query, [interval_start, interval_end])
+
+    answers = await asyncio.gather(*(query_interval(*interval) for interval in plan.intervals(0, end_time, 10 ** 6)))
+    plan.results(answers)
+    return sum(len(rows) for _, rows in answers)
+
+
+def main():
+    hours = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.002
+    seconds = hours * 3600
+    session = make_session(seconds, latency)
+
+    for name, query in (('aggregated by the gateway', by_gateway), ('aggregated by cassandra', by_cassandra)):
+        start = time.perf_counter()
+        rows = asyncio.run(query(session, seconds * 1000000))
+        print(f'{name}: {rows:,} rows shipped, {time.perf_counter() - start:.3f} s')
+
+
+if __name__ == '__main__':
+    main()
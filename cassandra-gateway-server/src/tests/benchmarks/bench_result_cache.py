@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Rows read from cassandra by an auto-refreshed dashboard, with and without the result cache.
+
+A 6 hours time range, with one point per second for 10 series, is refreshed every 10 seconds.
+
+Usage: SETTINGS_FILE=../settings.ini.default python -m tests.benchmarks.bench_result_cache [refreshes]
+"""
+
+import sys
+import time
+from tools.ResultCache import MemoryBackend, ResultCache
+from tools.ResultPage import ResultPage
+from tools.TimeSeries import TimeserieBuilder
+
+SERIES = 10
+RANGE = 6 * 3600  # in seconds
+REFRESH = 10  # in seconds
+INTERVAL_MS = 30000
+HORIZON_MS = 60000
+COLUMNS = ('timestamp', 'name', 'value')
+
+
+def query(start_time: int, end_time: int):
+    # one point per second and serie, timestamps in microseconds
+    rows = [
+        (second * 1000000, f'serie {serie}', 1.0)
+        for second in range(start_time // 1000000 + 1, -(-end_time // 1000000)) for serie in range(SERIES)
+    ]
+    builder = TimeserieBuilder('average', INTERVAL_MS)
+    builder.add_rows(ResultPage(COLUMNS, rows))
+    return builder.results(), len(rows)
+
+
+def main():
+    refreshes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    cache = ResultCache(MemoryBackend(64 * 2 ** 20), HORIZON_MS)
+    key = ResultCache.make_key(None, 'SELECT timestamp, name, value FROM value', 'average', INTERVAL_MS)
+    now = 1579034870
+
+    uncached_rows = cached_rows = 0
+    uncached_time = cached_time = 0
+    for refresh in range(refreshes):
+        end_time = (now + refresh * REFRESH) * 1000000
+        start_time = end_time - RANGE * 1000000
+
+        start = time.perf_counter()
+        uncached_rows += query(start_time, end_time)[1]
+        uncached_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        cached = cache.lookup(key, start_time, end_time, INTERVAL_MS)
+        edge_series = []
+        for edge in ResultCache.edges(cached, start_time, end_time, INTERVAL_MS):
+            results, rows = query(*edge)
+            edge_series.append(results)
+            cached_rows += rows
+        series = ResultCache.merge(cached, edge_series, INTERVAL_MS)
+        cache.store(key, series, start_time, end_time, INTERVAL_MS, end_time / 1000000)
+        cached_time += time.perf_counter() - start
+
+    print(f'{refreshes} refreshes without cache: {uncached_rows:,} rows read, {uncached_time:.2f} s')
+    print(f'{refreshes} refreshes with cache: {cached_rows:,} rows read, {cached_time:.2f} s '
+          f'({100 - 100 * cached_rows / uncached_rows:.1f}% less rows), '
+          f'cache size {cache.backend.size / 2 ** 20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Query latency percentiles with a slow node, for the execution profiles built from the [CASSANDRA] settings.
+
+The cluster is simulated: six nodes, every partition has three replicas, one node answers slowly.
+Queries go through the load balancing and speculative execution policies of the gateway execution profile,
+the same way the driver uses them: the first host of the query plan coordinates the query, a coordinator
+which is not a replica forwards it to one, and each speculative execution sends it to the next host of
+the plan. The first answer wins.
+
+Usage: SETTINGS_FILE=../settings.ini.default python -m tests.benchmarks.bench_routing [queries] [slow node ms]
+"""
+
+import os
+import sys
+import random
+import asyncio
+import types
+from cassandra.pool import Host
+from cassandra.policies import SimpleConvictionPolicy
+from tools import CassandraClient
+
+NODES = 6
+REPLICATION_FACTOR = 3
+SERVICE_TIME = 0.001  # in seconds, plus an exponential jitter of the same mean
+PARALLEL_QUERIES = 32
+
+
+class SimulatedCluster:
+
+    def __init__(self, slow_latency: float):
+        self.hosts = [Host(f'10.0.0.{node}', SimpleConvictionPolicy, 'dc1', 'rack1') for node in range(NODES)]
+        for host in self.hosts:
+            host.set_up()
+        self.slow_host = self.hosts[0]
+        self.slow_latency = slow_latency
+        self.metadata = types.SimpleNamespace(get_replicas=self.get_replicas)
+
+    def get_replicas(self, _, routing_key: bytes):
+        first = routing_key[0] % NODES
+        return [self.hosts[(first + replica) % NODES] for replica in range(REPLICATION_FACTOR)]
+
+    def service_time(self, host):
+        latency = SERVICE_TIME + random.expovariate(1 / SERVICE_TIME)
+        return latency + self.slow_latency if host is self.slow_host else latency
+
+    def answer_time(self, coordinator, replicas: list):
+        if coordinator in replicas:
+            return self.service_time(coordinator)
+        return self.service_time(coordinator) + self.service_time(random.choice(replicas))
+
+
+async def execute(cluster: SimulatedCluster, profile, statement):
+    loop = asyncio.get_event_loop()
+    answer = loop.create_future()
+    replicas = cluster.get_replicas(None, statement.routing_key)
+    query_plan = profile.load_balancing_policy.make_query_plan('metrics', statement)
+    speculative_plan = None
+    if profile.speculative_execution_policy:
+        speculative_plan = profile.speculative_execution_policy.new_plan('metrics', statement)
+    timers = []
+
+    def send():
+        host = next(query_plan, None)
+        if host is None or answer.done():
+            return
+        timers.append(loop.call_later(
+            cluster.answer_time(host, replicas),
+            lambda: answer.done() or answer.set_result(host)
+        ))
+        delay = speculative_plan.next_execution(host) if speculative_plan else -1
+        if delay >= 0:
+            timers.append(loop.call_later(delay, send))
+
+    started = loop.time()
+    send()
+    await answer
+    for timer in timers:
+        timer.cancel()
+    return loop.time() - started
+
+
+async def run(profile, queries: int, slow_latency: float):
+    random.seed(0)
+    cluster = SimulatedCluster(slow_latency)
+    profile.load_balancing_policy.populate(cluster, cluster.hosts)
+    semaphore = asyncio.Semaphore(PARALLEL_QUERIES)
+
+    async def query():
+        statement = types.SimpleNamespace(keyspace='metrics', routing_key=os.urandom(8), is_idempotent=True)
+        async with semaphore:
+            return await execute(cluster, profile, statement)
+
+    return sorted(await asyncio.gather(*(query() for _ in range(queries))))
+
+
+def main():
+    queries = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    slow_latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+
+    CassandraClient.cassandra_local_datacenter = 'dc1'
+    profiles = (
+        ('round robin', False, 0),
+        ('token aware', True, 0),
+        ('token aware, speculative execution after 5 ms', True, 0.005),
+    )
+    for name, token_aware, speculative_delay in profiles:
+        CassandraClient.cassandra_token_aware = token_aware
+        CassandraClient.cassandra_speculative_delay = speculative_delay
+        latencies = asyncio.run(run(CassandraClient.make_execution_profile(), queries, slow_latency))
+        p50, p95, p99 = (latencies[int(len(latencies) * p)] * 1000 for p in (0.5, 0.95, 0.99))
+        print(f'{name}: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Per-request latency with a new session per request versus the long-lived session.
+
+Needs a reachable cassandra cluster, configured by the settings file.
+
+Usage: SETTINGS_FILE=../settings.ini python -m tests.benchmarks.bench_sessions [requests]
+"""
+
+import sys
+import time
+import statistics
+from tools.CassandraClient import Client, cassandra_keyspace
+
+QUERY = 'SELECT release_version FROM system.local'
+
+
+def measure(get_session, requests: int):
+    durations = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        session = get_session()
+        session.execute(QUERY)
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def report(name: str, durations: list):
+    durations = sorted(durations)
+    p99 = durations[int(len(durations) * 0.99) - 1]
+    print(f'{name}: mean {statistics.mean(durations):.2f} ms, p50 {statistics.median(durations):.2f} ms, '
+          f'p99 {p99:.2f} ms')
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    Client.connect()  # open the cluster connection once, outside of the measurements
+    cluster = Client.cassandra_connection
+
+    sessions = []
+
+    def new_session():
+        # what was done before: a new session for each request
+        session = cluster.connect(cassandra_keyspace)
+        sessions.append(session)
+        return session
+
+    report('session per request', measure(new_session, requests))
+    report('long-lived session', measure(Client.connect, requests))
+
+    for session in sessions:
+        session.shutdown()
+    Client.close_connection()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Hit rate and memory of forked workers using one result cache each versus a single shared cache.
+
+Every worker serves requests for dashboard panels picked with a long tail distribution, a miss builds
+the aggregated series of the panel and stores them. Each cache gets the same memory budget.
+Memory is the proportional set size (PSS) of the workers summed up, shared pages are counted once.
+
+Usage: SETTINGS_FILE=../settings.ini.default python -m tests.benchmarks.bench_shared_cache [workers] [requests]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+from tools.ResultCache import CacheEntry, MemoryBackend
+from tools.SharedCache import SharedMemoryBackend
+
+PANELS = 2000
+SERIES = 10
+POINTS = 720  # 6 hours by 30 seconds intervals
+BUDGET = 64 * 2 ** 20
+
+
+def panel_entry(panel: int):
+    return CacheEntry(0, POINTS, {
+        f'panel {panel} serie {serie}': [[random.random(), interval * 30000] for interval in range(POINTS)]
+        for serie in range(SERIES)
+    })
+
+
+def proportional_set_size():
+    try:
+        with open('/proc/self/smaps_rollup') as smaps:
+            for line in smaps:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def serve(backend, requests: int, seed: int):
+    random.seed(seed)
+    weights = [1 / (panel + 1) for panel in range(PANELS)]
+    hits = 0
+    for panel in random.choices(range(PANELS), weights, k=requests):
+        key = ('metrics', f'SELECT panel {panel}', 'average', 30000)
+        if backend.get(key) is not None:
+            hits += 1
+            continue
+        entry = panel_entry(panel)
+        backend.put(key, entry, entry.size)
+    return hits
+
+
+def run(make_backend, workers: int, requests: int):
+    shared = make_backend()
+    children = []
+    for worker in range(workers):
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.close(read_end)
+            backend = shared or make_backend(per_process=True)
+            hits = serve(backend, requests, worker)
+            with os.fdopen(write_end, 'w') as pipe:
+                json.dump({'hits': hits, 'pss': proportional_set_size()}, pipe)
+            os._exit(0)
+        os.close(write_end)
+        children.append((pid, read_end))
+
+    hits = pss = 0
+    for pid, read_end in children:
+        with os.fdopen(read_end) as pipe:
+            report = json.load(pipe)
+        os.waitpid(pid, 0)
+        hits += report['hits']
+        pss += report['pss']
+    return hits / (workers * requests), pss
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    def per_process(per_process=False):
+        return MemoryBackend(BUDGET) if per_process else None
+
+    def shared(per_process=False):
+        return SharedMemoryBackend(BUDGET)
+
+    for name, make_backend in (('one cache per worker', per_process), ('shared cache', shared)):
+        start = time.perf_counter()
+        hit_rate, pss = run(make_backend, workers, requests)
+        print(f'{name}: {workers} workers, hit rate {hit_rate * 100:.1f}%, '
+              f'workers PSS {pss / 2 ** 20:.0f} MiB, {time.perf_counter() - start:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+In-process stand-in of the cassandra driver session, used by tests and benchmarks.
+
+Results are delivered from timer threads, the same way the driver calls back from its IO thread.
+"""
+
+import time
+import types
+import threading
+from cassandra.metadata import ColumnMetadata, TableMetadata
+from tools.ResultPage import ResultPage
+
+
+class FakeResponseFuture:
+    """
+    Mimic the paging and callback behaviour of cassandra.cluster.ResponseFuture.
+    """
+
+    def __init__(self, pages, latency: float = 0, error: Exception = None):
+        self.pages = pages or [[]]  # any sequence, pages can be built lazily
+        self.latency = latency
+        self.error = error
+        self.page_index = 0
+        self.fetched_pages = 0
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._errbacks = []
+        self._result = None
+        self._exception = None
+        self._done = False
+        self._fetch()
+
+    @property
+    def has_more_pages(self):
+        return self.page_index < len(self.pages) - 1
+
+    def _fetch(self):
+        if self.latency:
+            timer = threading.Timer(self.latency, self._deliver)
+            timer.daemon = True
+            timer.start()
+        else:
+            self._deliver()
+
+    def _deliver(self):
+        with self._lock:
+            self.fetched_pages += 1
+            if self.error:
+                self._exception = self.error
+                callbacks = list(self._errbacks)
+                value = self.error
+            else:
+                self._result = self.pages[self.page_index]
+                callbacks = list(self._callbacks)
+                value = self._result
+            self._done = True
+        for callback in callbacks:
+            callback(value)
+
+    def add_callbacks(self, callback, errback):
+        with self._lock:
+            self._callbacks.append(callback)
+            self._errbacks.append(errback)
+            done = self._done
+        if done:
+            if self._exception:
+                errback(self._exception)
+            else:
+                callback(self._result)
+
+    def clear_callbacks(self):
+        with self._lock:
+            self._callbacks = []
+            self._errbacks = []
+
+    def start_fetching_next_page(self):
+        with self._lock:
+            self.page_index += 1
+            self._done = False
+            self._result = None
+        self._fetch()
+
+    def result(self):
+        rows = []
+        while True:
+            while not self._done:
+                time.sleep(0.0001)
+            if self._exception:
+                raise self._exception
+            rows.extend(self._result)
+            if not self.has_more_pages:
+                return rows
+            self.start_fetching_next_page()
+
+
+class FakePreparedStatement:
+    """
+    Mimic cassandra.query.PreparedStatement.
+    """
+
+    def __init__(self, query: str, column_metadata: list = None, result_metadata: list = None):
+        self.query_string = query
+        self.column_metadata = column_metadata or []
+        self.result_metadata = result_metadata or []
+        self.is_idempotent = False
+
+
+class FakeSession:
+    """
+    Mimic cassandra.cluster.Session, every query answers with the pages built by `pages_factory`.
+
+    `pages_factory` is called with the query string and the parameters of each execution.
+    """
+
+    def __init__(self, pages_factory=None, latency: float = 0, error: Exception = None, keyspace: str = None):
+        self.pages_factory = pages_factory or (lambda query, parameters: [[]])
+        self.latency = latency
+        self.error = error
+        self.keyspace = keyspace
+        self.cluster = types.SimpleNamespace(metadata=types.SimpleNamespace(keyspaces={}))
+        self.is_shutdown = False
+        self.executed = []
+        self.prepared = []
+
+    def prepare(self, query):
+        self.prepared.append(query)
+        return FakePreparedStatement(query)
+
+    def execute_async(self, query, parameters=None):
+        query = getattr(query, 'query_string', query)
+        self.executed.append((query, parameters))
+        return FakeResponseFuture(self.pages_factory(query, parameters), latency=self.latency, error=self.error)
+
+    def execute(self, query, parameters=None):
+        return self.execute_async(query, parameters).result()
+
+    def add_table(self, keyspace: str, name: str, partition_key: list, clustering_key: list = (), columns: list = ()):
+        """
+        Describe a table in the cluster metadata, columns are given as (name, CQL type).
+        """
+        table = TableMetadata(keyspace, name)
+        for kind, definitions in (('partition_key', partition_key), ('clustering_key', clustering_key),
+                                  (None, columns)):
+            for column_name, cql_type in definitions:
+                column = ColumnMetadata(table, column_name, cql_type)
+                table.columns[column_name] = column
+                if kind:
+                    getattr(table, kind).append(column)
+        keyspaces = self.cluster.metadata.keyspaces
+        keyspaces.setdefault(keyspace, types.SimpleNamespace(tables={})).tables[name] = table
+        return table
+
+    def shutdown(self):
+        self.is_shutdown = True
+
+
+def paginate(column_names: tuple, rows: list, page_size: int):
+    """
+    :return: the rows split into result pages of `page_size` rows, at least one page
+    """
+    return [
+        ResultPage(column_names, rows[start:start + page_size]) for start in range(0, len(rows), page_size)
+    ] or [ResultPage(column_names, [])]
+
+
+class SyntheticSession(FakeSession):
+    """
+    Session answering synthetic time series, for load tests of the gateway.
+
+    Time series queries get `rows` rows of `series` series spread over `time_range`, in pages of `page_size` rows.
+    Annotation queries, selecting a `title` column, get `annotation_rows` annotations.
+    Pages are built once and shared by every query, their cost is not measured along with the gateway.
+    Executions are counted rather than recorded, the session can serve any number of queries.
+    """
+
+    def __init__(self, rows: int = 10000, page_size: int = 5000, series: int = 4, latency: float = 0,
+                 time_range: tuple = (0, 3600 * 10 ** 6), annotation_rows: int = 100):
+        """
+        :param time_range: start and end of the timestamps, in microseconds
+        """
+        super().__init__(self._pages, latency)
+        start, end = time_range
+        step = (end - start) / max(rows, 1)
+        self.series_pages = paginate(
+            ('timestamp', 'name', 'value'),
+            [(int(start + index * step), f'serie {index % series}', float(index % 1000)) for index in range(rows)],
+            page_size
+        )
+        step = (end - start) / max(annotation_rows, 1)
+        self.annotation_pages = paginate(
+            ('timestamp', 'title', 'tags', 'text'),
+            [
+                (int(start + index * step), f'deployment {index}', 'deployment,production', 'version deployed')
+                for index in range(annotation_rows)
+            ],
+            page_size
+        )
+        self.queries = 0
+        self.rows_read = 0
+
+    def _pages(self, query, _):
+        pages = self.annotation_pages if 'title' in query.lower() else self.series_pages
+        self.queries += 1
+        self.rows_read += sum(map(len, pages))
+        return pages
+
+    def execute_async(self, query, parameters=None):
+        query = getattr(query, 'query_string', query)
+        return FakeResponseFuture(self.pages_factory(query, parameters), latency=self.latency)
@@ -1,6 +1,12 @@
+import json
 import unittest
+from unittest import mock
+
+from cassandra import Unauthorized
+from tornado import httpclient, testing, web
 
 from handlers.AnnotationsHandler import AnnotationsHandler
+from tests.fake_cassandra import FakeSession
 
 from collections import namedtuple
 
@@ -35,3 +41,47 @@ class TestAnnotationsHandler(unittest.TestCase):
             self.assertEqual(raw_line.title, parsed_line['title'], msg='Title must be the same')
             self.assertEqual(raw_line.tags, parsed_line['tags'], msg='Title must be the same')
             self.assertEqual(raw_line.text, parsed_line['text'], msg='Title must be the same')
+
+
+class TestAnnotationsHandlerPost(testing.AsyncHTTPTestCase):
+
+    rows = TestAnnotationsHandler.rows
+
+    def get_app(self):
+        return web.Application([(r'/annotations', AnnotationsHandler)])
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('handlers.AnnotationsHandler.Client.get_client', return_value=FakeSession())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _post(self, pages):
+        async def timed_pages(*_):
+            for page in pages:
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+
+        body = {
+            'range': {'from': '1970-01-01T00:00:00.000Z', 'to': '1970-01-01T01:00:00.000Z'},
+            'annotation': {'name': ANNOTATION_NAME, 'query': 'SELECT timestamp, title, tags, text FROM events'}
+        }
+        with mock.patch.object(AnnotationsHandler, '_timed_pages', timed_pages):
+            return self.fetch('/annotations', method='POST', body=json.dumps(body),
+                              headers={'Content-Type': 'application/json'}, raise_error=False)
+
+    def test_unauthorized(self):
+        response = self._post([Unauthorized('not allowed')])
+
+        self.assertEqual(403, response.code, msg='403 when refused before any annotation was sent')
+
+    def test_failure_after_the_first_annotations(self):
+        with self.assertRaises(httpclient.HTTPClientError, msg='The truncated answer is not taken for a 200'):
+            self._post([self.rows, Unauthorized('not allowed')])
+
+    def test_annotations_are_answered(self):
+        response = self._post([self.rows[:1], self.rows[1:]])
+
+        self.assertEqual(200, response.code)
+        self.assertEqual(len(self.rows), len(json.loads(response.body)), msg='Annotations of every page')
@@ -0,0 +1,66 @@
+import json
+from unittest import mock
+
+from tornado import testing, web
+
+from handlers.BaseTagHandler import tag_index
+from handlers.SearchHandler import SearchHandler
+from handlers.TagKeysHandler import TagKeysHandler
+from handlers.TagValuesHandler import TagValuesHandler
+from tests.tools.test_TagIndex import make_session
+
+HEADERS = {'Content-Type': 'application/json'}
+
+
+class TestTagHandlers(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return web.Application([
+            (r'/tag-keys', TagKeysHandler),
+            (r'/tag-values', TagValuesHandler),
+            (r'/search', SearchHandler),
+        ])
+
+    def setUp(self):
+        super().setUp()
+        self.session = make_session()
+        for target in ('handlers.TagKeysHandler.Client.get_client', 'handlers.SearchHandler.Client.get_client',
+                       'tools.TagIndex.Client.get_client'):
+            patcher = mock.patch(target, return_value=self.session)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.multiple(tag_index, index={}, refresh_time=None, refreshing=None, refresher_pid=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, url: str, body: dict):
+        response = self.fetch(url, method='POST', body=json.dumps(body), headers=HEADERS)
+        self.assertEqual(200, response.code)
+        return json.loads(response.body)
+
+    def test_tag_keys(self):
+        keys = self.post('/tag-keys', {})
+
+        self.assertIn({'type': 'string', 'text': 'serial'}, keys)
+        self.assertIn({'type': 'number', 'text': 'id'}, keys)
+
+    def test_tag_values(self):
+        values = self.post('/tag-values', {'key': 'serial'})
+
+        self.assertEqual([{'text': 'sensor-1'}, {'text': 'sensor-2'}], values,
+                         msg='The first request waits for the index to be built')
+        executed = len(self.session.executed)
+        self.post('/tag-values', {'key': 'name'})
+        self.assertEqual(executed, len(self.session.executed), msg='Next requests are answered from the index')
+
+    def test_tag_values_without_key(self):
+        response = self.fetch('/tag-values', method='POST', body='{}', headers=HEADERS)
+
+        self.assertEqual(400, response.code)
+
+    def test_search(self):
+        self.assertEqual(['day', 'id', 'name', 'serial'], self.post('/search', {'target': ''}),
+                         msg='An empty target lists the indexed columns')
+        self.assertEqual(['oxygen', 'pressure'], self.post('/search', {'target': 'name'}),
+                         msg='A column gives its values')
+        self.assertEqual([], self.post('/search', {'target': 'unknown'}))
@@ -0,0 +1,41 @@
+import json
+from unittest import mock
+
+from tornado import testing, web
+
+from handlers.MetricsHandler import MetricsHandler
+from handlers.QueryHandler import QueryHandler
+from tests.fake_cassandra import FakeSession
+from tests.handlers.test_QueryHandler import cassandraRow
+
+
+class TestMetricsHandler(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return web.Application([(r'/query', QueryHandler), (r'/metrics', MetricsHandler)])
+
+    def setUp(self):
+        super().setUp()
+        session = FakeSession(lambda query, parameters: [[cassandraRow(timestamp=1000000, name='oxygen', value=1)]])
+        patcher = mock.patch('handlers.QueryHandler.Client.get_client', return_value=session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_query_metrics(self):
+        body = {
+            'range': {'from': '1970-01-01T00:00:00.000Z', 'to': '1970-01-01T01:00:00.000Z'},
+            'intervalMs': 1000,
+            'targets': [{'refId': 'A', 'target': 'SELECT metrics', 'type': 'table'}]
+        }
+        self.fetch('/query', method='POST', body=json.dumps(body), headers={'Content-Type': 'application/json'})
+
+        response = self.fetch('/metrics')
+
+        self.assertEqual(200, response.code)
+        self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+        exposition = response.body.decode()
+        self.assertIn('cassandra_gateway_responses_total{handler="query",code="200"}', exposition)
+        self.assertIn('cassandra_gateway_rows_count{handler="query",type="table",aggregation="other"}', exposition)
+        self.assertIn('cassandra_gateway_response_bytes_count{handler="query"}', exposition)
+        self.assertIn('cassandra_gateway_requests_in_flight{handler="metrics"} 1', exposition,
+                      msg='Only the metrics request is in flight')
@@ -1,6 +1,21 @@
+import json
+import time
+import types
+import asyncio
 import unittest
+from unittest import mock
 
+from cassandra import InvalidRequest, Unauthorized
+from tornado import httpclient, testing, web
+
+from handlers.HealthHandler import HealthHandler
 from handlers.QueryHandler import QueryHandler
+from tests.fake_cassandra import FakePreparedStatement, FakeSession
+from tools import Pushdown
+from tools.Admission import AdmissionControl
+from tools.Metrics import Metrics
+from tools.ResultCache import MemoryBackend, ResultCache
+from tools.ResultPage import ResultPage
 
 from collections import namedtuple
 
@@ -191,3 +206,417 @@ class TestAnnotationsHandler(unittest.TestCase):
             QueryHandler._aggregate_datapoint_changes(empty_values),
             msg='No entries when no values given'
         )
+
+
+class TestQueryHandlerPost(testing.AsyncHTTPTestCase):
+
+    rows = [
+        cassandraRow(timestamp=1000000, name='oxygen', value=1),
+        cassandraRow(timestamp=2000000, name='oxygen', value=2),
+    ]
+
+    def get_app(self):
+        return web.Application([(r'/query', QueryHandler)])
+
+    def setUp(self):
+        super().setUp()
+        self.session = FakeSession(self._pages, latency=0.001)
+        patcher = mock.patch('handlers.QueryHandler.Client.get_client', return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _pages(self, query, _):
+        if 'forbidden' in query:
+            raise Unauthorized('not allowed')
+        return [self.rows]
+
+    def _post(self, targets, **args):
+        body = {
+            'range': {'from': '1970-01-01T00:00:00.000Z', 'to': '1970-01-01T01:00:00.000Z'},
+            'intervalMs': 1000,
+            'targets': targets,
+            **args
+        }
+        return self.fetch(
+            '/query',
+            method='POST',
+            body=json.dumps(body),
+            headers={'Content-Type': 'application/json'}
+        )
+
+    def test_targets_keep_their_order(self):
+        targets = [
+            {'refId': ref_id, 'target': f'SELECT {ref_id}', 'type': 'timeserie', 'aggregation': 'none'}
+            for ref_id in 'ABCDEFGHIJ'
+        ]
+        response = self._post(targets)
+
+        self.assertEqual(200, response.code)
+        results = json.loads(response.body)
+        self.assertEqual(list('ABCDEFGHIJ'), [result['refId'] for result in results], msg='Results follow refId order')
+        self.assertEqual(len(targets), len(self.session.executed), msg='Every target is queried')
+
+    def test_failure_is_reported_per_target(self):
+        targets = [
+            {'refId': 'A', 'target': 'SELECT forbidden', 'type': 'timeserie', 'aggregation': 'none'},
+            {'refId': 'B', 'target': 'SELECT allowed', 'type': 'timeserie', 'aggregation': 'none'},
+        ]
+        response = self._post(targets)
+
+        self.assertEqual(200, response.code, msg='One failing target does not fail the whole request')
+        failed, succeeded = json.loads(response.body)
+        self.assertEqual('A', failed['refId'])
+        self.assertIn('error', failed, msg='The failing target carries its error')
+        self.assertEqual([[1.0, 1000.0], [2.0, 2000.0]], succeeded['datapoints'], msg='Other targets are answered')
+
+    def test_raw_series_are_downsampled_to_max_data_points(self):
+        self.rows = [cassandraRow(timestamp=i * 1000, name='oxygen', value=i % 17) for i in range(2000)]
+        targets = [
+            {'refId': 'A', 'target': 'SELECT lttb', 'type': 'timeserie', 'aggregation': 'none'},
+            {'refId': 'B', 'target': 'SELECT minmax', 'type': 'timeserie', 'aggregation': 'none',
+             'downsampling': 'minmax'},
+            {'refId': 'C', 'target': 'SELECT all', 'type': 'timeserie', 'aggregation': 'none', 'downsampling': 'none'},
+        ]
+        lttb, minmax, raw = json.loads(self._post(targets, maxDataPoints=100).body)
+
+        self.assertEqual(100, len(lttb['datapoints']), msg='LTTB by default')
+        self.assertLessEqual(len(minmax['datapoints']), 100)
+        self.assertEqual({0.0, 16.0}, {value for value, _ in minmax['datapoints'][1:-1]},
+                         msg='Every bucket keeps its lowest and highest values')
+        self.assertEqual(2000, len(raw['datapoints']), msg='Downsampling can be disabled per target')
+
+    def test_frames_format(self):
+        targets = [{'refId': 'A', 'target': 'SELECT frames', 'type': 'timeserie', 'aggregation': 'none'}]
+        response = self._post(targets, format='frames')
+
+        self.assertEqual(200, response.code)
+        frame, = json.loads(response.body)
+        self.assertEqual('oxygen', frame['schema']['name'])
+        self.assertEqual([[1000.0, 2000.0], [1.0, 2.0]], frame['data']['values'], msg='Datapoints are by columns')
+
+    def test_cached_intervals_are_not_queried_again(self):
+        request = 'SELECT cached WHERE timestamp > $startTime AND timestamp < $endTime'
+        targets = [{'refId': 'A', 'target': request, 'type': 'timeserie', 'aggregation': 'sum'}]
+        cache = ResultCache(MemoryBackend(2 ** 20), 0)
+        with mock.patch('handlers.QueryHandler.result_cache', cache):
+            first = self._post(targets)
+            second = self._post(targets)
+
+        self.assertEqual(json.loads(first.body), json.loads(second.body), msg='Cached intervals give the same results')
+        self.assertEqual(
+            [(0, 1000000)],
+            [(start, end) for _, (start, end) in self.session.executed[1:]],
+            msg='Only the edge before the first complete interval is queried again'
+        )
+
+    @testing.gen_test
+    async def test_concurrent_identical_queries_are_executed_once(self):
+        self.session.latency = 0.05
+        body = {
+            'range': {'from': '1970-01-01T00:00:00.000Z', 'to': '1970-01-01T01:00:00.000Z'},
+            'intervalMs': 1000,
+            'targets': [{'refId': 'A', 'target': 'SELECT shared', 'type': 'timeserie', 'aggregation': 'none'}]
+        }
+        responses = await asyncio.gather(*(
+            self.http_client.fetch(
+                self.get_url('/query'),
+                method='POST',
+                body=json.dumps(body),
+                headers={'Content-Type': 'application/json'}
+            ) for _ in range(5)
+        ))
+
+        self.assertEqual(1, len(self.session.executed), msg='The query is executed once')
+        self.assertEqual(1, len({response.body for response in responses}), msg='Every request gets the results')
+
+    def test_all_targets_unauthorized(self):
+        response = self._post([{'refId': 'A', 'target': 'SELECT forbidden', 'type': 'timeserie'}])
+
+        self.assertEqual(403, response.code, msg='403 when no target is authorized')
+
+    def test_partitions_are_queried_concurrently(self):
+        request = 'SELECT partitioned WHERE day IN $computedDates AND timestamp > $startTime'
+        self.session.pages_factory = lambda query, parameters: [[
+            cassandraRow(timestamp=int(parameters[0][-2:]) * 86400000000, name='oxygen', value=1)
+        ]]
+        body = {
+            'range': {'from': '1970-01-01T12:00:00.000Z', 'to': '1970-01-03T12:00:00.000Z'},
+            'intervalMs': 1000,
+            'targets': [{'refId': 'A', 'target': request, 'type': 'timeserie', 'aggregation': 'none'}]
+        }
+        response = self.fetch('/query', method='POST', body=json.dumps(body),
+                              headers={'Content-Type': 'application/json'})
+
+        self.assertEqual(
+            ['1970-01-01', '1970-01-02', '1970-01-03'],
+            [parameters[0] for _, parameters in self.session.executed],
+            msg='A query per daily partition'
+        )
+        self.assertIn('day = ?', self.session.executed[0][0])
+        self.assertEqual(
+            [[1.0, 86400000.0], [1.0, 172800000.0], [1.0, 259200000.0]],
+            json.loads(response.body)[0]['datapoints'],
+            msg='Partitions results are merged in time order'
+        )
+
+    def test_too_many_partitions(self):
+        partitioned = 'SELECT partitioned WHERE day IN $computedDates AND timestamp > $startTime'
+        targets = [
+            {'refId': 'A', 'target': partitioned, 'type': 'timeserie', 'aggregation': 'none'},
+            {'refId': 'B', 'target': 'SELECT allowed', 'type': 'timeserie', 'aggregation': 'none'},
+        ]
+        three_days = {'from': '1970-01-01T12:00:00.000Z', 'to': '1970-01-03T12:00:00.000Z'}
+        with mock.patch('handlers.BaseQueryHandler.partition_max_count', 2):
+            response = self._post(targets, range=three_days)
+            alone = self._post(targets[:1], range=three_days)
+
+        self.assertEqual(200, response.code)
+        refused, answered = json.loads(response.body)
+        self.assertIn('3 day partitions', refused['error'], msg='The target over the limit carries its error')
+        self.assertEqual(2, len(answered['datapoints']), msg='Other targets are answered')
+        self.assertEqual(['SELECT allowed'], [query for query, _ in self.session.executed], msg='No partition queried')
+        self.assertEqual(400, alone.code, msg='400 when every target covers too many partitions')
+
+    def test_adhoc_filters(self):
+        self.session.add_table(
+            None, 'data',
+            partition_key=[('serial', 'text')],
+            clustering_key=[('name', 'text'), ('timestamp', 'bigint')],
+            columns=[('value', 'double')]
+        )
+        self.session.pages_factory = lambda query, parameters: [[
+            cassandraRow(timestamp=1000000, name='oxygen', value=1),
+            cassandraRow(timestamp=2000000, name='oxygen', value=5),
+        ]]
+        body = {
+            'range': {'from': '1970-01-01T00:00:00.000Z', 'to': '1970-01-01T01:00:00.000Z'},
+            'intervalMs': 1000,
+            'targets': [{
+                'refId': 'A',
+                'target': "SELECT timestamp, name, value FROM data WHERE serial = 'a' AND timestamp > $startTime",
+                'type': 'timeserie',
+                'aggregation': 'none'
+            }],
+            'adhocFilters': [
+                {'key': 'name', 'operator': '=', 'value': 'oxygen'},
+                {'key': 'value', 'operator': '>', 'value': '2'},
+            ]
+        }
+        response = self.fetch('/query', method='POST', body=json.dumps(body),
+                              headers={'Content-Type': 'application/json'})
+
+        query, parameters = self.session.executed[0]
+        self.assertIn('AND name = ?', query, msg='The clustering column filter is bound into the query')
+        self.assertEqual([0, 'oxygen'], parameters, msg='Bound after the query macros')
+        self.assertEqual([[5.0, 2000.0]], json.loads(response.body)[0]['datapoints'],
+                         msg='The regular column filter is applied by the gateway')
+
+    @testing.gen_test
+    async def test_deadline_expired(self):
+        self.session.latency = 0.5
+        body = {
+            'range': {'from': '1970-01-01T00:00:00.000Z', 'to': '1970-01-01T01:00:00.000Z'},
+            'targets': [{'refId': 'A', 'target': 'SELECT slow', 'type': 'timeserie', 'aggregation': 'none'}]
+        }
+        with mock.patch.multiple(Metrics, counters={}):
+            response = await self.http_client.fetch(
+                self.get_url('/query'), method='POST', body=json.dumps(body), raise_error=False,
+                headers={'Content-Type': 'application/json', 'X-Request-Timeout': '0.05'}
+            )
+            await asyncio.sleep(0.05)
+            cancelled = dict(Metrics.counters)
+
+        self.assertEqual(504, response.code, msg='No target answered before the deadline')
+        self.assertEqual(1, cancelled[('cassandra_gateway_cancelled_requests_total', ('query', 'deadline'))])
+        self.assertEqual(1, cancelled[('cassandra_gateway_cancelled_queries_total', ())],
+                         msg='The query awaiting its page is given up')
+
+    @testing.gen_test
+    async def test_client_disconnection_cancels_queries(self):
+        self.session.latency = 0.05
+        self.session.pages_factory = lambda query, parameters: [self.rows] * 100
+        body = {
+            'range': {'from': '1970-01-01T00:00:00.000Z', 'to': '1970-01-01T01:00:00.000Z'},
+            'targets': [{'refId': 'A', 'target': 'SELECT long', 'type': 'timeserie', 'aggregation': 'none'}]
+        }
+        with mock.patch.multiple(Metrics, counters={}):
+            with self.assertRaises(httpclient.HTTPClientError):
+                await self.http_client.fetch(self.get_url('/query'), method='POST', body=json.dumps(body),
+                                             headers={'Content-Type': 'application/json'}, request_timeout=0.2)
+            await asyncio.sleep(0.2)
+            cancelled = dict(Metrics.counters)
+
+        self.assertEqual(1, cancelled.get(('cassandra_gateway_cancelled_requests_total', ('query', 'disconnected'))))
+        self.assertEqual(1, cancelled.get(('cassandra_gateway_cancelled_queries_total', ())),
+                         msg='Paging stops with the request')
+
+    @testing.gen_test
+    async def test_concurrent_requests_wait_for_a_slot(self):
+        self.session.latency = 0.01
+        targets = [{'refId': 'A', 'target': 'SELECT queued', 'type': 'timeserie', 'aggregation': 'none'}]
+        with mock.patch('handlers.BaseQueryHandler.admission', AdmissionControl(4, 64, 5)):
+            responses = await asyncio.gather(*(
+                self.http_client.fetch(
+                    self.get_url('/query'),
+                    method='POST',
+                    body=json.dumps({
+                        'range': {'from': '1970-01-01T00:00:00.000Z', 'to': '1970-01-01T01:00:00.000Z'},
+                        'targets': [dict(targets[0], target=f'SELECT queued {index}')]
+                    }),
+                    headers={'Content-Type': 'application/json'},
+                    raise_error=False
+                ) for index in range(40)
+            ))
+
+        self.assertEqual([200] * 40, [response.code for response in responses],
+                         msg='Requests over the slots are queued, then served')
+        self.assertEqual(40, len(self.session.executed))
+
+    @testing.gen_test
+    async def test_requests_are_shed_when_no_slot_is_free(self):
+        self.session.latency = 0.1
+        body = {
+            'range': {'from': '1970-01-01T00:00:00.000Z', 'to': '1970-01-01T01:00:00.000Z'},
+            'targets': [{'refId': 'A', 'target': 'SELECT busy', 'type': 'timeserie', 'aggregation': 'none'}]
+        }
+        with mock.patch('handlers.BaseQueryHandler.admission', AdmissionControl(1, 1, 1)):
+            responses = await asyncio.gather(*(
+                self.http_client.fetch(self.get_url('/query'), method='POST', body=json.dumps(body),
+                                       headers={'Content-Type': 'application/json'}, raise_error=False)
+                for _ in range(3)
+            ))
+
+        self.assertEqual([200, 200, 503], sorted(response.code for response in responses),
+                         msg='One request served, one queued, one rejected')
+        rejected = [response for response in responses if response.code == 503][0]
+        self.assertEqual('1', rejected.headers['Retry-After'])
+
+
+class TestQueryHandlerPushdown(testing.AsyncHTTPTestCase):
+
+    query = 'SELECT timestamp, name, value FROM value WHERE serial = 1 ' \
+            'AND timestamp > $startTime AND timestamp < $endTime'
+    rows = [(timestamp * 1000, name, float(timestamp % 7)) for timestamp in range(0, 10000, 90) for name in 'ab']
+
+    def get_app(self):
+        return web.Application([(r'/query', QueryHandler)])
+
+    def setUp(self):
+        super().setUp()
+        self.refused = False
+        self.session = FakeSession(self._pages)
+        self.session.prepare = self._prepare
+        self.session.add_table(
+            'metrics', 'value',
+            partition_key=[('serial', 'int'), ('date', 'text')],
+            clustering_key=[('name', 'text'), ('timestamp', 'timestamp')],
+            columns=[('value', 'double')]
+        )
+        for patcher in (
+            mock.patch('handlers.QueryHandler.Client.get_client', return_value=self.session),
+            mock.patch('handlers.QueryHandler.aggregation_pushdown', True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(Pushdown.rejected_queries.clear)
+
+    def _prepare(self, query):
+        value_type = types.SimpleNamespace(typename='double')
+        return FakePreparedStatement(query, result_metadata=[('metrics', 'value', 'value', value_type)])
+
+    def _pages(self, query, parameters):
+        start, end = parameters
+        if query.startswith('SELECT name'):
+            if self.refused:
+                raise InvalidRequest('GROUP BY not supported')
+            partials = {}
+            for timestamp, name, value in self.rows:
+                if start <= timestamp < end:
+                    partial, count = partials.get(name, (0, 0))
+                    partials[name] = (partial + value, count + 1)
+            return [[(name, partial, count) for name, (partial, count) in partials.items()]]
+        return [ResultPage(cassandraRow._fields, [row for row in self.rows if start < row[0] < end])]
+
+    def _post(self):
+        body = {
+            'range': {'from': '1970-01-01T00:00:00.000Z', 'to': '1970-01-01T00:00:08.000Z'},
+            'intervalMs': 1000,
+            'targets': [{'refId': 'A', 'target': self.query, 'type': 'timeserie', 'aggregation': 'average'}]
+        }
+        response = self.fetch(
+            '/query',
+            method='POST',
+            body=json.dumps(body),
+            headers={'Content-Type': 'application/json'}
+        )
+        self.assertEqual(200, response.code)
+        return json.loads(response.body)
+
+    def test_pushdown_gives_same_results(self):
+        pushed_down = self._post()
+        self.assertEqual(8, len(self.session.executed), msg='One query per interval')
+
+        with mock.patch('handlers.QueryHandler.aggregation_pushdown', False):
+            aggregated_by_gateway = self._post()
+
+        self.assertEqual(aggregated_by_gateway, pushed_down)
+
+    def test_fallback_to_the_gateway(self):
+        self.refused = True
+        with mock.patch('handlers.QueryHandler.aggregation_pushdown', False):
+            expected = self._post()
+
+        self.assertEqual(expected, self._post(), msg='Refused pushdowns are aggregated by the gateway')
+        executed = len(self.session.executed)
+        self._post()
+        self.assertEqual(executed + 1, len(self.session.executed), msg='Refused pushdowns are not tried again')
+
+
+class TestQueryHandlerOffload(testing.AsyncHTTPTestCase):
+
+    # 8 pages of 50000 rows, about a second of parsing and aggregation
+    pages = [
+        ResultPage(('timestamp', 'name', 'value'), [
+            ((page * 50000 + row) * 1000, f'serie {row % 10}', row) for row in range(50000)
+        ]) for page in range(8)
+    ]
+
+    def get_app(self):
+        return web.Application([(r'/query', QueryHandler), (r'/health', HealthHandler)])
+
+    def setUp(self):
+        super().setUp()
+        session = FakeSession(lambda query, parameters: self.pages, latency=0.001)
+        for patcher in (
+            mock.patch('handlers.QueryHandler.Client.get_client', return_value=session),
+            mock.patch('handlers.HealthHandler.Client.is_healthy', return_value=True),
+            mock.patch('handlers.QueryHandler.result_executor', 'thread'),
+            mock.patch('handlers.QueryHandler.result_executor_threshold', 10000),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @testing.gen_test(timeout=30)
+    async def test_health_stays_responsive_during_a_large_query(self):
+        body = {
+            'range': {'from': '1970-01-01T00:00:00.000Z', 'to': '1970-01-02T00:00:00.000Z'},
+            'intervalMs': 60000,
+            'targets': [{'refId': 'A', 'target': 'SELECT large', 'type': 'timeserie', 'aggregation': 'average'}]
+        }
+        query = asyncio.ensure_future(self.http_client.fetch(
+            self.get_url('/query'),
+            method='POST',
+            body=json.dumps(body),
+            headers={'Content-Type': 'application/json'}
+        ))
+
+        latencies = []
+        while not query.done():
+            started = time.perf_counter()
+            await self.http_client.fetch(self.get_url('/health'))
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.005)
+
+        self.assertEqual(10, len(json.loads((await query).body)), msg='The large query is answered')
+        self.assertGreater(len(latencies), 5, msg='Health checks are answered while the query is processed')
+        self.assertLess(max(latencies), 0.1, msg='Health checks never wait for the query processing')
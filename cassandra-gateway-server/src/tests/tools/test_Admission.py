@@ -0,0 +1,59 @@
+import asyncio
+
+from tornado import testing
+
+from tools.Admission import AdmissionControl
+
+
+class TestAdmissionControl(testing.AsyncTestCase):
+
+    @testing.gen_test
+    async def test_queue_then_reject(self):
+        admission = AdmissionControl(slots=1, queue_size=1, queue_timeout=1)
+
+        self.assertTrue(await admission.acquire(), msg='Admitted while a slot is free')
+        queued = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        self.assertEqual(1, admission.queued)
+        self.assertFalse(await admission.acquire(), msg='Rejected when the queue is full')
+
+        admission.release()
+        self.assertTrue(await queued, msg='A released slot goes to the queued request')
+        self.assertEqual(1, admission.in_flight)
+        self.assertEqual({'queue_full': 1, 'queue_timeout': 0}, admission.rejected)
+
+    @testing.gen_test
+    async def test_queue_timeout(self):
+        admission = AdmissionControl(slots=1, queue_size=4, queue_timeout=0.01)
+        await admission.acquire()
+
+        self.assertFalse(await admission.acquire(), msg='Rejected after waiting too long')
+        self.assertEqual(0, admission.queued, msg='The rejected request left the queue')
+        self.assertEqual(1, admission.rejected['queue_timeout'])
+
+    @testing.gen_test
+    async def test_reserved_slots(self):
+        admission = AdmissionControl(slots=2, queue_size=4, queue_timeout=1, reserved_slots=1)
+        await admission.acquire(small=False)
+
+        large = asyncio.ensure_future(admission.acquire(small=False))
+        await asyncio.sleep(0)
+        self.assertFalse(large.done(), msg='Large requests cannot use the reserved slot')
+        self.assertTrue(await admission.acquire(small=True), msg='Small requests use the reserved slot')
+
+        admission.release(small=False)
+        self.assertTrue(await large, msg='Slots not reserved go to large requests')
+
+    @testing.gen_test
+    async def test_cancelled_waiter(self):
+        admission = AdmissionControl(slots=1, queue_size=4, queue_timeout=1)
+        await admission.acquire()
+        queued = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+
+        queued.cancel()
+        await asyncio.sleep(0.01)
+        admission.release()
+
+        self.assertEqual(0, admission.queued)
+        self.assertEqual(0, admission.in_flight, msg='No slot is given to a cancelled request')
@@ -1,9 +1,217 @@
+import asyncio
+import threading
 import unittest
+from unittest import mock
 
-from tools.CassandraClient import Client as CassandraClient
+from cassandra import ConsistencyLevel
+from cassandra.policies import ConstantSpeculativeExecutionPolicy, NoSpeculativeExecutionPolicy, TokenAwarePolicy
+from tornado import testing
 
+from tools.CassandraClient import Client as CassandraClient, ResultPager, execute_async, get_compression
+from tools.CassandraClient import check_settings, make_execution_profile
+from handlers.BaseQueryHandler import warm_up_templates
+from tests.fake_cassandra import FakeResponseFuture, FakeSession
 
-class TestCassandraClient(unittest.TestCase):
+
+class FakeHost:
+    is_up = True
+
+
+class FakeCluster:
+
+    def __init__(self, *_, **__):
+        self.is_shutdown = False
+        self.hosts = [FakeHost()]
+        self.metadata = mock.Mock()
+        self.metadata.all_hosts = lambda: self.hosts
+        self.connect_calls = 0
+
+    def connect(self, keyspace=None):
+        self.connect_calls += 1
+        return FakeSession()
+
+    def shutdown(self):
+        self.is_shutdown = True
+
+
+@mock.patch('tools.CassandraClient.Cluster', FakeCluster)
+class TestCassandraClient(testing.AsyncTestCase):
+
+    def tearDown(self):
+        CassandraClient.close_connection()
+        super().tearDown()
 
     def test_stop_closed_client(self):
         CassandraClient.close_connection()
+
+    @testing.gen_test
+    async def test_session_is_reused(self):
+        session = await CassandraClient.get_client('keyspace')
+
+        self.assertIs(
+            session,
+            await CassandraClient.get_client('keyspace'),
+            msg='A keyspace session is created only once'
+        )
+        self.assertIsNot(session, await CassandraClient.get_client('other'), msg='Each keyspace has its own session')
+        self.assertEqual(2, CassandraClient.cassandra_connection.connect_calls, msg='One connect per keyspace')
+
+    @testing.gen_test
+    async def test_connect_does_not_block_the_loop(self):
+        threads = []
+        connect = FakeCluster.connect
+
+        def record_thread(cluster, keyspace=None):
+            threads.append(threading.get_ident())
+            return connect(cluster, keyspace)
+
+        with mock.patch.object(FakeCluster, 'connect', record_thread):
+            sessions = await asyncio.gather(*(CassandraClient.get_client('keyspace') for _ in range(3)))
+
+        self.assertEqual(1, len(threads), msg='Concurrent requests wait for the same connection')
+        self.assertNotEqual(threading.get_ident(), threads[0], msg='Connecting runs outside of the event loop')
+        self.assertTrue(all(session is sessions[0] for session in sessions), msg='They all get the same session')
+        self.assertEqual({}, CassandraClient.pending, msg='No connection left pending')
+
+    @testing.gen_test
+    async def test_session_recreated_after_fork(self):
+        session = await CassandraClient.get_client('keyspace')
+
+        with mock.patch('tools.CassandraClient.os.getpid', return_value=CassandraClient.owner_pid + 1):
+            self.assertIsNot(
+                session,
+                await CassandraClient.get_client('keyspace'),
+                msg='A forked process must not reuse the parent session'
+            )
+        self.assertFalse(session.is_shutdown, msg='The parent session is left untouched')
+
+    @testing.gen_test
+    async def test_reconnect_when_no_host_is_up(self):
+        session = await CassandraClient.get_client('keyspace')
+        cluster = CassandraClient.cassandra_connection
+        cluster.hosts[0] = mock.Mock(is_up=False)
+
+        CassandraClient.last_connection_time = 0
+        threads = []
+        shutdown = FakeCluster.shutdown
+
+        def record_thread(unhealthy_cluster):
+            threads.append(threading.get_ident())
+            shutdown(unhealthy_cluster)
+
+        with mock.patch.object(FakeCluster, 'shutdown', record_thread):
+            new_session = await CassandraClient.get_client('keyspace')
+
+        self.assertTrue(cluster.is_shutdown, msg='The unhealthy cluster connection is closed')
+        self.assertTrue(session.is_shutdown, msg='Sessions of the unhealthy cluster are closed')
+        self.assertIsNot(session, new_session, msg='A new session is opened')
+        self.assertNotIn(threading.get_ident(), threads, msg='Reconnecting runs outside of the event loop as well')
+        self.assertTrue(threads, msg='The unhealthy connection got closed')
+
+    @testing.gen_test
+    async def test_close_connection(self):
+        session = await CassandraClient.get_client('keyspace')
+        CassandraClient.close_connection()
+
+        self.assertTrue(session.is_shutdown, msg='Sessions are closed with the connection')
+        self.assertIsNone(CassandraClient.cassandra_connection, msg='No connection left')
+
+
+@mock.patch('tools.CassandraClient.Cluster', FakeCluster)
+class TestWarmUp(testing.AsyncTestCase):
+
+    def tearDown(self):
+        CassandraClient.close_connection()
+        super().tearDown()
+
+    @testing.gen_test
+    async def test_warm_up(self):
+        templates = warm_up_templates([
+            'SELECT * FROM metrics WHERE timestamp > $startTime AND timestamp < $endTime',
+            'SELECT * FROM metrics WHERE day IN $computedDates AND timestamp > $startTime',
+        ])
+
+        session = await CassandraClient.warm_up(templates)
+
+        self.assertIs(session, await CassandraClient.get_client(), msg='The warmed up session is used by the requests')
+        self.assertEqual(
+            [
+                'SELECT * FROM metrics WHERE timestamp > ? AND timestamp < ?',
+                'SELECT * FROM metrics WHERE day = ? AND timestamp > ?',
+            ],
+            sorted(session.prepared, reverse=True),
+            msg='Queries are prepared the way the query handlers prepare them, split by partition'
+        )
+
+
+class TestExecutionProfile(unittest.TestCase):
+
+    def test_default_profile(self):
+        profile = make_execution_profile()
+
+        self.assertIsInstance(profile.load_balancing_policy, TokenAwarePolicy, msg='Queries are routed to replicas')
+        self.assertIsInstance(
+            profile.speculative_execution_policy,
+            NoSpeculativeExecutionPolicy,
+            msg='No speculative execution by default'
+        )
+        self.assertEqual(ConsistencyLevel.LOCAL_ONE, profile.consistency_level)
+
+    @mock.patch.multiple(
+        'tools.CassandraClient',
+        cassandra_token_aware=False,
+        cassandra_speculative_delay=0.01,
+        cassandra_consistency='QUORUM',
+        cassandra_request_timeout=2.5
+    )
+    def test_configured_profile(self):
+        profile = make_execution_profile()
+
+        self.assertNotIsInstance(profile.load_balancing_policy, TokenAwarePolicy)
+        self.assertIsInstance(profile.speculative_execution_policy, ConstantSpeculativeExecutionPolicy)
+        self.assertEqual(0.01, profile.speculative_execution_policy.delay)
+        self.assertEqual(ConsistencyLevel.QUORUM, profile.consistency_level)
+        self.assertEqual(2.5, profile.request_timeout)
+
+    def test_compression(self):
+        with mock.patch('tools.CassandraClient.cassandra_compression', 'none'):
+            self.assertFalse(get_compression(), msg='Compression can be disabled')
+        with mock.patch('tools.CassandraClient.cassandra_compression', 'snappy'), \
+                mock.patch('tools.CassandraClient.locally_supported_compressions', {}):
+            self.assertTrue(get_compression(), msg='The driver picks a compression when the configured one is missing')
+
+    def test_settings_are_checked(self):
+        check_settings('LOCAL_QUORUM', 'lz4')
+        with self.assertRaisesRegex(ValueError, "'LOCAL_QUOROM'.*LOCAL_QUORUM", msg='Typos are refused at start'):
+            check_settings('LOCAL_QUOROM', 'lz4')
+        with self.assertRaisesRegex(ValueError, "'zstd'.*lz4, snappy, none"):
+            check_settings('ONE', 'zstd')
+
+
+class TestResultPager(testing.AsyncTestCase):
+
+    @testing.gen_test
+    async def test_pages_in_order(self):
+        pages = [[1, 2], [3], [4, 5, 6]]
+        response_future = FakeResponseFuture(pages, latency=0.001)
+
+        received = [page async for page in ResultPager(response_future)]
+
+        self.assertEqual(pages, received, msg='Every page is received, in order')
+
+    @testing.gen_test
+    async def test_error_is_raised(self):
+        response_future = FakeResponseFuture([[1]], latency=0.001, error=ValueError('boom'))
+
+        with self.assertRaises(ValueError, msg='Driver errors are raised to the awaiting coroutine'):
+            async for _ in ResultPager(response_future):
+                pass
+
+    @testing.gen_test
+    async def test_execute_async(self):
+        session = FakeSession(lambda query, parameters: [[1, 2], [3]])
+
+        rows = await execute_async(session, 'SELECT', (1,))
+
+        self.assertEqual([1, 2, 3], rows, msg='Rows of all pages are returned')
+        self.assertEqual([('SELECT', (1,))], session.executed, msg='The query is executed once with its parameters')
@@ -0,0 +1,46 @@
+import gzip
+import zlib
+import unittest
+
+from tornado import httputil
+
+from tools.Compression import ResponseCompression, accepted_encodings, choose_encoding
+
+
+def request(accept_encoding: str):
+    return httputil.HTTPServerRequest('GET', '/', headers=httputil.HTTPHeaders({'Accept-Encoding': accept_encoding}))
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_accepted_encodings(self):
+        self.assertEqual({'gzip', 'br'}, accepted_encodings('gzip, deflate;q=0, br;q=0.5'))
+
+    def test_choose_encoding(self):
+        self.assertEqual('gzip', choose_encoding('gzip, br', ['gzip', 'br']), msg='The server preference wins')
+        self.assertEqual('gzip', choose_encoding('*', ['unknown', 'gzip']), msg='Encodings not installed are skipped')
+        self.assertIsNone(choose_encoding('identity', ['gzip']))
+        self.assertIsNone(choose_encoding('gzip', []), msg='Compression can be disabled')
+
+    def test_streamed_answer(self):
+        transform = ResponseCompression(request('gzip'))
+        transform.encoding = 'gzip'
+        headers = httputil.HTTPHeaders({'Content-Type': 'application/json'})
+        _, headers, first = transform.transform_first_chunk(200, headers, b'[{"a":', False)
+        second = transform.transform_chunk(b'1}]', False)
+        last = transform.transform_chunk(b'', True)
+
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertEqual(b'[{"a":1}]', gzip.decompress(first + second + last))
+        self.assertEqual(b'[{"a":', zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(first),
+                         msg='Each chunk can be decoded right away')
+
+    def test_short_answers_are_not_compressed(self):
+        transform = ResponseCompression(request('gzip'))
+        transform.encoding = 'gzip'
+        headers = httputil.HTTPHeaders({'Content-Type': 'application/json', 'Content-Length': '16'})
+        _, headers, chunk = transform.transform_first_chunk(200, headers, b'{"status": "ok"}', True)
+
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(b'{"status": "ok"}', chunk)
+        self.assertEqual('Accept-Encoding', headers['Vary'])
@@ -0,0 +1,111 @@
+import math
+import unittest
+
+from tools.Downsampling import downsample, lttb_numpy, lttb_python, minmax_numpy, minmax_python, numpy
+from tools.TimeSeries import TimeserieBuilder
+from tools.ResultPage import ResultPage
+
+
+def wave(size: int):
+    timestamps = [1000.0 + i * 100 for i in range(size)]
+    values = [math.sin(i / 50) * 10 + (i % 7) for i in range(size)]
+    return values, timestamps
+
+
+class TestDownsampling(unittest.TestCase):
+
+    def test_small_series_are_kept(self):
+        values, timestamps = wave(100)
+        for mode in ('lttb', 'minmax', 'none'):
+            self.assertEqual((values, timestamps), downsample(values, timestamps, 100, mode))
+        self.assertEqual((values, timestamps), downsample(values, timestamps, None, 'lttb'),
+                         msg='Without maxDataPoints every datapoint is kept')
+
+    def test_lttb(self):
+        values, timestamps = wave(10000)
+        kept_values, kept_timestamps = downsample(values, timestamps, 500, 'lttb')
+
+        self.assertEqual(500, len(kept_values))
+        self.assertEqual((values[0], timestamps[0]), (kept_values[0], kept_timestamps[0]), msg='First point kept')
+        self.assertEqual((values[-1], timestamps[-1]), (kept_values[-1], kept_timestamps[-1]), msg='Last point kept')
+        self.assertEqual(sorted(kept_timestamps), kept_timestamps, msg='Points stay in time order')
+        for value, timestamp in zip(kept_values, kept_timestamps):
+            self.assertEqual(values[timestamps.index(timestamp)], value, msg='Kept points are actual datapoints')
+
+    def test_lttb_keeps_spikes(self):
+        values = [0.0] * 10000
+        values[1234] = 100.0
+        values[8765] = -100.0
+        timestamps = [float(i) for i in range(10000)]
+
+        kept_values, _ = downsample(values, timestamps, 100, 'lttb')
+
+        self.assertIn(100.0, kept_values)
+        self.assertIn(-100.0, kept_values)
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_engines_agree(self):
+        values, timestamps = wave(12345)
+        value_array, timestamp_array = numpy.array(values), numpy.array(timestamps)
+        for max_points in (3, 4, 100, 1000):
+            self.assertEqual(
+                lttb_python(values, timestamps, max_points),
+                lttb_numpy(value_array, timestamp_array, max_points).tolist(),
+                msg=f'Both LTTB implementations keep the same points ({max_points})'
+            )
+            self.assertEqual(
+                minmax_python(values, timestamps, max_points),
+                minmax_numpy(value_array, timestamp_array, max_points).tolist(),
+                msg=f'Both min/max implementations keep the same points ({max_points})'
+            )
+
+    def test_minmax(self):
+        values, timestamps = wave(10000)
+        kept_values, kept_timestamps = downsample(values, timestamps, 200, 'minmax')
+
+        self.assertLessEqual(len(kept_values), 200)
+        self.assertEqual(sorted(kept_timestamps), kept_timestamps, msg='Points stay in time order')
+        self.assertEqual(max(values), max(kept_values), msg='The highest point is kept')
+        self.assertEqual(min(values), min(kept_values), msg='The lowest point is kept')
+
+        # each bucket of 99 pixels keeps its extremes
+        span = timestamps[-1] - timestamps[0]
+        for bucket in range(99):
+            bucket_values = [
+                value for value, timestamp in zip(values, timestamps)
+                if min(int((timestamp - timestamps[0]) * 99 / span), 98) == bucket
+            ]
+            self.assertIn(max(bucket_values), kept_values)
+            self.assertIn(min(bucket_values), kept_values)
+
+    def test_minmax_same_timestamp(self):
+        values = [float(i % 10) for i in range(100)]
+        kept_values, kept_timestamps = downsample(values, [1000.0] * 100, 10, 'minmax')
+
+        self.assertEqual([0.0, 9.0, 9.0], kept_values, msg='A single bucket: the first, lowest, highest, last points')
+        self.assertEqual([1000.0] * 3, kept_timestamps)
+
+    def test_text_values_are_kept(self):
+        values = ['text'] * 1000
+        timestamps = [float(i) for i in range(1000)]
+
+        self.assertEqual((values, timestamps), downsample(values, timestamps, 10, 'lttb'))
+
+
+class TestBuilderDownsampling(unittest.TestCase):
+
+    page = ResultPage(('timestamp', 'name', 'value'), [(i * 1000, 'oxygen', float(i % 13)) for i in range(5000)])
+
+    def test_raw_series_are_downsampled(self):
+        for aggregation in ('none', 'on changes'):
+            builder = TimeserieBuilder(aggregation, value_type='double', max_points=300, downsampling='lttb')
+            builder.add_rows(self.page)
+
+            datapoints = builder.results()[0]['datapoints']
+            self.assertEqual(300, len(datapoints), msg=f'{aggregation} series are downsampled')
+
+    def test_aggregated_series_are_not_downsampled(self):
+        builder = TimeserieBuilder('sum', 1, value_type='double', max_points=300, downsampling='lttb')
+        builder.add_rows(self.page)
+
+        self.assertEqual(5000, len(builder.results()[0]['datapoints']), msg='Intervals are given by intervalMs')
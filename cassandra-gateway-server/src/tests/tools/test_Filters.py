@@ -0,0 +1,148 @@
+import unittest
+from collections import namedtuple
+
+from tools.Filters import FilterPlan, parse_filters, plan_filters, split_alternatives
+from tools.ResultPage import ResultPage
+from tests.fake_cassandra import FakeSession
+
+QUERY = 'SELECT timestamp, name, value FROM data WHERE serial = \'sensor-1\' AND day IN $computedDates ' \
+        'AND timestamp > $startTime AND timestamp < $endTime'
+
+
+def make_session():
+    session = FakeSession(keyspace='metrics')
+    session.add_table(
+        'metrics', 'data',
+        partition_key=[('serial', 'text'), ('day', 'text')],
+        clustering_key=[('name', 'text'), ('timestamp', 'bigint')],
+        columns=[('value', 'double'), ('unit', 'text')]
+    )
+    return session
+
+
+def adhoc(key, operator, value):
+    return {'key': key, 'operator': operator, 'value': value}
+
+
+class TestParseFilters(unittest.TestCase):
+
+    def test_invalid_filters_are_ignored(self):
+        filters = parse_filters([
+            adhoc('name', '=', 'oxygen'),
+            adhoc('name', 'LIKE', 'oxy%'),
+            adhoc('', '=', 'oxygen'),
+            adhoc('name', '=~', '(unclosed'),
+            'name = oxygen',
+        ])
+
+        self.assertEqual([('name', '=', 'oxygen')], filters)
+
+    def test_split_alternatives(self):
+        self.assertEqual(['a', 'b'], split_alternatives('(a|b)'))
+        self.assertEqual(['a', 'b.c'], split_alternatives('^(a|b\\.c)$'))
+        self.assertEqual(['a'], split_alternatives('a'))
+        self.assertIsNone(split_alternatives('a.*'), msg='Not a plain value')
+
+
+class TestPlanFilters(unittest.TestCase):
+
+    def plan(self, query, *filters):
+        return plan_filters(query, parse_filters(filters), make_session())
+
+    def test_clustering_column_is_pushed_down(self):
+        plan = self.plan(QUERY, adhoc('name', '=', 'oxygen'))
+
+        self.assertEqual(QUERY + ' AND name = $adhocFilter0', plan.query)
+        self.assertEqual({'adhocFilter0': 'oxygen'}, plan.macros)
+        self.assertEqual([], plan.row_filters)
+
+    def test_regex_of_values_is_pushed_as_in(self):
+        plan = self.plan(QUERY + ' LIMIT 10', adhoc('name', '=~', '(oxygen|pressure)'))
+
+        self.assertEqual(QUERY + ' AND name IN $adhocFilter0 LIMIT 10', plan.query,
+                         msg='Predicates are added before the trailing clauses')
+        self.assertEqual({'adhocFilter0': ('oxygen', 'pressure')}, plan.macros)
+
+    def test_partition_key_is_pushed_down_once_complete(self):
+        query = 'SELECT * FROM data WHERE day = $day'
+        plan = self.plan(query, adhoc('serial', '=', 'sensor-2'), adhoc('name', '=', 'oxygen'))
+        self.assertEqual(query + ' AND serial = $adhocFilter0 AND name = $adhocFilter1', plan.query)
+
+        plan = self.plan('SELECT * FROM data', adhoc('serial', '=', 'sensor-2'))
+        self.assertEqual('SELECT * FROM data', plan.query,
+                         msg='Part of the partition key only would need ALLOW FILTERING')
+        self.assertEqual([('serial', '=', 'sensor-2')], plan.row_filters)
+
+    def test_filters_needing_allow_filtering_are_left_to_the_gateway(self):
+        plan = self.plan(
+            QUERY,
+            adhoc('value', '>', '3.5'),
+            adhoc('unit', '=', 'bar'),
+            adhoc('serial', '=', 'sensor-2'),
+            adhoc('name', '!=', 'oxygen'),
+        )
+
+        self.assertEqual(QUERY, plan.query, msg='Nothing pushed down')
+        self.assertEqual(
+            [('value', '>', 3.5), ('unit', '=', 'bar'), ('name', '!=', 'oxygen'), ('serial', '=', 'sensor-2')],
+            plan.row_filters,
+            msg='Regular columns, other operators and columns restricted by the query are filtered by the gateway'
+        )
+
+    def test_clustering_column_after_a_range(self):
+        query = 'SELECT * FROM data WHERE serial = \'a\' AND day = \'b\' AND name > \'c\''
+        plan = self.plan(query, adhoc('timestamp', '=', '1000'))
+
+        self.assertEqual(query, plan.query)
+        self.assertEqual([('timestamp', '=', 1000)], plan.row_filters, msg='Values are converted to the column type')
+
+    def test_string_literals_are_skipped(self):
+        query = 'SELECT * FROM data WHERE serial = \'a LIMIT 1\' AND day = \'b\''
+        plan = self.plan(query, adhoc('name', '=', 'oxygen'))
+
+        self.assertEqual(query + ' AND name = $adhocFilter0', plan.query)
+
+    def test_unknown_table_and_columns(self):
+        plan = self.plan('SELECT * FROM other', adhoc('name', '=', 'oxygen'))
+        self.assertEqual([('name', '=', 'oxygen')], plan.row_filters, msg='Left to the gateway')
+
+        plan = self.plan(QUERY, adhoc('host', '=', 'a'))
+        self.assertEqual((QUERY, [], {}), (plan.query, plan.row_filters, plan.macros),
+                         msg='A filter on a column the table does not have concerns other queries')
+
+
+class TestFilterRows(unittest.TestCase):
+
+    row = namedtuple('row', ['timestamp', 'name', 'value'])
+
+    def test_filter_rows(self):
+        page = ResultPage(['timestamp', 'name', 'value'], [(1, 'oxygen', 1.5), (2, 'pressure', 3.0), (3, 'co2', None)])
+
+        self.assertEqual([(2, 'pressure', 3.0)], FilterPlan('', {}, [('value', '>', 2.0)]).filter_rows(page))
+        self.assertEqual([(1, 'oxygen', 1.5), (3, 'co2', None)],
+                         FilterPlan('', {}, [('name', '!=', 'pressure')]).filter_rows(page))
+        self.assertEqual([(1, 'oxygen', 1.5), (2, 'pressure', 3.0)],
+                         FilterPlan('', {}, [('name', '=~', 'o.*|p.*')]).filter_rows(page))
+        self.assertEqual([(1, 'oxygen', 1.5)], FilterPlan('', {}, [('timestamp', '=', '1')]).filter_rows(page),
+                         msg='Values of unknown types are compared as text')
+        self.assertEqual(page, FilterPlan('', {}, [('unit', '=', 'bar')]).filter_rows(page),
+                         msg='Columns not in the results are not filtered')
+
+    def test_filter_on_a_column_not_selected(self):
+        page = ResultPage(['timestamp', 'value'], [(1, 1.5), (2, 3.0)])
+        plan = FilterPlan('', {}, [('unit', '=', 'bar'), ('value', '>', 2.0)])
+
+        with self.assertLogs('tools.Filters', 'WARNING') as logs:
+            self.assertEqual([(2, 3.0)], plan.filter_rows(page), msg='The other filters are applied')
+            plan.filter_rows(page)
+
+        self.assertEqual(1, len(logs.output), msg='Warned once per target, not once per page')
+        self.assertIn('unit', logs.output[0])
+
+    def test_filter_namedtuple_rows(self):
+        rows = [self.row(1, 'oxygen', 1.5), self.row(2, 'pressure', 3.0)]
+
+        filtered = FilterPlan('', {}, [('name', '=', 'oxygen')]).filter_rows(rows)
+
+        self.assertEqual([(1, 'oxygen', 1.5)], filtered)
+        self.assertEqual(['timestamp', 'name', 'value'], filtered.column_names)
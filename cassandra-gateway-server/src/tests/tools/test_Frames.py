@@ -0,0 +1,56 @@
+import unittest
+
+from tools.Frames import to_frame, pyarrow
+
+
+class TestFrames(unittest.TestCase):
+
+    def test_serie(self):
+        frame = to_frame({'target': 'oxygen', 'refId': 'A', 'datapoints': [[0.5, 1000.0], [0.75, 2000.0]]})
+
+        self.assertEqual('A', frame['refId'])
+        self.assertEqual('oxygen', frame['schema']['name'])
+        self.assertEqual(['time', 'number'], [field['type'] for field in frame['schema']['fields']])
+        self.assertEqual([[1000.0, 2000.0], [0.5, 0.75]], frame['data']['values'], msg='Values are by columns')
+
+    def test_text_serie(self):
+        frame = to_frame({'target': 'file name', 'refId': 'A', 'datapoints': [['text', 1000.0], [1.0, 2000.0]]})
+
+        self.assertEqual('string', frame['schema']['fields'][1]['type'], msg='Text values make a string field')
+
+    def test_table(self):
+        frame = to_frame({
+            'columns': [{'text': 'name', 'type': 'string'}, {'text': 'value', 'type': 'string'}],
+            'rows': [['door', True], ['laser', 123]],
+            'type': 'table',
+            'refId': 'B'
+        })
+
+        self.assertEqual(['name', 'value'], [field['name'] for field in frame['schema']['fields']])
+        self.assertEqual([['door', 'laser'], [True, 123]], frame['data']['values'])
+
+    def test_error(self):
+        frame = to_frame({'target': 'A', 'refId': 'A', 'datapoints': [], 'error': 'Deadline exceeded'})
+
+        self.assertEqual('Deadline exceeded', frame['error'])
+        self.assertEqual([], frame['data']['values'])
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_arrow_stream(self):
+        from tools.Frames import ArrowStream
+
+        stream = ArrowStream()
+        data = stream.write([{'target': 'oxygen', 'refId': 'A', 'datapoints': [[0.5, 1000.0], ['text', 2000.5]]}])
+        data += stream.write([{'target': 'A', 'refId': 'A', 'datapoints': [], 'error': 'Deadline exceeded'}])
+        data += stream.close()
+
+        reader = pyarrow.ipc.open_stream(data)
+        batch, metadata = reader.read_next_batch_with_custom_metadata()
+        self.assertEqual({b'refId': b'A', b'name': b'oxygen'}, dict(metadata))
+        self.assertEqual([0.5, None], batch.column('value').to_pylist())
+        self.assertEqual([None, 'text'], batch.column('text').to_pylist())
+        self.assertEqual([1000000, 2000500], batch.column('time').cast(pyarrow.int64()).to_pylist())
+
+        batch, metadata = reader.read_next_batch_with_custom_metadata()
+        self.assertEqual(b'Deadline exceeded', dict(metadata)[b'error'])
+        self.assertEqual(0, batch.num_rows)
@@ -0,0 +1,36 @@
+import json
+import unittest
+from unittest import mock
+
+from tools import JsonEncoder
+
+
+class TestJsonEncoder(unittest.TestCase):
+
+    items = [
+        {'target': 'oxygen', 'datapoints': [[i / 10, 1000 + i] for i in range(2500)]},
+        {'columns': [{'text': 'name', 'type': 'string'}], 'rows': [['door'], ['laser']], 'type': 'table'},
+        {'target': 'empty', 'datapoints': []},
+    ]
+
+    def _decode(self):
+        return json.loads(b'[' + b''.join(JsonEncoder.iter_encode_items(self.items)) + b']')
+
+    def test_chunks_make_the_whole_document(self):
+        self.assertEqual(self.items, self._decode(), msg='Chunks concatenate into the JSON of the items')
+
+    def test_without_orjson(self):
+        with mock.patch.object(JsonEncoder, 'orjson', None):
+            self.assertEqual(self.items, self._decode(), msg='The standard encoder is used as a fallback')
+
+    def test_large_lists_are_chunked(self):
+        chunks = list(JsonEncoder.iter_encode_items(self.items[:1]))
+
+        self.assertGreater(len(chunks), 3, msg='A large list is encoded in several chunks')
+
+    def test_large_columns_are_chunked(self):
+        frame = {'data': {'values': [list(range(2500)), [i / 10 for i in range(2500)]]}}
+        chunks = list(JsonEncoder.iter_encode_items([frame]))
+
+        self.assertGreater(len(chunks), 6, msg='Each large column is encoded in several chunks')
+        self.assertEqual([frame], json.loads(b'[' + b''.join(chunks) + b']'))
@@ -0,0 +1,58 @@
+import os
+import unittest
+from unittest import mock
+
+from tools.Metrics import Metrics, SnapshotStore
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.multiple(Metrics, counters={}, gauges={}, histograms={}, collectors=[], store=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_histogram_exposition(self):
+        labels = Metrics.query_labels('query', 'timeserie', 'sum')
+        for rows in (5, 50, 50, 2000000):
+            Metrics.observe('cassandra_gateway_rows', rows, *labels)
+
+        exposition = Metrics.collect()
+
+        prefix = 'cassandra_gateway_rows_bucket{handler="query",type="timeserie",aggregation="sum",'
+        self.assertIn(prefix + 'le="10"} 1\n', exposition)
+        self.assertIn(prefix + 'le="100"} 3\n', exposition, msg='Buckets are cumulative')
+        self.assertIn(prefix + 'le="+Inf"} 4\n', exposition)
+        self.assertIn('cassandra_gateway_rows_sum{handler="query",type="timeserie",aggregation="sum"} 2000105.0\n',
+                      exposition)
+        self.assertIn('cassandra_gateway_rows_count{handler="query",type="timeserie",aggregation="sum"} 4\n',
+                      exposition)
+        self.assertIn('# TYPE cassandra_gateway_rows histogram\n', exposition)
+
+    def test_label_values_are_bounded(self):
+        self.assertEqual(('query', 'other', 'other'), Metrics.query_labels('query', 'graph', "sum'; DROP"))
+
+    def test_counters_and_collectors(self):
+        Metrics.increment('cassandra_gateway_responses_total', 'query', '403')
+        Metrics.increment('cassandra_gateway_responses_total', 'query', '403')
+        Metrics.increment('cassandra_gateway_requests_in_flight', 'query')
+        Metrics.add_collector(lambda: [('cassandra_gateway_queries_total', ('coalesced',), 7)])
+
+        exposition = Metrics.collect()
+
+        self.assertIn('cassandra_gateway_responses_total{handler="query",code="403"} 2\n', exposition)
+        self.assertIn('cassandra_gateway_requests_in_flight{handler="query"} 1\n', exposition)
+        self.assertIn('cassandra_gateway_queries_total{outcome="coalesced"} 7\n', exposition)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'no fork support')
+    def test_workers_are_summed_up(self):
+        Metrics.store = SnapshotStore(2)
+        Metrics.increment('cassandra_gateway_responses_total', 'query', '503')
+
+        pid = os.fork()
+        if not pid:
+            Metrics.store.write(1, Metrics.snapshot())
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertIn('cassandra_gateway_responses_total{handler="query",code="503"} 2\n', Metrics.collect())
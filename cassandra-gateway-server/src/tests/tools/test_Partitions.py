@@ -0,0 +1,65 @@
+import time
+import unittest
+
+from tornado import testing
+
+from tests.fake_cassandra import FakeSession
+from tools.Partitions import TooManyPartitions, check_granularity, compute_partitions, iterate_partitions
+from tools.Partitions import split_partitions
+
+DAY = 86400 * 10 ** 6  # in microseconds
+
+
+class TestPartitions(unittest.TestCase):
+
+    def test_daily_partitions(self):
+        self.assertEqual(
+            ['1970-01-01', '1970-01-02', '1970-01-03'],
+            compute_partitions(DAY // 2, 2 * DAY + 1, 'day'),
+            msg='Every day touched by the time range is a partition'
+        )
+        self.assertEqual(['1970-01-01'], compute_partitions(0, DAY - 1, 'day'))
+
+    def test_hourly_partitions(self):
+        hour = 3600 * 10 ** 6
+        self.assertEqual(['1970-01-01 23', '1970-01-02 00'], compute_partitions(DAY - 1, DAY + hour - 1, 'hour'))
+        self.assertEqual(['1970010123'], compute_partitions(DAY - 1, DAY - 1, 'hour', '%Y%m%d%H'))
+
+    def test_partitions_limit(self):
+        self.assertEqual(3, len(compute_partitions(DAY // 2, 2 * DAY + 1, 'day', max_partitions=3)))
+        with self.assertRaises(TooManyPartitions, msg='A time range over the limit is refused'):
+            compute_partitions(0, 365 * DAY, 'hour', max_partitions=1000)
+
+    def test_unknown_granularity(self):
+        check_granularity('hour')
+        with self.assertRaisesRegex(ValueError, "'week'", msg='Settings are checked when loaded'):
+            check_granularity('week')
+
+    def test_split_partitions(self):
+        self.assertEqual(
+            "SELECT * FROM t WHERE day = $computedDate AND name = 'IN $computedDates'",
+            split_partitions("SELECT * FROM t WHERE day in $computedDates AND name = 'IN $computedDates'"),
+            msg='String literals are left untouched'
+        )
+        self.assertIsNone(split_partitions('SELECT * FROM t WHERE day = $startTime'))
+
+
+class TestIteratePartitions(testing.AsyncTestCase):
+
+    @testing.gen_test
+    async def test_pages_come_in_partitions_order(self):
+        session = FakeSession(lambda query, parameters: [[(parameters[0], page)] for page in range(3)], latency=0.05)
+
+        started = time.perf_counter()
+        pages = [page async for page in iterate_partitions(session, 'SELECT', [[day] for day in range(4)], 4)]
+
+        self.assertEqual([[(day, page)] for day in range(4) for page in range(3)], pages)
+        self.assertLess(time.perf_counter() - started, 0.5, msg='Partitions are queried concurrently')
+
+    @testing.gen_test
+    async def test_partition_error_is_raised(self):
+        session = FakeSession(error=RuntimeError('partition unavailable'))
+
+        with self.assertRaises(RuntimeError):
+            async for _ in iterate_partitions(session, 'SELECT', [[0], [1]]):
+                pass
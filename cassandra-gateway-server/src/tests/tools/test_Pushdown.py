@@ -0,0 +1,97 @@
+import types
+import unittest
+
+from tools import Pushdown
+from tools.Pushdown import plan_pushdown
+from tools.TimeSeries import IntervalAggregator
+
+QUERY = 'SELECT timestamp, name, value FROM value WHERE serial = 1 AND timestamp > $startTime AND timestamp < $endTime'
+
+
+def column(name):
+    return types.SimpleNamespace(name=name)
+
+
+def table(partition_key, clustering_key):
+    return types.SimpleNamespace(
+        partition_key=[column(name) for name in partition_key],
+        clustering_key=[column(name) for name in clustering_key]
+    )
+
+
+TABLE = table(['serial', 'date'], ['name', 'timestamp'])
+
+
+class TestPlanPushdown(unittest.TestCase):
+
+    def tearDown(self):
+        Pushdown.rejected_queries.clear()
+
+    def test_rewritten_query(self):
+        plan = plan_pushdown(QUERY, 'average', 1000, TABLE, 'double')
+
+        self.assertEqual(
+            'SELECT name, sum(value), count(value) FROM value '
+            'WHERE serial = 1 AND timestamp >= $startTime AND timestamp < $endTime GROUP BY serial, date, name',
+            plan.query,
+            msg='Values are grouped by the primary key columns up to the name'
+        )
+
+    def test_queries_aggregated_by_the_gateway(self):
+        for query, aggregation, interval_ms, queried_table, value_type in (
+            (QUERY, 'none', 1000, TABLE, 'double'),
+            (QUERY, 'and', 1000, TABLE, 'double'),
+            (QUERY, 'sum', None, TABLE, 'double'),
+            (QUERY, 'sum', 1000, None, 'double'),
+            (QUERY, 'sum', 1000, TABLE, 'text'),
+            (QUERY, 'sum', 1000, TABLE, 'int'),
+            (QUERY, 'sum', 1000, table(['serial'], ['timestamp', 'name']), 'double'),
+            (QUERY, 'sum', 1000, table(['serial', 'date'], ['timestamp']), 'double'),
+            (QUERY + ' LIMIT 10', 'sum', 1000, TABLE, 'double'),
+            (QUERY.replace('timestamp < $endTime', 'timestamp < 10'), 'sum', 1000, TABLE, 'double'),
+            (QUERY.replace('name, value', 'value, name'), 'sum', 1000, TABLE, 'double'),
+        ):
+            self.assertIsNone(
+                plan_pushdown(query, aggregation, interval_ms, queried_table, value_type),
+                msg=f'{query}, {aggregation}, {value_type}'
+            )
+
+        self.assertIsNotNone(plan_pushdown(QUERY, 'maximum', 1000, TABLE, 'int'), msg='Only sums of int overflow')
+
+    def test_rejected_queries(self):
+        plan_pushdown(QUERY, 'sum', 1000, TABLE, 'double').reject()
+
+        self.assertIsNone(plan_pushdown(QUERY, 'sum', 1000, TABLE, 'double'), msg='Rejected queries are not planned')
+
+    def test_intervals(self):
+        plan = plan_pushdown(QUERY, 'sum', 1000, TABLE, 'double')
+
+        self.assertEqual(
+            [(1500001, 2000000), (2000000, 3000000), (3000000, 3200000)],
+            plan.intervals(1500000, 3200000, 10),
+            msg='Intervals are aligned, the bounds of the time range are excluded'
+        )
+        self.assertIsNone(plan.intervals(1500000, 3200000, 2), msg='No plan above the intervals limit')
+
+    def test_same_results_as_the_gateway(self):
+        points = [(value, 1000 + value * 130) for value in range(50)]  # timestamps in milliseconds
+        plan = plan_pushdown(QUERY, 'average', 1000, TABLE, 'double')
+
+        answers = []
+        for interval_start, interval_end in plan.intervals(0, 10000000, 100):
+            # one partial aggregate for each of two partitions
+            rows = []
+            for partition in (0, 1):
+                values = [value for value, timestamp in points
+                          if interval_start <= timestamp * 1000 < interval_end and value % 2 == partition]
+                rows.append(('oxygen', sum(values), len(values)))
+            answers.append((interval_start, rows))
+
+        aggregator = IntervalAggregator('average', 1000, 'zero', (0, 10000))
+        for value, timestamp in points:
+            aggregator.add(float(value), timestamp)
+
+        self.assertEqual(
+            [{'target': 'oxygen', 'datapoints': aggregator.finish()}],
+            plan.results(answers, 'zero', (0, 10000))
+        )
@@ -0,0 +1,100 @@
+import unittest
+
+from tools.ResultCache import CacheEntry, MemoryBackend, ResultCache
+from tools.ResultPage import ResultPage
+from tools.SharedCache import SharedMemoryBackend
+from tools.TimeSeries import TimeserieBuilder
+
+INTERVAL_MS = 1000
+# one point every 300 ms for two series, timestamps in microseconds
+ROWS = [(timestamp * 1000, name, float(timestamp % 7)) for timestamp in range(0, 60000, 300) for name in 'ab']
+COLUMNS = ('timestamp', 'name', 'value')
+
+
+def query(start_time, end_time):
+    builder = TimeserieBuilder('sum', INTERVAL_MS)
+    builder.add_rows(ResultPage(COLUMNS, [row for row in ROWS if start_time < row[0] < end_time]))
+    return builder.results()
+
+
+class TestMemoryBackend(unittest.TestCase):
+
+    def test_least_recently_used_entries_are_evicted(self):
+        backend = MemoryBackend(100)
+        backend.put('a', 'a', 40)
+        backend.put('b', 'b', 40)
+        backend.get('a')
+        backend.put('c', 'c', 40)
+
+        self.assertEqual(['a', 'c'], list(backend.entries), msg='The least recently used entry is evicted')
+        self.assertEqual(80, backend.size)
+
+    def test_too_large_entries_are_not_stored(self):
+        backend = MemoryBackend(100)
+        backend.put('a', 'a', 101)
+
+        self.assertIsNone(backend.get('a'))
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResultCache(MemoryBackend(2 ** 20), 5000)
+        self.key = ResultCache.make_key('metrics', 'SELECT * FROM value WHERE timestamp > $startTime', 'sum', 1000)
+
+    def _query(self, start_time, end_time, now=60):
+        cached = self.cache.lookup(self.key, start_time, end_time, INTERVAL_MS)
+        edges = ResultCache.edges(cached, start_time, end_time, INTERVAL_MS)
+        series = ResultCache.merge(cached, [query(*edge) for edge in edges], INTERVAL_MS)
+        self.cache.store(self.key, series, start_time, end_time, INTERVAL_MS, now)
+        return edges, [{'target': name, 'datapoints': datapoints} for name, datapoints in series.items()]
+
+    def test_key(self):
+        self.assertEqual(
+            ('metrics', 'SELECT * FROM value WHERE timestamp > ?', 'sum', 1000),
+            self.key,
+            msg='Time range macros are not part of the key'
+        )
+
+    def test_only_edges_are_queried(self):
+        self._query(10500000, 40500000)
+        edges, results = self._query(20500000, 50500000)
+
+        self.assertEqual(
+            [(20500000, 21000000), (39999999, 50500000)],
+            edges,
+            msg='Only the intervals missing from the cache are queried'
+        )
+        self.assertEqual(query(20500000, 50500000), results, msg='Cached intervals give the same results')
+
+    def test_cached_range_inside_the_time_range(self):
+        self._query(20500000, 30500000)
+        edges, results = self._query(10500000, 40500000)
+
+        self.assertEqual([(10500000, 21000000), (29999999, 40500000)], edges)
+        self.assertEqual(query(10500000, 40500000), results)
+
+    def test_recent_intervals_are_not_cached(self):
+        self._query(10500000, 40500000, now=30)
+
+        entry = self.cache.backend.get(self.key)
+        self.assertEqual((11, 25), (entry.first, entry.last), msg='Only complete intervals older than the horizon')
+
+    def test_contiguous_ranges_are_merged(self):
+        self._query(10500000, 25500000)
+        self._query(20500000, 30500000)
+
+        entry = self.cache.backend.get(self.key)
+        self.assertEqual((11, 30), (entry.first, entry.last))
+        self.assertIsInstance(entry, CacheEntry)
+        edges, results = self._query(10500000, 30500000)
+        self.assertEqual([(10500000, 11000000), (29999999, 30500000)], edges)
+        self.assertEqual(query(10500000, 30500000), results)
+
+    def test_shared_backend(self):
+        self.cache = ResultCache(SharedMemoryBackend(2 ** 20, 4), 5000)
+        self._query(10500000, 40500000)
+        edges, results = self._query(20500000, 50500000)
+
+        self.assertEqual([(20500000, 21000000), (39999999, 50500000)], edges)
+        self.assertEqual(query(20500000, 50500000), results)
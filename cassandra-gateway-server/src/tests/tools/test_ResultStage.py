@@ -0,0 +1,58 @@
+import pickle
+
+from tornado import testing
+
+from tools.ResultPage import ResultPage
+from tools.ResultStage import ColumnarRows, ResultStage, build_results
+from tools.TimeSeries import TableBuilder, TimeserieBuilder
+
+COLUMNS = ('timestamp', 'name', 'value')
+
+
+def make_pages(pages: int, rows: int):
+    return [
+        ResultPage(COLUMNS, [
+            ((page * rows + row) * 1000000, f'serie {row % 3}', float(row)) for row in range(rows)
+        ]) for page in range(pages)
+    ]
+
+
+class TestColumnarRows(testing.AsyncTestCase):
+
+    def test_rows_survive_the_handover(self):
+        columns = ColumnarRows(COLUMNS)
+        columns.add_page([(1, 'a', 1.5), (2, 'a', 2.5)])
+        columns.add_page([(3, 'b', None), (4, 'a', 4)])
+
+        received = pickle.loads(pickle.dumps(columns))
+
+        self.assertEqual(
+            [(1, 'a', 1.5), (2, 'a', 2.5), (3, 'b', None), (4, 'a', 4)],
+            [row for page in received.pages() for row in page],
+            msg='A null turns the typed column into a list, no row is lost'
+        )
+        self.assertEqual(COLUMNS, tuple(received.column_names))
+        self.assertIs(columns.columns[1][0], columns.columns[1][1], msg='Equal strings are stored once')
+
+    def test_build_results(self):
+        columns = ColumnarRows(COLUMNS)
+        expected = TimeserieBuilder()
+        for page in make_pages(2, 10):
+            columns.add_page(page)
+            expected.add_rows(page)
+
+        self.assertEqual(expected.results(), build_results(TimeserieBuilder(), columns))
+
+    @testing.gen_test(timeout=30)
+    async def test_offloaded_results_are_the_same(self):
+        pages = make_pages(4, 1000)
+        for kind in ('thread', 'process'):
+            for builder_class, args in ((TimeserieBuilder, ('sum', 60000)), (TableBuilder, ())):
+                expected = builder_class(*args)
+                stage = ResultStage(builder_class(*args), kind, threshold=1500)
+                for page in pages:
+                    expected.add_rows(page)
+                    await stage.add_rows(page)
+
+                self.assertTrue(stage.offloaded)
+                self.assertEqual(expected.results(), await stage.results(), msg=f'Same results with a {kind}')
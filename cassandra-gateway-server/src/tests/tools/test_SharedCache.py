@@ -0,0 +1,61 @@
+import os
+import unittest
+
+from tools.ResultCache import CacheEntry
+from tools.SharedCache import SharedMemoryBackend, decode_entry, encode_entry
+
+
+def entry(first, points=10):
+    return CacheEntry(first, first + points, {
+        'oxygen': [[value * 0.5, (first + value) * 1000] for value in range(points)],
+        'count': [[value, (first + value) * 1000] for value in range(points)],
+    })
+
+
+class TestEncoding(unittest.TestCase):
+
+    def test_round_trip(self):
+        encoded = entry(10)
+        encoded.series['file name'] = [['text', 1000.5], [1.5, 2000]]
+
+        decoded = decode_entry(encode_entry(encoded))
+
+        self.assertEqual((encoded.first, encoded.last, encoded.series), (decoded.first, decoded.last, decoded.series))
+        self.assertIs(int, type(decoded.series['count'][0][0]), msg='Integers are kept as integers')
+
+
+class TestSharedMemoryBackend(unittest.TestCase):
+
+    def test_get_put(self):
+        backend = SharedMemoryBackend(2 ** 20, 4)
+        backend.put(('metrics', 'SELECT', 'sum', 1000), entry(10))
+
+        self.assertEqual(entry(10).series, backend.get(('metrics', 'SELECT', 'sum', 1000)).series)
+        self.assertIsNone(backend.get(('metrics', 'SELECT', 'sum', 2000)), msg='Unknown keys are missed')
+
+        backend.put(('metrics', 'SELECT', 'sum', 1000), entry(20))
+        self.assertEqual(20, backend.get(('metrics', 'SELECT', 'sum', 1000)).first, msg='Entries are replaced')
+
+        backend.remove(('metrics', 'SELECT', 'sum', 1000))
+        self.assertIsNone(backend.get(('metrics', 'SELECT', 'sum', 1000)))
+
+    def test_oldest_entries_are_evicted(self):
+        backend = SharedMemoryBackend(64 * 1024, 1)
+        for key in range(200):
+            backend.put(key, entry(key, 20))
+
+        self.assertIsNone(backend.get(0), msg='The oldest entries are overwritten')
+        self.assertEqual(199, backend.get(199).first, msg='The newest entries are kept')
+        self.assertLessEqual(backend.size, 64 * 1024, msg='The size is capped')
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'no fork support')
+    def test_shared_by_forked_processes(self):
+        backend = SharedMemoryBackend(2 ** 20, 4)
+
+        pid = os.fork()
+        if not pid:
+            backend.put('written by the child', entry(10))
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(entry(10).series, backend.get('written by the child').series)
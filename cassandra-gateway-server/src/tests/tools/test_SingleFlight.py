@@ -0,0 +1,63 @@
+import asyncio
+
+from tornado import testing
+
+from tools.SingleFlight import SingleFlight
+
+
+class TestSingleFlight(testing.AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.flights = SingleFlight()
+        self.calls = 0
+
+    async def _call(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return ['result']
+
+    @testing.gen_test
+    async def test_concurrent_calls_are_coalesced(self):
+        results = await asyncio.gather(*(self.flights.run('key', self._call) for _ in range(10)))
+
+        self.assertEqual([['result']] * 10, results, msg='Every caller gets the result')
+        self.assertEqual(1, self.calls, msg='The call is run once')
+        self.assertEqual((1, 9), (self.flights.executed, self.flights.coalesced))
+        self.assertEqual({}, self.flights.flights, msg='Landed calls are forgotten')
+
+        await self.flights.run('key', self._call)
+        self.assertEqual(2, self.calls, msg='Only calls in flight are shared')
+
+    @testing.gen_test
+    async def test_different_keys(self):
+        await asyncio.gather(self.flights.run('a', self._call), self.flights.run('b', self._call))
+
+        self.assertEqual(2, self.calls)
+
+    @testing.gen_test
+    async def test_errors_are_shared(self):
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError('failed')
+
+        results = await asyncio.gather(*(self.flights.run('key', fail) for _ in range(3)), return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, ValueError) for result in results), msg='Every caller gets the error')
+
+    @testing.gen_test
+    async def test_cancelled_callers(self):
+        first = asyncio.ensure_future(self.flights.run('key', self._call))
+        second = asyncio.ensure_future(self.flights.run('key', self._call))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        self.assertEqual(['result'], await second, msg='A cancelled caller does not cancel the call of others')
+
+        third = asyncio.ensure_future(self.flights.run('key', self._call))
+        await asyncio.sleep(0)
+        flight = self.flights.flights['key']
+        third.cancel()
+        with self.assertRaises(asyncio.CancelledError, msg='The call is cancelled once nobody waits for it'):
+            await flight.future
+        self.assertNotIn('key', self.flights.flights)
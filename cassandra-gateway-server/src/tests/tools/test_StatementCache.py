@@ -0,0 +1,96 @@
+import types
+import unittest
+
+from tornado import testing
+
+from tools.StatementCache import StatementCache, bind_macros
+from tests.fake_cassandra import FakePreparedStatement, FakeSession
+
+MACROS = {'startTime': 1000, 'endTime': 2000}
+
+
+class TestBindMacros(unittest.TestCase):
+
+    def test_macros_become_bind_markers(self):
+        template, parameters = bind_macros(
+            'SELECT * FROM t WHERE timestamp < $endTime AND timestamp > $startTime',
+            MACROS
+        )
+
+        self.assertEqual('SELECT * FROM t WHERE timestamp < ? AND timestamp > ?', template)
+        self.assertEqual([2000, 1000], parameters, msg='Parameters follow the bind markers order')
+
+    def test_literals_and_unknown_macros_are_kept(self):
+        query = "SELECT * FROM t WHERE name = '$startTime' AND serial = $serial AND timestamp > $startTime"
+        template, parameters = bind_macros(query, MACROS)
+
+        self.assertEqual("SELECT * FROM t WHERE name = '$startTime' AND serial = $serial AND timestamp > ?", template)
+        self.assertEqual([1000], parameters)
+
+    def test_same_template_for_every_range(self):
+        query = 'SELECT * FROM t WHERE timestamp > $startTime'
+
+        self.assertEqual(
+            bind_macros(query, MACROS)[0],
+            bind_macros(query, {'startTime': 42})[0],
+            msg='Time ranges do not change the template'
+        )
+
+
+class TestStatementCache(testing.AsyncTestCase):
+
+    @testing.gen_test
+    async def test_prepared_once(self):
+        session = FakeSession()
+        cache = StatementCache(2)
+
+        first = await cache.prepare(session, 'SELECT ?')
+        second = await cache.prepare(session, 'SELECT ?')
+
+        self.assertIs(first, second, msg='Same template, same prepared statement')
+        self.assertEqual(['SELECT ?'], session.prepared, msg='A template is prepared only once')
+        self.assertTrue(first.is_idempotent, msg='Read statements are idempotent')
+
+    @testing.gen_test
+    async def test_writes_are_not_idempotent(self):
+        session = FakeSession()
+        cache = StatementCache(2)
+
+        update = await cache.prepare(session, 'UPDATE counters SET hits = hits + 1 WHERE name = ?')
+        read = await cache.prepare(session, '  select * FROM counters WHERE name = ?')
+
+        self.assertFalse(update.is_idempotent, msg='Writes are never retried nor executed speculatively')
+        self.assertTrue(read.is_idempotent, msg='Reads are idempotent, whatever their case')
+
+    @testing.gen_test
+    async def test_lru_eviction(self):
+        session = FakeSession()
+        cache = StatementCache(2)
+
+        await cache.prepare(session, 'SELECT 1')
+        await cache.prepare(session, 'SELECT 2')
+        await cache.prepare(session, 'SELECT 1')
+        await cache.prepare(session, 'SELECT 3')
+        await cache.prepare(session, 'SELECT 1')
+        await cache.prepare(session, 'SELECT 2')
+
+        self.assertEqual(
+            ['SELECT 1', 'SELECT 2', 'SELECT 3', 'SELECT 2'],
+            session.prepared,
+            msg='The least recently used statement is evicted first'
+        )
+
+    @testing.gen_test
+    async def test_schema_change_invalidation(self):
+        column = ('keyspace', 'table', 'value', None)
+        session = FakeSession()
+        session.prepare = lambda query: FakePreparedStatement(query, [column])
+        session.cluster.metadata.keyspaces['keyspace'] = types.SimpleNamespace(tables={'table': object()})
+        cache = StatementCache(2)
+
+        first = await cache.prepare(session, 'SELECT ?')
+        self.assertIs(first, await cache.prepare(session, 'SELECT ?'))
+
+        session.cluster.metadata.keyspaces['keyspace'].tables['table'] = object()
+
+        self.assertIsNot(first, await cache.prepare(session, 'SELECT ?'), msg='Prepared again after a schema change')
@@ -0,0 +1,119 @@
+import asyncio
+from unittest import mock
+
+from tornado import testing
+
+from tools.TagIndex import IndexStore, TagIndex
+from tests.fake_cassandra import FakeSession
+
+DISTINCT_PARTITIONS = [[('sensor-1', '2024-01-01'), ('sensor-2', '2024-01-01')], [('sensor-1', '2024-01-02')]]
+NAMES = [[('oxygen',), ('pressure',)], [('oxygen',), (None,)]]
+DEVICES = [[(3,), (1,), (2,)]]
+
+
+def pages_factory(query, _):
+    if query == 'SELECT DISTINCT serial, day FROM metrics.data':
+        return DISTINCT_PARTITIONS
+    if query == 'SELECT name FROM metrics.data':
+        return NAMES
+    if query == 'SELECT DISTINCT id FROM metrics.devices':
+        return DEVICES
+    raise AssertionError(f'Unexpected query: {query}')
+
+
+def make_session(*args, **kwargs):
+    session = FakeSession(pages_factory, *args, keyspace='metrics', **kwargs)
+    session.add_table(
+        'metrics', 'data',
+        partition_key=[('serial', 'text'), ('day', 'text')],
+        clustering_key=[('name', 'text'), ('timestamp', 'bigint')],
+        columns=[('value', 'double')]
+    )
+    session.add_table('metrics', 'devices', partition_key=[('id', 'int')], columns=[('label', 'text')])
+    return session
+
+
+class TestTagIndex(testing.AsyncTestCase):
+
+    def test_keys(self):
+        self.assertEqual(
+            [
+                {'type': 'string', 'text': 'day'},
+                {'type': 'number', 'text': 'id'},
+                {'type': 'string', 'text': 'name'},
+                {'type': 'string', 'text': 'serial'},
+            ],
+            TagIndex(['name']).keys(make_session()),
+            msg='Partition key columns of every table and the indexed columns they have'
+        )
+
+    @testing.gen_test
+    async def test_refresh(self):
+        index = TagIndex(['name'])
+        session = make_session()
+
+        await index.refresh(session)
+
+        self.assertEqual(['sensor-1', 'sensor-2'], index.values('serial'))
+        self.assertEqual(['2024-01-01', '2024-01-02'], index.values('day'))
+        self.assertEqual(['oxygen', 'pressure'], index.values('name'), msg='Distinct values, without nulls')
+        self.assertEqual(['1', '2', '3'], index.values('id'), msg='Sorted by value, given as text')
+        self.assertEqual([], index.values('value'), msg='Other columns are not indexed')
+        self.assertEqual(3, len(session.executed), msg='One scan per partition key and per indexed column')
+
+    @testing.gen_test
+    async def test_bounded(self):
+        index = TagIndex(['name'], max_values=1, max_rows=2)
+        session = make_session()
+
+        await index.refresh(session)
+
+        self.assertEqual(1, len(index.values('serial')), msg='At most max_values values per column')
+        self.assertEqual(['oxygen'], index.values('name'), msg='Scans stop after max_rows rows')
+
+    @testing.gen_test
+    async def test_background_refresh(self):
+        index = TagIndex(['name'], refresh_interval=0.05)
+        session = make_session()
+
+        with mock.patch('tools.TagIndex.Client.get_client', return_value=session):
+            index.start()
+            await index.ready()
+            self.assertEqual(['sensor-1', 'sensor-2'], index.values('serial'), msg='Refreshed once started')
+            await asyncio.sleep(0.1)
+
+        self.assertGreater(len(session.executed), 3, msg='Refreshed again at regular intervals')
+
+
+class TestSharedTagIndex(testing.AsyncTestCase):
+
+    def test_store(self):
+        store = IndexStore(1024)
+
+        self.assertEqual((0, None), store.read(), msg='Nothing published yet')
+        self.assertTrue(store.write({'serial': ['sensor-1']}))
+        self.assertEqual((1, {'serial': ['sensor-1']}), store.read())
+        self.assertEqual((1, None), store.read(1), msg='A generation is only read once')
+
+        self.assertFalse(store.write({'serial': ['x' * 1024]}), msg='Too large to be shared')
+        self.assertEqual((2, {}), store.read(1), msg='An empty index is shared instead, no worker waits for it')
+
+    @testing.gen_test
+    async def test_first_worker_refreshes_for_all(self):
+        store = IndexStore(2 ** 20)
+        session = make_session()
+
+        with mock.patch('tools.TagIndex.Client.get_client', return_value=session), \
+                mock.patch('tools.TagIndex.SHARED_INDEX_POLL_INTERVAL', 0.01):
+            with mock.patch('tools.TagIndex.server.worker_id', 1):
+                follower = TagIndex(['name'], store=store)
+                follower.start()
+            with mock.patch('tools.TagIndex.server.worker_id', 0):
+                refresher = TagIndex(['name'], store=store)
+                refresher.start()
+            await refresher.ready()
+            await follower.ready()
+
+        self.assertEqual(3, len(session.executed), msg='The tables are scanned by the first worker only')
+        self.assertEqual(refresher.index, follower.index, msg='The other workers read the index it published')
+        self.assertEqual(['oxygen', 'pressure'], follower.values('name'))
@@ -0,0 +1,166 @@
+import unittest
+
+from collections import namedtuple
+
+from tools.ResultPage import ResultPage
+from tools.TimeSeries import IntervalAggregator, TableBuilder, TimeserieBuilder, fill_datapoints, numpy
+
+cassandraRow = namedtuple('row', ['timestamp', 'name', 'value'])
+
+
+class TestTimeserieBuilder(unittest.TestCase):
+
+    rows = [
+        cassandraRow(timestamp=(1000 + i * 100) * 1000, name=name, value=i)
+        for i in range(50) for name in ('oxygen', 'laser')
+    ]
+
+    def test_pages_are_aggregated_incrementally(self):
+        whole = TimeserieBuilder('sum', 1000)
+        whole.add_rows(self.rows)
+
+        paged = TimeserieBuilder('sum', 1000)
+        for i in range(0, len(self.rows), 7):
+            paged.add_rows(self.rows[i:i + 7])
+
+        self.assertEqual(whole.results(), paged.results(), msg='Paging does not change the results')
+
+    def test_tuple_pages(self):
+        page = ResultPage(cassandraRow._fields, [tuple(row) for row in self.rows])
+
+        for builder_class in (TimeserieBuilder, TableBuilder):
+            from_tuples = builder_class()
+            from_tuples.add_rows(page)
+            from_namedtuples = builder_class()
+            from_namedtuples.add_rows(self.rows)
+
+            self.assertEqual(
+                from_namedtuples.results(),
+                from_tuples.results(),
+                msg='Tuple rows are decoded by column position'
+            )
+
+    def test_changes_of_paged_values(self):
+        builder = TimeserieBuilder('on changes', value_type='double')
+        values = [1.0, 1.0, 1.0, 2.0, 2.0, 3.0, 3.0, 3.0, 1.0]
+        rows = [(1000 * (i + 1), 'oxygen', value) for i, value in enumerate(values)]
+        builder.add_rows(ResultPage(cassandraRow._fields, rows[:4]))
+        builder.add_rows(ResultPage(cassandraRow._fields, rows[4:]))
+
+        self.assertEqual(
+            [{'target': 'oxygen', 'datapoints': [[1.0, 1.0], [2.0, 4.0], [3.0, 6.0], [1.0, 9.0]]}],
+            builder.results(),
+            msg='Only the changes are kept, across pages'
+        )
+
+    def test_float_values_are_kept(self):
+        builder = TimeserieBuilder(value_type='double')
+        builder.add_rows(ResultPage(cassandraRow._fields, [(1000, 'oxygen', 0.5), (2000, 'oxygen', None)]))
+
+        self.assertEqual([{'target': 'oxygen', 'datapoints': [[0.5, 1.0]]}], builder.results())
+
+    def test_only_the_current_interval_is_buffered(self):
+        aggregator = IntervalAggregator('sum', 1000)
+        for i in range(100):
+            aggregator.add(1.0, 1000 + i * 100)
+            self.assertLessEqual(len(aggregator.buffer), 10, msg='At most one interval of values is buffered')
+
+    def test_str_values_are_not_aggregated(self):
+        builder = TimeserieBuilder('sum', 1000)
+        builder.add_rows([
+            cassandraRow(timestamp=1000000, name='file name', value='text'),
+            cassandraRow(timestamp=1100000, name='file name', value='other text'),
+        ])
+
+        self.assertEqual(
+            [{'target': 'file name', 'datapoints': [['text', 1000.0], ['other text', 1100.0]]}],
+            builder.results(),
+            msg='Text values are kept as they are'
+        )
+
+
+class TestIntervalAggregator(unittest.TestCase):
+
+    def _aggregate(self, points, fill='none', time_range=None):
+        aggregator = IntervalAggregator('sum', 1000, fill, time_range)
+        for value, timestamp in points:
+            aggregator.add(value, timestamp)
+        return aggregator.finish()
+
+    def test_aligned_intervals(self):
+        points = [[1, 1500], [2, 1999], [3, 2000], [4, 4100]]
+
+        self.assertEqual(
+            [[3, 1000], [3, 2000], [4, 4000]],
+            self._aggregate(points),
+            msg='Intervals start on multiples of the interval and the last one is kept'
+        )
+
+    def test_shifted_ranges_give_same_intervals(self):
+        points = [[i, 1000 + i * 100] for i in range(100)]
+
+        self.assertEqual(
+            self._aggregate(points[3:])[1:],
+            self._aggregate(points)[1:],
+            msg='Complete intervals do not depend on the first queried point'
+        )
+
+    def test_fill_modes(self):
+        points = [[1, 1000], [2, 3000]]
+        time_range = (500, 5500)
+
+        self.assertEqual([[1, 1000], [2, 3000]], self._aggregate(points, 'none', time_range))
+        self.assertEqual(
+            [[None, 0], [1, 1000], [None, 2000], [2, 3000], [None, 4000], [None, 5000]],
+            self._aggregate(points, 'null', time_range)
+        )
+        self.assertEqual(
+            [[0, 0], [1, 1000], [0, 2000], [2, 3000], [0, 4000], [0, 5000]],
+            self._aggregate(points, 'zero', time_range)
+        )
+        self.assertEqual(
+            [[None, 0], [1, 1000], [1, 2000], [2, 3000], [2, 4000], [2, 5000]],
+            self._aggregate(points, 'previous', time_range)
+        )
+
+    def test_fill_without_range(self):
+        self.assertEqual(
+            [[1, 1000], [None, 2000], [2, 3000]],
+            fill_datapoints([[1, 1000], [2, 3000]], 'null', 1000),
+            msg='Without time range, only the gaps between datapoints are filled'
+        )
+
+    def test_fill_float_timestamps(self):
+        self.assertEqual(
+            [[1, 1000.0], [None, 2000.0], [2, 3000.0]],
+            fill_datapoints([[1, 1000.0], [2, 3000.0]], 'null', 1000.0, (1000.0, 4000.0)),
+            msg='Timestamps and intervals from JSON numbers can be floats'
+        )
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestNumpyEngine(unittest.TestCase):
+
+    rows = [
+        cassandraRow(timestamp=(1000 + i * 130) * 1000, name=f'serie {i % 3}', value=(i * 7) % 11)
+        for i in range(500)
+    ]
+
+    def test_same_results_as_python(self):
+        for method in ('sum', 'minimum', 'maximum', 'and', 'or', 'count', 'average'):
+            python = TimeserieBuilder(method, 1000, 'python', 'previous', (0, 80000))
+            vectorized = TimeserieBuilder(method, 1000, 'numpy', 'previous', (0, 80000))
+            for i in range(0, len(self.rows), 64):
+                python.add_rows(self.rows[i:i + 64])
+                vectorized.add_rows(self.rows[i:i + 64])
+
+            expected = python.results()
+            results = vectorized.results()
+            for expected_serie, serie in zip(expected, results):
+                self.assertEqual(expected_serie['target'], serie['target'])
+                self.assertEqual(len(expected_serie['datapoints']), len(serie['datapoints']), msg=method)
+                for (expected_value, expected_timestamp), (value, timestamp) in zip(
+                        expected_serie['datapoints'], serie['datapoints']):
+                    self.assertAlmostEqual(expected_value, value, msg=method)
+                    self.assertEqual(type(expected_value), type(value), msg=method)
+                    self.assertEqual(expected_timestamp, timestamp, msg=method)
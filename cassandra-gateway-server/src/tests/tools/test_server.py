@@ -0,0 +1,114 @@
+import time
+import asyncio
+from unittest import mock
+
+from tornado import httpclient, httpserver, netutil, testing, web
+
+from handlers.BaseHandler import BaseHandler
+from tools import server
+
+
+class SlowHandler(BaseHandler):
+
+    async def get(self):
+        await asyncio.sleep(0.2)
+        self.write('done')
+
+
+class TestDrain(testing.AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        sockets = netutil.bind_sockets(0, '127.0.0.1')
+        self.port = sockets[0].getsockname()[1]
+        self.http_server = httpserver.HTTPServer(web.Application([(r'/slow', SlowHandler)]))
+        self.http_server.add_sockets(sockets)
+
+    def tearDown(self):
+        server.draining = False
+        self.http_server.stop()
+        super().tearDown()
+
+    def fetch(self):
+        return httpclient.AsyncHTTPClient().fetch(f'http://127.0.0.1:{self.port}/slow', raise_error=False)
+
+    @testing.gen_test
+    async def test_in_flight_requests_are_answered(self):
+        request = asyncio.ensure_future(self.fetch())
+        await asyncio.sleep(0.05)
+        self.assertEqual(1, BaseHandler.requests_in_flight, msg='The request is being served')
+
+        remaining = await server.drain(self.http_server, lambda: BaseHandler.requests_in_flight, timeout=5)
+
+        self.assertEqual(0, remaining, msg='Drained before the timeout')
+        self.assertTrue(server.draining, msg='Health checks report the worker as stopping')
+        response = await request
+        self.assertEqual(200, response.code, msg='The in-flight request is answered')
+        self.assertEqual(b'done', response.body)
+
+        with self.assertRaises(ConnectionRefusedError, msg='New connections are refused'):
+            await self.fetch()
+
+    @testing.gen_test
+    async def test_drain_timeout(self):
+        request = asyncio.ensure_future(self.fetch())
+        await asyncio.sleep(0.05)
+
+        remaining = await server.drain(self.http_server, lambda: BaseHandler.requests_in_flight, timeout=0.05)
+
+        self.assertEqual(1, remaining, msg='The request was still in flight after the timeout')
+        with self.assertRaises(httpclient.HTTPClientError, msg='Its connection got closed'):
+            await request
+        await asyncio.sleep(0.2)  # the handler finishes meanwhile
+
+
+class TestProcessStart(testing.AsyncTestCase):
+
+    def test_process_start(self):
+        age = time.monotonic() - server.process_start()
+
+        self.assertGreater(age, 0.01, msg='The process started before this test, its imports took time')
+        self.assertLess(age, 3600)
+
+    def test_unknown_process_start(self):
+        with mock.patch('builtins.open', side_effect=OSError):
+            self.assertAlmostEqual(time.monotonic(), server.process_start(), delta=1, msg='Now when unknown')
+
+
+class TestWorkerCount(testing.AsyncTestCase):
+
+    def test_not_forked(self):
+        with mock.patch.object(server, 'fork', False):
+            self.assertEqual(1, server.worker_count())
+
+    def test_configured_workers(self):
+        with mock.patch.object(server, 'fork', True), mock.patch.object(server, 'workers', 3):
+            self.assertEqual(3, server.worker_count())
+
+    def test_one_worker_per_cpu(self):
+        with mock.patch.object(server, 'fork', True), mock.patch.object(server, 'workers', 0), \
+                mock.patch('tools.server.process.cpu_count', return_value=4):
+            self.assertEqual(4, server.worker_count())
+
+
+class TestSupervisor(testing.AsyncTestCase):
+
+    def test_workers_drain_when_too_many_crashed(self):
+        supervisor = server.Supervisor(3)
+        supervisor.children = {101: 0, 102: 1, 103: 2}
+        exits = [(101, 256), (102, 0), (103, 0)]
+        killed = []
+
+        with mock.patch.object(server, 'max_restarts', 0), \
+                mock.patch('tools.server.os.waitpid', side_effect=lambda *_: exits.pop(0)) as waitpid, \
+                mock.patch('tools.server.os.kill', side_effect=lambda pid, signum: killed.append((pid, signum))):
+            with self.assertRaises(RuntimeError):
+                supervisor._reap()
+
+        self.assertEqual(
+            [(102, server.signal.SIGTERM), (103, server.signal.SIGTERM)],
+            killed,
+            msg='The remaining workers drain as on SIGTERM'
+        )
+        self.assertEqual({}, supervisor.children, msg='They are reaped before the supervisor exits')
+        self.assertEqual(3, waitpid.call_count)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionControl:
+    """
+    Bounded number of requests served at once by a worker process, with a short wait queue.
+
+    Requests are admitted while a slot is free, then queued in arrival order. They are rejected when
+    the queue is full or when they waited too long for a slot. Some slots can be reserved to small requests,
+    so they are not starved by large ones.
+    """
+
+    def __init__(self, slots: int, queue_size: int, queue_timeout: float, reserved_slots: int = 0):
+        """
+        :param slots: requests served at once
+        :param queue_size: requests waiting for a slot at most
+        :param queue_timeout: seconds a request may wait for a slot
+        :param reserved_slots: slots only given to small requests
+        """
+        self.slots = slots
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.reserved_slots = min(reserved_slots, slots - 1)
+        self.in_flight = 0
+        self.large_in_flight = 0
+        self.waiters = deque()  # (future resolved once a slot is given, small request)
+        self.rejected = {'queue_full': 0, 'queue_timeout': 0}
+
+    @property
+    def queued(self):
+        return len(self.waiters)
+
+    def _has_slot(self, small: bool):
+        if self.in_flight >= self.slots:
+            return False
+        return small or self.large_in_flight < self.slots - self.reserved_slots
+
+    def _take_slot(self, small: bool):
+        self.in_flight += 1
+        if not small:
+            self.large_in_flight += 1
+
+    def _grant(self):
+        # the first waiting request able to use the free slot gets it
+        for waiter in self.waiters:
+            future, small = waiter
+            if self._has_slot(small):
+                self.waiters.remove(waiter)
+                self._take_slot(small)
+                future.set_result(True)
+                return True
+        return False
+
+    def _leave_queue(self, waiter):
+        """
+        :return: True if a slot was given to the waiter meanwhile
+        """
+        future, _ = waiter
+        if future.done():
+            return True
+        self.waiters.remove(waiter)
+        future.cancel()
+        return False
+
+    async def acquire(self, small: bool = False):
+        """
+        Wait for a slot.
+
+        :param small: the request may use the reserved slots
+        :return: True once the request got a slot, to be released, False if it is rejected
+        """
+        if self._has_slot(small):
+            self._take_slot(small)
+            return True
+
+        if len(self.waiters) >= self.queue_size:
+            self.rejected['queue_full'] += 1
+            return False
+
+        waiter = (asyncio.get_event_loop().create_future(), small)
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[0]), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not self._leave_queue(waiter):
+                self.rejected['queue_timeout'] += 1
+                return False
+        except asyncio.CancelledError:
+            if self._leave_queue(waiter):
+                self.release(small)
+            raise
+        return True
+
+    def release(self, small: bool = False):
+        """
+        Give a slot back, to the next waiting request able to use it.
+
+        :param small: the slot was acquired by a small request
+        """
+        self.in_flight -= 1
+        if not small:
+            self.large_in_flight -= 1
+        while self._grant():
+            pass
@@ -2,11 +2,21 @@
 
 import os
 import ssl
+import time
+import asyncio
+import threading
 import logging
 import configparser
-from cassandra.cluster import Cluster
+from cassandra import ConsistencyLevel, InvalidRequest
+from cassandra.cluster import EXEC_PROFILE_DEFAULT, Cluster, ExecutionProfile
+from cassandra.connection import locally_supported_compressions
+from cassandra.query import PreparedStatement
 from cassandra.auth import PlainTextAuthProvider
-from cassandra.policies import DCAwareRoundRobinPolicy
+from cassandra.policies import ConstantSpeculativeExecutionPolicy, DCAwareRoundRobinPolicy, HostDistance
+from cassandra.policies import TokenAwarePolicy
+from tools.Metrics import Metrics
+from tools.ResultPage import page_factory
+from tools.StatementCache import StatementCache, bind_macros
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +33,32 @@ settings = config['CASSANDRA']
 cassandra_contact_points = settings.get('CONTACT_POINTS', fallback='localhost').split(',')
 cassandra_port = settings.getint('PORT', fallback=9042)
 
+cassandra_protocol_version = settings.getint('PROTOCOL_VERSION', fallback=None)
+cassandra_connect_timeout = settings.getfloat('CONNECT_TIMEOUT', fallback=5)
+
+# connection pools
+cassandra_executor_threads = settings.getint('EXECUTOR_THREADS', fallback=2)
+cassandra_core_connections = settings.getint('CORE_CONNECTIONS_PER_HOST', fallback=None)  # protocol v1 and v2 only
+cassandra_max_connections = settings.getint('MAX_CONNECTIONS_PER_HOST', fallback=None)  # protocol v1 and v2 only
+cassandra_reconnect_delay = settings.getfloat('RECONNECT_DELAY', fallback=10)  # in seconds
+
+# rows fetched per page, results are consumed one page at a time
+cassandra_fetch_size = settings.getint('FETCH_SIZE', fallback=5000)
+
+# query routing and execution
+cassandra_token_aware = settings.getboolean('TOKEN_AWARE', fallback=True)  # coordinator picked among the replicas
+cassandra_speculative_delay = settings.getfloat('SPECULATIVE_EXECUTION_DELAY', fallback=0)  # in seconds, 0 disables
+cassandra_speculative_attempts = settings.getint('SPECULATIVE_EXECUTION_ATTEMPTS', fallback=1)  # extra executions
+cassandra_consistency = settings.get('CONSISTENCY', fallback='LOCAL_ONE').upper()
+cassandra_request_timeout = settings.getfloat('REQUEST_TIMEOUT', fallback=10)  # in seconds, per page
+cassandra_compression = settings.get('COMPRESSION', fallback='lz4').lower()  # one of COMPRESSIONS
+
+# prepared statements
+cassandra_prepared_statements = settings.getint('PREPARED_STATEMENTS_CACHE_SIZE', fallback=512)
+# queries prepared by each worker process before it serves requests, one per line
+cassandra_warm_up_queries = [query.strip() for query in settings.get('WARM_UP_QUERIES', fallback='').splitlines()
+                             if query.strip()]
+
 # auth
 cassandra_username = settings.get('USERNAME', fallback=None)
 cassandra_password = settings.get('PASSWORD', fallback=None)
@@ -37,6 +73,26 @@ cassandra_ssl_cert_file = settings.get('SSL_CERT_FILE', fallback=None)
 cassandra_ssl_key_file = settings.get('SSL_KEY_FILE', fallback=None)
 cassandra_ssl_password = settings.get('SSL_PASSWORD', fallback=None)
 
+# protocol compressions, 'none' to disable it
+COMPRESSIONS = ('lz4', 'snappy', 'none')
+
+
+def check_settings(consistency: str, compression: str):
+    """
+    :param consistency: a consistency level name, from the settings
+    :param compression: a protocol compression, from the settings
+    :raise ValueError: if one of them is unknown
+    """
+    if consistency not in ConsistencyLevel.name_to_value:
+        raise ValueError(
+            f'Unknown consistency level {consistency!r}, expected one of: {", ".join(ConsistencyLevel.name_to_value)}'
+        )
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression {compression!r}, expected one of: {", ".join(COMPRESSIONS)}')
+
+
+check_settings(cassandra_consistency, cassandra_compression)
+
 cassandra_ssl = None
 if cassandra_use_ssl:
     cassandra_ssl = ssl.SSLContext(ssl.PROTOCOL_TLS)
@@ -47,12 +103,63 @@ if cassandra_use_ssl:
     )
 
 
+def make_execution_profile():
+    """
+    Execution profile of the gateway queries, from the settings.
+
+    :return: the execution profile
+    """
+    load_balancing_policy = DCAwareRoundRobinPolicy(local_dc=cassandra_local_datacenter)
+    if cassandra_token_aware:
+        # prepared statements carry their routing key, replicas coordinate their own queries
+        load_balancing_policy = TokenAwarePolicy(load_balancing_policy, shuffle_replicas=True)
+
+    speculative_execution_policy = None
+    if cassandra_speculative_delay > 0:
+        # only idempotent statements are executed speculatively, every prepared SELECT is
+        speculative_execution_policy = ConstantSpeculativeExecutionPolicy(
+            cassandra_speculative_delay,
+            cassandra_speculative_attempts
+        )
+
+    return ExecutionProfile(
+        load_balancing_policy=load_balancing_policy,
+        speculative_execution_policy=speculative_execution_policy,
+        consistency_level=ConsistencyLevel.name_to_value[cassandra_consistency],
+        request_timeout=cassandra_request_timeout,
+        # rows as tuples, columns are looked up by position once per page
+        row_factory=page_factory
+    )
+
+
+def get_compression():
+    """
+    :return: the protocol compression setting of the cluster
+    """
+    if cassandra_compression == 'none':
+        return False
+    if cassandra_compression not in locally_supported_compressions:
+        logger.warning(f'{cassandra_compression} compression is not available, the driver picks another one')
+        return True
+    return cassandra_compression
+
+
 class Client:
     """
     Cassandra client.
+
+    Hold one cluster connection and one session per keyspace for the current process.
+    Sessions are long-lived and shared by every request served by this process.
     """
 
     cassandra_connection = None
+    sessions = {}
+    statements = StatementCache(cassandra_prepared_statements)
+    owner_pid = None
+    last_connection_time = 0
+    # connections being opened in an executor, by keyspace, shared by the requests waiting for them
+    pending = {}
+    connect_lock = threading.Lock()
 
     @classmethod
     def _open_connection(cls):
@@ -68,34 +175,270 @@ class Client:
             password=cassandra_password
         )
 
+        cluster_settings = {}
+        if cassandra_protocol_version:
+            cluster_settings['protocol_version'] = cassandra_protocol_version
+
         cls.cassandra_connection = Cluster(
             cassandra_contact_points,
             port=cassandra_port,
             auth_provider=auth_provider,
             ssl_context=cassandra_ssl,
-            load_balancing_policy=DCAwareRoundRobinPolicy(local_dc=cassandra_local_datacenter)
+            execution_profiles={EXEC_PROFILE_DEFAULT: make_execution_profile()},
+            compression=get_compression(),
+            executor_threads=cassandra_executor_threads,
+            connect_timeout=cassandra_connect_timeout,
+            **cluster_settings
         )
 
+        if cassandra_protocol_version and cassandra_protocol_version < 3:
+            # pool sizes are only configurable with protocol v1 and v2, v3+ always use one connection per host
+            if cassandra_core_connections:
+                cls.cassandra_connection.set_core_connections_per_host(HostDistance.LOCAL, cassandra_core_connections)
+            if cassandra_max_connections:
+                cls.cassandra_connection.set_max_connections_per_host(HostDistance.LOCAL, cassandra_max_connections)
+        elif cassandra_core_connections or cassandra_max_connections:
+            logger.warning('Connections per host settings are ignored with protocol v3 and above')
+
+        cls.owner_pid = os.getpid()
+        cls.last_connection_time = time.monotonic()
+
+    @classmethod
+    def is_healthy(cls):
+        """
+        Tell if at least one cassandra host is known to be up.
+
+        :return: True if queries can be sent to the cluster
+        """
+        return any(host.is_up for host in cls.cassandra_connection.metadata.all_hosts())
+
+    @classmethod
+    def _ready_session(cls, keyspace: str):
+        """
+        :param keyspace: the keyspace the session is bound to
+        :return: the session of the keyspace if it can be used as is, None if (re)connecting is needed
+        """
+        if cls.owner_pid != os.getpid() or not cls.cassandra_connection or cls.cassandra_connection.is_shutdown:
+            return None
+        if not cls.is_healthy() and time.monotonic() - cls.last_connection_time > cassandra_reconnect_delay:
+            return None
+        session = cls.sessions.get(keyspace)
+        if not session or session.is_shutdown:
+            return None
+        return session
+
+    @classmethod
+    async def get_client(cls, keyspace: str = cassandra_keyspace):
+        """
+        Return the session bound to a keyspace, ready to perform query.
+
+        Sessions are created once per process and per keyspace, then reused by every request.
+        Connecting is blocking, it runs in an executor: concurrent requests wait for the same connection.
+
+        :param keyspace: the keyspace the session is bound to
+        :return: A cassandra session, ready to perform query
+        """
+        session = cls._ready_session(keyspace)
+        if session:
+            return session
+
+        if keyspace not in cls.pending:
+            loop = asyncio.get_event_loop()
+            cls.pending[keyspace] = loop.run_in_executor(None, cls.connect, keyspace)
+
+        future = cls.pending[keyspace]
+        try:
+            # shielded, a cancelled request must not cancel the connection shared with others
+            return await asyncio.shield(future)
+        finally:
+            if cls.pending.get(keyspace) is future:
+                del cls.pending[keyspace]
+
     @classmethod
-    def get_client(cls):
+    def connect(cls, keyspace: str = cassandra_keyspace):
         """
-        Create a client connection and return it.
+        Return the session bound to a keyspace, blocking while connecting.
 
-        Take care of creating the pool connection to the cluster if needed.
+        Take care of creating the pool connection to the cluster and the session if needed,
+        and of reconnecting when no host of the cluster is up anymore.
 
-        :return: A cassandra client connection, ready to perform query
+        :param keyspace: the keyspace the session is bound to
+        :return: A cassandra session, ready to perform query
         """
+        with cls.connect_lock:
+            return cls._connect(keyspace)
+
+    @classmethod
+    def _connect(cls, keyspace: str):
+        if cls.owner_pid != os.getpid():
+            # inherited through a fork, the driver threads and sockets belong to the parent process
+            cls.cassandra_connection = None
+            cls.sessions = {}
+            cls.statements.invalidate()
+
+        if cls.cassandra_connection and not cls.cassandra_connection.is_shutdown and not cls.is_healthy() \
+                and time.monotonic() - cls.last_connection_time > cassandra_reconnect_delay:
+            logger.warning('No cassandra host is up, reconnecting to the cluster')
+            cls.close_connection()
+
         if not cls.cassandra_connection or cls.cassandra_connection.is_shutdown:
             cls.close_connection()
             cls._open_connection()
-        return cls.cassandra_connection.connect(cassandra_keyspace)
+
+        session = cls.sessions.get(keyspace)
+        if not session or session.is_shutdown:
+            session = cls.cassandra_connection.connect(keyspace)
+            session.default_fetch_size = cassandra_fetch_size
+            cls.sessions[keyspace] = session
+        return session
+
+    @classmethod
+    async def prepare(cls, session, query: str, macros: dict):
+        """
+        Turn the macros of a query into bind markers and prepare it.
+
+        :param session: the cassandra session to prepare with
+        :param query: the query, with its macros
+        :param macros: macro values by name
+        :return: the prepared statement and its parameters
+        """
+        template, parameters = bind_macros(query, macros)
+        statement = await cls.statements.prepare(session, template)
+        return statement, parameters
+
+    @classmethod
+    async def warm_up(cls, templates: list):
+        """
+        Open the connection pools and the session of the default keyspace, then prepare query templates,
+        so the first requests do not wait for them.
+
+        :param templates: queries with bind markers to prepare
+        :return: the session
+        """
+        session = await cls.get_client()
+        await asyncio.gather(*(cls.statements.prepare(session, template) for template in templates))
+        return session
 
     @classmethod
     def close_connection(cls):
         """
-        Close all remaining connection properly if any.
+        Close all remaining sessions and connection properly if any.
         """
+        if cls.owner_pid != os.getpid():
+            # inherited through a fork, nothing to shut down in this process
+            cls.cassandra_connection = None
+            cls.sessions = {}
+            cls.statements.invalidate()
+            return
+
+        for session in cls.sessions.values():
+            session.shutdown()
+        cls.sessions = {}
+        cls.statements.invalidate()
+
         if not cls.cassandra_connection:
             return
         cls.cassandra_connection.shutdown()
         cls.cassandra_connection = None
+
+
+class ResultPager:
+    """
+    Asynchronous iterator over the pages of a driver ResponseFuture.
+
+    Driver callbacks run in the driver IO thread, results are handed back to the event loop
+    so they can be awaited without blocking it. The next page is fetched while the current one is consumed.
+    """
+
+    def __init__(self, response_future):
+        self.loop = asyncio.get_event_loop()
+        self.response_future = response_future
+        self.page = self.loop.create_future()
+        response_future.add_callbacks(self._on_page, self._on_error)
+
+    def _on_page(self, rows):
+        self.loop.call_soon_threadsafe(self._resolve, rows, None)
+
+    def _on_error(self, exception):
+        self.loop.call_soon_threadsafe(self._resolve, None, exception)
+
+    def _resolve(self, rows, exception):
+        if not self.page or self.page.done():
+            # no one is waiting for this page anymore
+            return
+        if exception:
+            self.page.set_exception(exception)
+        else:
+            self.page.set_result(rows)
+
+    def close(self):
+        """
+        Stop paging, a page requested from cassandra is dropped when it comes.
+
+        :return: True if a page was still awaited
+        """
+        if not self.page:
+            return False
+        self.response_future.clear_callbacks()
+        # a cancelled page was awaited by a cancelled consumer
+        awaited = not self.page.done() or self.page.cancelled()
+        self.page = None
+        return awaited
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.page:
+            raise StopAsyncIteration
+
+        rows = await self.page
+
+        if self.response_future.has_more_pages:
+            self.page = self.loop.create_future()
+            self.response_future.start_fetching_next_page()
+        else:
+            self.page = None
+
+        return rows
+
+
+async def iterate_pages(session, query, parameters=None):
+    """
+    Execute a query without blocking the event loop, yielding its result one page at a time.
+
+    The page size is the session fetch size.
+
+    :param session: the cassandra session to use
+    :param query: the query to execute
+    :param parameters: the query parameters if any
+    :return: an asynchronous iterator over the result pages
+    """
+    pager = ResultPager(session.execute_async(query, parameters))
+    try:
+        async for page in pager:
+            yield page
+    except InvalidRequest:
+        if isinstance(query, PreparedStatement):
+            # may have been prepared against an outdated schema
+            Client.statements.invalidate(session, query.query_string)
+        raise
+    finally:
+        # cancelled or left before the last page, no more page is fetched
+        if pager.close():
+            Metrics.increment('cassandra_gateway_cancelled_queries_total')
+
+
+async def execute_async(session, query, parameters=None):
+    """
+    Execute a query without blocking the event loop.
+
+    :param session: the cassandra session to use
+    :param query: the query to execute
+    :param parameters: the query parameters if any
+    :return: all the rows of the query result
+    """
+    rows = []
+    async for page in iterate_pages(session, query, parameters):
+        rows.extend(page)
+    return rows
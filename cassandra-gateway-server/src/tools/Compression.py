@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import os
+import zlib
+import logging
+import configparser
+from tornado import web
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # optional, `br` content encoding
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, `zstd` content encoding
+    zstandard = None
+
+# load SERVER settings
+config = configparser.ConfigParser()
+config.read(os.getenv('SETTINGS_FILE', './settings.ini'))
+
+if 'SERVER' not in config:
+    raise ValueError('No [SERVER] section inside the settings file')
+
+settings = config['SERVER']
+# content encodings by preference, the first one accepted by the client is used, those not installed are left out
+response_compression = [
+    encoding.strip().lower()
+    for encoding in settings.get('RESPONSE_COMPRESSION', fallback='zstd,br,gzip').split(',')
+    if encoding.strip() and encoding.strip().lower() != 'none'
+]
+# in bytes, answers written at once and shorter than that are not compressed
+compression_threshold = settings.getint('RESPONSE_COMPRESSION_THRESHOLD', fallback=1024)
+
+# compressed media types, besides text/*
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/x-json',
+    'application/vnd.apache.arrow.stream',
+}
+
+# levels trading a little size for a lot less CPU, answers are compressed on the event loop
+GZIP_LEVEL = 1
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+
+class GzipCompressor:
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk: bytes, finishing: bool) -> bytes:
+        data = self.compressor.compress(chunk)
+        return data + self.compressor.flush(zlib.Z_FINISH if finishing else zlib.Z_SYNC_FLUSH)
+
+
+class BrotliCompressor:
+
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, chunk: bytes, finishing: bool) -> bytes:
+        data = self.compressor.process(chunk)
+        return data + (self.compressor.finish() if finishing else self.compressor.flush())
+
+
+class ZstdCompressor:
+
+    def __init__(self):
+        self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, chunk: bytes, finishing: bool) -> bytes:
+        data = self.compressor.compress(chunk)
+        if finishing:
+            return data + self.compressor.flush()
+        return data + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+
+# compressor of each content encoding, when its module is installed
+COMPRESSORS = {'gzip': GzipCompressor}
+if brotli:
+    COMPRESSORS['br'] = BrotliCompressor
+if zstandard:
+    COMPRESSORS['zstd'] = ZstdCompressor
+
+
+def accepted_encodings(header: str):
+    """
+    :param header: an Accept-Encoding header
+    :return: the content encodings the client accepts
+    """
+    accepted = set()
+    for item in header.split(','):
+        encoding, _, parameters = item.partition(';')
+        quality = 1.0
+        for parameter in parameters.split(';'):
+            name, _, value = parameter.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(encoding.strip().lower())
+    return accepted
+
+
+def choose_encoding(header: str, preferences: list = None):
+    """
+    :param header: the Accept-Encoding header of a request
+    :param preferences: content encodings by preference, RESPONSE_COMPRESSION by default
+    :return: the content encoding of the answer, None to leave it uncompressed
+    """
+    accepted = accepted_encodings(header or '')
+    for encoding in preferences if preferences is not None else response_compression:
+        if encoding in COMPRESSORS and (encoding in accepted or '*' in accepted):
+            return encoding
+    return None
+
+
+class ResponseCompression(web.OutputTransform):
+    """
+    Compress the answers with the content encoding preferred among those the client accepts:
+    zstd or br when their module is installed, gzip otherwise.
+
+    Streamed answers are compressed chunk by chunk, each chunk is flushed so the client can decode it right away.
+    An answer written at once is only compressed when longer than RESPONSE_COMPRESSION_THRESHOLD bytes.
+    """
+
+    def __init__(self, request):
+        self.encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        self.compressor = None
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        if 'Vary' in headers:
+            headers['Vary'] += ', Accept-Encoding'
+        else:
+            headers['Vary'] = 'Accept-Encoding'
+
+        content_type = headers.get('Content-Type', '').split(';')[0].strip()
+        if (
+            self.encoding
+            and (content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES)
+            and 'Content-Encoding' not in headers
+            and (not finishing or len(chunk) >= compression_threshold)
+        ):
+            headers['Content-Encoding'] = self.encoding
+            self.compressor = COMPRESSORS[self.encoding]()
+            chunk = self.transform_chunk(chunk, finishing)
+            if 'Content-Length' in headers:
+                # the length of the compressed answer is only known once it is written at once
+                if finishing:
+                    headers['Content-Length'] = str(len(chunk))
+                else:
+                    del headers['Content-Length']
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk, finishing):
+        if self.compressor:
+            chunk = self.compressor.compress(chunk, finishing)
+        return chunk
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:  # optional, vectorized downsampling
+    numpy = None
+
+# ways to reduce a serie to the datapoints a panel can draw, anything else keeps every datapoint
+DOWNSAMPLING_MODES = ('lttb', 'minmax')
+
+
+def _lttb_buckets(size: int, threshold: int):
+    """
+    :return: start index of each bucket of the points between the first and the last one, then the last index
+    """
+    every = (size - 2) / (threshold - 2)
+    return [int(bucket * every) + 1 for bucket in range(threshold - 2)] + [size - 1]
+
+
+def lttb_python(values: list, timestamps: list, threshold: int):
+    """
+    Largest triangle three buckets, in pure python.
+
+    :param values: the values, in time order
+    :param timestamps: their timestamps
+    :param threshold: points kept, 3 at least
+    :return: indexes of the kept points
+    """
+    size = len(values)
+    edges = _lttb_buckets(size, threshold)
+    selected = [0]
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # the third point is the average of the next bucket, the last point for the last bucket
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else size
+        count = next_end - end
+        average_x = sum(timestamps[end:next_end]) / count
+        average_y = sum(values[end:next_end]) / count
+
+        previous_x, previous_y = timestamps[previous], values[previous]
+        largest = -1
+        for index in range(start, end):
+            area = abs(
+                (previous_x - average_x) * (values[index] - previous_y)
+                - (previous_x - timestamps[index]) * (average_y - previous_y)
+            )
+            if area > largest:
+                largest = area
+                previous = index
+        selected.append(previous)
+    selected.append(size - 1)
+    return selected
+
+
+def lttb_numpy(values, timestamps, threshold: int):
+    """
+    Largest triangle three buckets, the areas of the points of a bucket computed at once.
+
+    :param values: numpy array of the values, in time order
+    :param timestamps: numpy array of their timestamps
+    :param threshold: points kept, 3 at least
+    :return: numpy array of the indexes of the kept points
+    """
+    size = len(values)
+    # relative timestamps, to keep the precision of the areas
+    timestamps = timestamps - timestamps[0]
+    edges = numpy.array(_lttb_buckets(size, threshold))
+
+    # averages of every bucket, the last point being the last bucket
+    counts = numpy.diff(numpy.append(edges, size))
+    average_x = numpy.add.reduceat(timestamps, edges) / counts
+    average_y = numpy.add.reduceat(values, edges) / counts
+
+    selected = numpy.empty(threshold, dtype=numpy.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        previous_x, previous_y = timestamps[previous], values[previous]
+        areas = numpy.abs(
+            (previous_x - average_x[bucket + 1]) * (values[start:end] - previous_y)
+            - (previous_x - timestamps[start:end]) * (average_y[bucket + 1] - previous_y)
+        )
+        previous = selected[bucket + 1] = start + int(numpy.argmax(areas))
+    return selected
+
+
+def _minmax_bucket_count(max_points: int):
+    # the minimum and the maximum of each bucket, along with the first and the last points
+    return max(1, (max_points - 2) // 2)
+
+
+def minmax_python(values: list, timestamps: list, max_points: int):
+    """
+    Minimum and maximum per time bucket, in pure python.
+
+    :param values: the values, in time order
+    :param timestamps: their timestamps
+    :param max_points: points kept at most, two per bucket along with the first and the last points
+    :return: indexes of the kept points
+    """
+    buckets = _minmax_bucket_count(max_points)
+    first, span = timestamps[0], timestamps[-1] - timestamps[0]
+
+    selected = {0, len(values) - 1}
+    bucket_min = bucket_max = None
+    current = None
+    for index, timestamp in enumerate(timestamps):
+        bucket = min(int((timestamp - first) * buckets / span), buckets - 1) if span else 0
+        if bucket != current:
+            selected.update(extreme for extreme in (bucket_min, bucket_max) if extreme is not None)
+            bucket_min = bucket_max = index
+            current = bucket
+        elif values[index] < values[bucket_min]:
+            bucket_min = index
+        elif values[index] > values[bucket_max]:
+            bucket_max = index
+    selected.update((bucket_min, bucket_max))
+    return sorted(selected)
+
+
+def minmax_numpy(values, timestamps, max_points: int):
+    """
+    Minimum and maximum per time bucket, every bucket reduced at once.
+
+    :param values: numpy array of the values, in time order
+    :param timestamps: numpy array of their timestamps
+    :param max_points: points kept at most, two per bucket along with the first and the last points
+    :return: numpy array of the indexes of the kept points
+    """
+    buckets = _minmax_bucket_count(max_points)
+    span = timestamps[-1] - timestamps[0]
+    if span:
+        bucket_ids = numpy.minimum(((timestamps - timestamps[0]) * (buckets / span)).astype(numpy.int64), buckets - 1)
+    else:
+        bucket_ids = numpy.zeros(len(values), dtype=numpy.int64)
+
+    # index of the first point of each bucket holding points
+    starts = numpy.append(0, numpy.flatnonzero(numpy.diff(bucket_ids)) + 1)
+    counts = numpy.diff(numpy.append(starts, len(values)))
+
+    selected = [numpy.array([0, len(values) - 1])]
+    for reducer in (numpy.fmin, numpy.fmax):
+        extremes = numpy.repeat(reducer.reduceat(values, starts), counts)
+        # the first point of each bucket reaching its extreme value
+        candidates = numpy.flatnonzero(values == extremes)
+        _, first = numpy.unique(bucket_ids[candidates], return_index=True)
+        selected.append(candidates[first])
+    return numpy.unique(numpy.concatenate(selected))
+
+
+def downsample(values: list, timestamps: list, max_points: int, mode: str):
+    """
+    Reduce a serie to the datapoints a panel can draw, keeping its shape.
+
+    - 'lttb': largest triangle three buckets, the points forming the largest triangles with their neighbours,
+      `max_points` points;
+    - 'minmax': the lowest and the highest points of each time bucket, as a panel draws them per pixel.
+
+    Series of text values or of at most `max_points` datapoints are kept as they are.
+
+    :param values: the values, in time order
+    :param timestamps: their timestamps, in milliseconds
+    :param max_points: datapoints the panel asks for at most, its `maxDataPoints`
+    :param mode: 'lttb' or 'minmax', anything else keeps every datapoint
+    :return: the kept values and their timestamps
+    """
+    if mode not in DOWNSAMPLING_MODES or not max_points or len(values) <= max(max_points, 3):
+        return values, timestamps
+    max_points = max(max_points, 3)
+
+    if numpy is not None:
+        try:
+            value_array = numpy.fromiter(values, dtype=float, count=len(values))
+        except (TypeError, ValueError):
+            # text values are not downsampled
+            return values, timestamps
+        timestamp_array = numpy.fromiter(timestamps, dtype=float, count=len(timestamps))
+        if mode == 'lttb':
+            selected = lttb_numpy(value_array, timestamp_array, max_points)
+        else:
+            selected = minmax_numpy(value_array, timestamp_array, max_points)
+        return value_array[selected].tolist(), timestamp_array[selected].tolist()
+
+    if not all(isinstance(value, (int, float)) for value in values):
+        # text values are not downsampled
+        return values, timestamps
+    if mode == 'lttb':
+        selected = lttb_python(values, timestamps, max_points)
+    else:
+        selected = minmax_python(values, timestamps, max_points)
+    return [values[index] for index in selected], [timestamps[index] for index in selected]
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+import re
+import uuid
+import logging
+from decimal import Decimal, InvalidOperation
+from cassandra.metadata import protect_name
+from tools.ResultPage import ResultPage, get_column_names
+
+logger = logging.getLogger(__name__)
+
+# CQL string literals, masked before looking for clauses
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+IDENTIFIER = r'(?:"[^"]+"|\w+)'
+SELECT_PATTERN = re.compile(
+    rf'^\s*SELECT\s.+?\sFROM\s+(?P<table>{IDENTIFIER}(?:\.{IDENTIFIER})?)'
+    r'(?P<where>\s+WHERE\s.*?)?'
+    r'(?P<tail>\s+(?:GROUP\s+BY|ORDER\s+BY|PER\s+PARTITION\s+LIMIT|LIMIT|ALLOW\s+FILTERING)\b.*?)?\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL
+)
+# `column operator`, in a WHERE clause
+RESTRICTION_PATTERN = re.compile(rf'({IDENTIFIER})\s*(>=|<=|=|>|<|\bIN\b|\bCONTAINS\b)', re.IGNORECASE)
+# a regular expression matching a few plain values: `a|b`, `(a|b)` or `^(a|b)$`, as built by Grafana templating
+ALTERNATIVES_PATTERN = re.compile(r'^\^?\(?((?:[^\\.^$*+?()\[\]{}|]|\\.)+(?:\|(?:[^\\.^$*+?()\[\]{}|]|\\.)+)*)\)?\$?$')
+
+OPERATORS = ('=', '!=', '<', '>', '=~', '!~')
+NUMBERS = (int, float, Decimal)
+
+# CQL types of the columns which filters can be bound to, with the conversion of the filter value
+CONVERSIONS = {
+    'ascii': str,
+    'text': str,
+    'varchar': str,
+    'tinyint': int,
+    'smallint': int,
+    'int': int,
+    'bigint': int,
+    'varint': int,
+    'float': float,
+    'double': float,
+    'decimal': Decimal,
+    'boolean': lambda value: {'true': True, 'false': False}[value.lower()],
+    'uuid': uuid.UUID,
+    'timeuuid': uuid.UUID,
+}
+
+
+def parse_filters(adhoc_filters):
+    """
+    :param adhoc_filters: ad hoc filters of a Grafana query, {'key', 'operator', 'value'}
+    :return: (column name, operator, value) of the valid filters
+    """
+    filters = []
+    for adhoc_filter in adhoc_filters or []:
+        if not isinstance(adhoc_filter, dict):
+            continue
+        key = adhoc_filter.get('key')
+        operator = adhoc_filter.get('operator', '=')
+        value = adhoc_filter.get('value')
+        if not key or operator not in OPERATORS or value is None:
+            logger.debug(f'Invalid ad hoc filter ignored: {adhoc_filter}')
+            continue
+        if operator in ('=~', '!~'):
+            try:
+                re.compile(str(value))
+            except re.error:
+                logger.debug(f'Invalid ad hoc filter regular expression ignored: {value}')
+                continue
+        filters.append((key, operator, str(value)))
+    return filters
+
+
+def _column_name(identifier: str):
+    # unquoted identifiers are case insensitive
+    if identifier.startswith('"'):
+        return identifier[1:-1]
+    return identifier.lower()
+
+
+def get_table(session, name: str):
+    """
+    :param session: a cassandra session
+    :param name: `table` or `keyspace.table`, as written in a query
+    :return: the table metadata, None if unknown
+    """
+    parts = [_column_name(part) for part in re.findall(IDENTIFIER, name)]
+    keyspace_name, table_name = parts if len(parts) == 2 else (session.keyspace, parts[0])
+    keyspace = session.cluster.metadata.keyspaces.get(keyspace_name)
+    if not keyspace:
+        return None
+    return keyspace.tables.get(table_name)
+
+
+def convert(value: str, cql_type: str):
+    """
+    :param value: a filter value
+    :param cql_type: CQL type of the filtered column
+    :return: the value converted to the column type, None if it can not be
+    """
+    conversion = CONVERSIONS.get(cql_type)
+    if conversion is None:
+        return None
+    try:
+        return conversion(value)
+    except (ValueError, KeyError, InvalidOperation):
+        return None
+
+
+def split_alternatives(pattern: str):
+    """
+    :param pattern: a regular expression
+    :return: the plain values it matches, None if it is not a plain alternation of values
+    """
+    match = ALTERNATIVES_PATTERN.match(pattern)
+    if not match:
+        return None
+    return [re.sub(r'\\(.)', r'\1', alternative) for alternative in match.group(1).split('|')]
+
+
+def _restrictions(where: str):
+    """
+    :param where: a WHERE clause, string literals masked
+    :return: the columns restricted by equality (`=` or `IN`), the columns restricted otherwise
+    """
+    equal, other = set(), set()
+    for identifier, operator in RESTRICTION_PATTERN.findall(where or ''):
+        (equal if operator.upper() in ('=', 'IN') else other).add(_column_name(identifier))
+    return equal, other
+
+
+def _pushed_columns(table, candidates: set, equal: set):
+    """
+    Columns of the candidates which can be restricted without ALLOW FILTERING.
+
+    :param table: the table metadata
+    :param candidates: columns filtered by equality, not restricted by the query
+    :param equal: columns the query already restricts by equality
+    """
+    partition_key = [column.name for column in table.partition_key]
+    clustering_key = [column.name for column in table.clustering_key]
+
+    pushed = set()
+    if all(name in equal or name in candidates for name in partition_key):
+        pushed.update(candidates.intersection(partition_key))
+    if not all(name in equal or name in pushed for name in partition_key):
+        # the partition key is not fully restricted, only partitions can be filtered
+        return pushed
+
+    for name in clustering_key:
+        if name in candidates:
+            pushed.add(name)
+        elif name not in equal:
+            # the next clustering columns can not be restricted, this one being unrestricted or a range
+            break
+    return pushed
+
+
+class FilterPlan:
+    """
+    Ad hoc filters of a target query: bound into its WHERE clause, or applied by the gateway on its result rows.
+
+    Pushed filters are `$adhocFilter<n>` macros of the rewritten query, their values are in `macros`.
+    """
+
+    def __init__(self, query: str, macros: dict, row_filters: list):
+        """
+        :param query: the query, with the predicates of the pushed filters
+        :param macros: values of the pushed filters by macro name
+        :param row_filters: (column name, operator, value) filters left to the gateway
+        """
+        self.query = query
+        self.macros = macros
+        self.row_filters = row_filters
+        self.compiled = [
+            (name, operator, re.compile(value) if operator in ('=~', '!~') else value)
+            for name, operator, value in row_filters
+        ]
+        self.missing_columns = set()  # filtered columns the query does not select, already warned about
+
+    @property
+    def key(self):
+        """
+        :return: identifies the filters applied by the gateway, queries are told apart by their macros
+        """
+        return tuple(self.row_filters)
+
+    @staticmethod
+    def _test(operator: str, expected):
+        if operator == '=~':
+            return lambda value: value is not None and expected.fullmatch(str(value)) is not None
+        if operator == '!~':
+            return lambda value: value is None or expected.fullmatch(str(value)) is None
+
+        def comparable(value):
+            # a value of another type than the filter value, from an unknown column type, is compared as text
+            if value is None or isinstance(value, type(expected)) or \
+                    isinstance(value, NUMBERS) and isinstance(expected, NUMBERS):
+                return value
+            return str(value)
+
+        if operator == '=':
+            return lambda value: comparable(value) == expected
+        if operator == '!=':
+            return lambda value: comparable(value) != expected
+        if operator == '<':
+            return lambda value: value is not None and comparable(value) < expected
+        return lambda value: value is not None and comparable(value) > expected
+
+    def filter_rows(self, rows):
+        """
+        :param rows: a result page
+        :return: the rows of the page matching every filter left to the gateway
+        """
+        if not self.compiled or not rows:
+            return rows
+
+        column_names = get_column_names(rows)
+        tests = []
+        for name, operator, expected in self.compiled:
+            if name not in column_names:
+                # the column is not in the results, its filter can not be applied
+                if name not in self.missing_columns:
+                    self.missing_columns.add(name)
+                    logger.warning(f'Ad hoc filter on {name} not applied, the query does not select this column')
+                continue
+            tests.append((column_names.index(name), self._test(operator, expected)))
+        if not tests:
+            return rows
+
+        return ResultPage(column_names, [row for row in rows if all(test(row[index]) for index, test in tests)])
+
+
+def plan_filters(query: str, filters: list, session, pushdown: bool = True):
+    """
+    Bind the ad hoc filters on primary key columns into the WHERE clause of a query, the way cassandra serves
+    without ALLOW FILTERING: `=` and `IN` on the partition key columns once they are all restricted,
+    then on the clustering columns in their order. The other filters are left to the gateway.
+
+    :param query: the query, with its macros
+    :param filters: (column name, operator, value) of the ad hoc filters
+    :param session: the cassandra session, its cluster metadata describes the table the query reads from
+    :param pushdown: bind filters into the query, or leave them all to the gateway
+    :return: the FilterPlan
+    """
+    masked = STRING_LITERAL.sub(lambda literal: "'" + 'x' * (len(literal.group(0)) - 2) + "'", query)
+    match = SELECT_PATTERN.match(masked)
+    table = get_table(session, match.group('table')) if match else None
+    if table is None:
+        return FilterPlan(query, {}, [(name, operator, value) for name, operator, value in filters])
+
+    # filter values converted to the column types
+    primary_key = {column.name for column in table.primary_key}
+    row_filters = []
+    candidates = {}
+    for name, operator, value in filters:
+        column = table.columns.get(name)
+        if column is None:
+            # not a column of this table, the filter concerns other queries
+            continue
+        values = [value] if operator == '=' else split_alternatives(value) if operator == '=~' else None
+        converted = [convert(item, column.cql_type) for item in values or []]
+        if name in primary_key and values and None not in converted and name not in candidates:
+            candidates[name] = (operator, value, converted)
+        else:
+            typed = convert(value, column.cql_type) if operator in ('=', '!=', '<', '>') else None
+            row_filters.append((name, operator, value if typed is None else typed))
+
+    equal, other = _restrictions(match.group('where'))
+    pushable = {name for name in candidates if name not in equal and name not in other}
+    pushed = _pushed_columns(table, pushable, equal) if pushdown else set()
+
+    predicates = []
+    macros = {}
+    for name, (operator, value, converted) in candidates.items():
+        if name not in pushed:
+            row_filters.append((name, operator, converted[0] if operator == '=' else value))
+            continue
+        macro = f'adhocFilter{len(macros)}'
+        if operator == '=':
+            predicates.append(f'{protect_name(name)} = ${macro}')
+            macros[macro] = converted[0]
+        else:
+            predicates.append(f'{protect_name(name)} IN ${macro}')
+            macros[macro] = tuple(converted)
+
+    if not predicates:
+        return FilterPlan(query, {}, row_filters)
+
+    if match.group('where'):
+        position = match.end('where')
+        clause = ' AND ' + ' AND '.join(predicates)
+    else:
+        position = match.end('table')
+        clause = ' WHERE ' + ' AND '.join(predicates)
+    logger.debug(f'Ad hoc filters pushed down: {clause}')
+    return FilterPlan(query[:position] + clause + query[position:], macros, row_filters)
+
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from operator import itemgetter
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # optional, Arrow IPC answers
+    pyarrow = None
+
+# media type of the Arrow IPC streaming format
+ARROW_CONTENT_TYPE = 'application/vnd.apache.arrow.stream'
+
+# columns of the record batch of each serie, which serie it is stands in the metadata of the batch
+ARROW_SCHEMA = pyarrow.schema([
+    ('time', pyarrow.timestamp('us', tz='UTC')),
+    ('value', pyarrow.float64()),
+    ('text', pyarrow.string()),  # values which are not numbers
+]) if pyarrow else None
+
+
+def _columns(rows: list, width: int):
+    """
+    :return: the rows, transposed into `width` columns
+    """
+    if not rows:
+        return [[] for _ in range(width)]
+    return [list(map(itemgetter(index), rows)) for index in range(width)]
+
+
+def _frame(ref_id, name, fields: list, values: list):
+    return {
+        'refId': ref_id,
+        'schema': {'name': name, 'refId': ref_id, 'fields': fields},
+        'data': {'values': values}
+    }
+
+
+def to_frame(result: dict):
+    """
+    Answer a target result as a Grafana data frame: a schema, then the values by columns.
+
+    :param result: a serie (`target`, `datapoints`), a table (`columns`, `rows`) or an error (`error`)
+    :return: the data frame, in the Grafana DataFrameJSON layout
+    """
+    ref_id = result.get('refId')
+
+    if 'error' in result:
+        frame = _frame(ref_id, result.get('target'), [], [])
+        frame['error'] = result['error']
+        return frame
+
+    if result.get('type') == 'table':
+        columns = result.get('columns') or []
+        return _frame(
+            ref_id,
+            ref_id,
+            [{'name': column['text'], 'type': column.get('type', 'string')} for column in columns],
+            _columns(result.get('rows') or [], len(columns))
+        )
+
+    name = result.get('target')
+    values, timestamps = _columns(result.get('datapoints') or [], 2)
+    value_type = 'string' if str in set(map(type, values)) else 'number'
+    return _frame(
+        ref_id,
+        name,
+        [
+            {'name': 'time', 'type': 'time'},
+            {'name': 'value', 'type': value_type, 'config': {'displayNameFromDS': name}},
+        ],
+        [timestamps, values]
+    )
+
+
+class _Sink:
+    """
+    File written by an Arrow stream writer, its bytes are taken as they come.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def arrow_batch(result: dict):
+    """
+    :param result: a serie (`target`, `datapoints`) or an error (`error`)
+    :return: the record batch of the serie, the metadata naming it
+    """
+    metadata = {'refId': result.get('refId') or '', 'name': result.get('target') or ''}
+    if 'error' in result:
+        metadata['error'] = result['error']
+
+    values, timestamps = _columns(result.get('datapoints') or [], 2)
+    times = pyarrow.array([round(timestamp * 1000) for timestamp in timestamps], ARROW_SCHEMA.field('time').type)
+    if str in set(map(type, values)):
+        texts = pyarrow.array([value if isinstance(value, str) else None for value in values], pyarrow.string())
+        values = pyarrow.array([None if isinstance(value, str) else value for value in values], pyarrow.float64())
+    else:
+        texts = pyarrow.nulls(len(values), pyarrow.string())
+        values = pyarrow.array(values, pyarrow.float64())
+    return pyarrow.record_batch([times, values, texts], schema=ARROW_SCHEMA), metadata
+
+
+class ArrowStream:
+    """
+    Series answered as an Arrow IPC stream: a record batch per serie, its refId, name and error
+    in the custom metadata of the batch. The stream is encoded as the series come.
+    """
+
+    def __init__(self):
+        self.sink = _Sink()
+        self.writer = pyarrow.ipc.new_stream(self.sink, ARROW_SCHEMA)
+
+    def write(self, results: list) -> bytes:
+        """
+        :param results: the next series
+        :return: the next bytes of the stream
+        """
+        for result in results:
+            batch, metadata = arrow_batch(result)
+            self.writer.write_batch(batch, custom_metadata=metadata)
+        return self.sink.take()
+
+    def close(self) -> bytes:
+        """
+        :return: the last bytes of the stream
+        """
+        self.writer.close()
+        return self.sink.take()
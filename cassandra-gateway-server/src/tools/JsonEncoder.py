@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from tornado.escape import json_encode
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # optional, faster encoder
+    orjson = None
+
+# list items encoded at once, larger lists (datapoints, table rows) are encoded in several chunks
+CHUNK_SIZE = 1000
+
+
+def encode(value) -> bytes:
+    """
+    Encode a value into JSON, with orjson when it is installed.
+
+    :param value: the value to encode
+    :return: the UTF-8 encoded JSON document
+    """
+    if orjson:
+        return orjson.dumps(value)
+    return json_encode(value).encode('utf-8')
+
+
+def _iter_encode(value):
+    if isinstance(value, dict):
+        yield b'{'
+        for index, (key, item) in enumerate(value.items()):
+            yield (b',' if index else b'') + encode(str(key)) + b':'
+            yield from _iter_encode(item)
+        yield b'}'
+    elif isinstance(value, list) and len(value) > CHUNK_SIZE:
+        yield b'['
+        for start in range(0, len(value), CHUNK_SIZE):
+            chunk = encode(value[start:start + CHUNK_SIZE])
+            # strip the brackets of the chunk
+            yield (b',' if start else b'') + chunk[1:-1]
+        yield b']'
+    elif isinstance(value, list) and any(isinstance(item, list) and len(item) > CHUNK_SIZE for item in value):
+        # columns of a data frame, each one encoded in several chunks
+        yield b'['
+        for index, item in enumerate(value):
+            if index:
+                yield b','
+            yield from _iter_encode(item)
+        yield b']'
+    else:
+        yield encode(value)
+
+
+def iter_encode_items(items: list):
+    """
+    Encode items as the comma separated content of a JSON array, without the brackets.
+
+    The encoded document is yielded in chunks, it is never held as a whole.
+
+    :param items: the items to encode
+    :return: an iterator over UTF-8 encoded JSON chunks
+    """
+    for index, item in enumerate(items):
+        if index:
+            yield b','
+        yield from _iter_encode(item)
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import mmap
+import struct
+import logging
+import configparser
+import multiprocessing
+from bisect import bisect_left
+from tornado import ioloop
+from tools import server
+
+logger = logging.getLogger(__name__)
+
+# load API settings
+config = configparser.ConfigParser()
+config.read(os.getenv('SETTINGS_FILE', './settings.ini'))
+
+if 'API' not in config:
+    raise ValueError('No [API] section inside the settings file')
+
+settings = config['API']
+
+metrics_enabled = settings.getboolean('METRICS', fallback=True)
+metrics_publish_interval = settings.getfloat('METRICS_PUBLISH_INTERVAL', fallback=1)  # in seconds
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROW_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+BYTE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+
+QUERY_LABELS = ('handler', 'type', 'aggregation')
+
+# name: type, help, label names, histogram buckets
+METRICS = {
+    'cassandra_gateway_cql_duration_seconds': (
+        'histogram', 'Time spent waiting for the result pages of a query.', QUERY_LABELS, DURATION_BUCKETS
+    ),
+    'cassandra_gateway_rows': (
+        'histogram', 'Rows read by a query.', QUERY_LABELS, ROW_BUCKETS
+    ),
+    'cassandra_gateway_parse_duration_seconds': (
+        'histogram', 'Time spent parsing the result pages of a query, they are aggregated as they are parsed.',
+        QUERY_LABELS, DURATION_BUCKETS
+    ),
+    'cassandra_gateway_aggregation_duration_seconds': (
+        'histogram', 'Time spent finishing the aggregation of the results of a query.', QUERY_LABELS, DURATION_BUCKETS
+    ),
+    'cassandra_gateway_json_encode_duration_seconds': (
+        'histogram', 'Time spent encoding an answer to JSON.', ('handler',), DURATION_BUCKETS
+    ),
+    'cassandra_gateway_response_bytes': (
+        'histogram', 'Bytes of an answer.', ('handler',), BYTE_BUCKETS
+    ),
+    'cassandra_gateway_requests_in_flight': (
+        'gauge', 'Requests being served.', ('handler',), None
+    ),
+    'cassandra_gateway_responses_total': (
+        'counter', 'Answered requests, by status code.', ('handler', 'code'), None
+    ),
+    'cassandra_gateway_queries_total': (
+        'counter', 'Target queries executed, or coalesced with an identical query in flight.', ('outcome',), None
+    ),
+    'cassandra_gateway_cancelled_requests_total': (
+        'counter', 'Requests cancelled because the client disconnected or their deadline expired.',
+        ('handler', 'reason'), None
+    ),
+    'cassandra_gateway_cancelled_queries_total': (
+        'counter', 'Cassandra queries given up while a result page was still awaited.', (), None
+    ),
+    'cassandra_gateway_admission_slots_used': (
+        'gauge', 'Query slots used by the requests being served.', (), None
+    ),
+    'cassandra_gateway_admission_queue_depth': (
+        'gauge', 'Requests waiting for a query slot.', (), None
+    ),
+    'cassandra_gateway_rejected_requests_total': (
+        'counter', 'Requests rejected because no query slot got free, by reason.', ('reason',), None
+    ),
+    'cassandra_gateway_adhoc_filters_total': (
+        'counter', 'Ad hoc filters of the target queries, applied by cassandra or by the gateway.', ('placement',),
+        None
+    ),
+    'cassandra_gateway_ready_seconds': (
+        'gauge', 'Seconds from the start of a worker until it accepted connections, warm up included.',
+        ('worker',), None
+    ),
+}
+
+# aggregation label values, any other aggregation is reported as 'other'
+AGGREGATIONS = ('none', 'on changes', 'sum', 'average', 'minimum', 'maximum', 'count', 'and', 'or')
+
+SNAPSHOT_HEADER = struct.Struct('<I')  # length of the JSON snapshot
+SLAB_SIZE = 1024 * 1024  # space of the snapshot of a worker
+
+
+class SnapshotStore:
+    """
+    Latest metrics snapshot of every worker process, in an anonymous shared memory map created before they get forked.
+
+    Each worker writes its own slab, any worker reads them all.
+    """
+
+    def __init__(self, workers: int):
+        self.memory = mmap.mmap(-1, workers * SLAB_SIZE)
+        self.locks = [multiprocessing.Lock() for _ in range(workers)]
+
+    def write(self, worker: int, snapshot: dict):
+        if worker >= len(self.locks):
+            logger.warning(f'No metrics slab for worker {worker}, its metrics are not reported')
+            return
+        data = json.dumps(snapshot, separators=(',', ':')).encode('utf-8')
+        if SNAPSHOT_HEADER.size + len(data) > SLAB_SIZE:
+            logger.warning('Metrics snapshot too large, not reported')
+            return
+        start = worker * SLAB_SIZE
+        with self.locks[worker]:
+            SNAPSHOT_HEADER.pack_into(self.memory, start, len(data))
+            self.memory[start + SNAPSHOT_HEADER.size:start + SNAPSHOT_HEADER.size + len(data)] = data
+
+    def read(self):
+        snapshots = []
+        for worker, lock in enumerate(self.locks):
+            start = worker * SLAB_SIZE
+            with lock:
+                length, = SNAPSHOT_HEADER.unpack_from(self.memory, start)
+                data = self.memory[start + SNAPSHOT_HEADER.size:start + SNAPSHOT_HEADER.size + length]
+            if length:
+                snapshots.append(json.loads(data))
+        return snapshots
+
+
+def _format_labels(names, values, extra: str = ''):
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Metrics:
+    """
+    Metrics of the gateway, in the Prometheus text format.
+
+    Values are recorded in memory by each worker process, a dict update per value. Every worker publishes a
+    snapshot of its values in shared memory at regular intervals, the snapshots of all workers are summed up
+    when the metrics are collected.
+    """
+
+    counters = {}
+    gauges = {}
+    histograms = {}
+    collectors = []
+    store = None
+    publisher_pid = None
+
+    @classmethod
+    def observe(cls, name: str, value: float, *labels):
+        """
+        Add a value to a histogram.
+
+        :param name: the histogram name
+        :param value: the observed value
+        :param labels: label values, in the label names order
+        """
+        if not metrics_enabled:
+            return
+        histogram = cls.histograms.get((name, labels))
+        if histogram is None:
+            buckets = METRICS[name][3]
+            # a count per bucket, the last one being +Inf, then the sum
+            histogram = cls.histograms[(name, labels)] = [0] * (len(buckets) + 2)
+            histogram[-1] = 0.0
+        histogram[bisect_left(METRICS[name][3], value)] += 1
+        histogram[-1] += value
+
+    @classmethod
+    def increment(cls, name: str, *labels, value: float = 1):
+        """
+        Increment a counter, or a gauge.
+
+        :param name: the counter or gauge name
+        :param labels: label values, in the label names order
+        :param value: the increment, can be negative for gauges
+        """
+        if not metrics_enabled:
+            return
+        values = cls.gauges if METRICS[name][0] == 'gauge' else cls.counters
+        values[(name, labels)] = values.get((name, labels), 0) + value
+
+    @classmethod
+    def add_collector(cls, collector):
+        """
+        Report counters and gauges kept elsewhere.
+
+        :param collector: function giving (name, label values, value) of metrics, called at each publication
+        """
+        cls.collectors.append(collector)
+
+    @staticmethod
+    def query_labels(handler: str, target_type: str, aggregation: str):
+        """
+        :return: the labels of the query metrics, with a bounded set of values
+        """
+        return (
+            handler,
+            target_type if target_type in ('timeserie', 'table', 'annotation') else 'other',
+            aggregation if aggregation in AGGREGATIONS else 'other'
+        )
+
+    @classmethod
+    def snapshot(cls):
+        counters = dict(cls.counters)
+        gauges = dict(cls.gauges)
+        for collector in cls.collectors:
+            for name, labels, value in collector():
+                values = gauges if METRICS[name][0] == 'gauge' else counters
+                values[(name, tuple(labels))] = value
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'gauges': [[name, list(labels), value] for (name, labels), value in gauges.items()],
+            'histograms': [[name, list(labels), values] for (name, labels), values in cls.histograms.items()],
+        }
+
+    @classmethod
+    def publish(cls):
+        """
+        Publish the metrics of this worker to the other ones.
+        """
+        if cls.store is not None and not server.draining:
+            # a draining worker leaves its slab to the worker replacing it
+            cls.store.write(server.worker_id or 0, cls.snapshot())
+
+    @classmethod
+    def start(cls):
+        """
+        Publish the metrics of this worker at regular intervals, called by every request as it is cheap.
+        """
+        if not metrics_enabled or cls.publisher_pid == os.getpid():
+            return
+        cls.publisher_pid = os.getpid()
+        ioloop.PeriodicCallback(cls.publish, metrics_publish_interval * 1000).start()
+
+    @classmethod
+    def collect(cls):
+        """
+        Sum up the metrics of every worker.
+
+        :return: the metrics, in the Prometheus text format
+        """
+        cls.publish()
+        snapshots = cls.store.read() if cls.store is not None else [cls.snapshot()]
+
+        merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+        for snapshot in snapshots:
+            for kind in ('counters', 'gauges'):
+                for name, labels, value in snapshot[kind]:
+                    key = (name, tuple(labels))
+                    merged[kind][key] = merged[kind].get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(labels))
+                if key in merged['histograms']:
+                    values = [a + b for a, b in zip(merged['histograms'][key], values)]
+                merged['histograms'][key] = values
+
+        lines = []
+        for name, (metric_type, description, label_names, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            if metric_type == 'histogram':
+                for (metric, labels), values in sorted(merged['histograms'].items()):
+                    if metric != name:
+                        continue
+                    cumulated = 0
+                    for bound, count in zip(buckets + ('+Inf',), values):
+                        cumulated += count
+                        bucket_labels = _format_labels(label_names, labels, f'le="{bound}"')
+                        lines.append(f'{name}_bucket{bucket_labels} {cumulated}')
+                    lines.append(f'{name}_sum{_format_labels(label_names, labels)} {values[-1]}')
+                    lines.append(f'{name}_count{_format_labels(label_names, labels)} {cumulated}')
+            else:
+                for (metric, labels), value in sorted(merged[metric_type + 's'].items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(label_names, labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _ready_time():
+    if server.ready_time is None:
+        return []
+    return [('cassandra_gateway_ready_seconds', (str(server.worker_id or 0),), server.ready_time)]
+
+
+Metrics.add_collector(_ready_time)
+
+if metrics_enabled:
+    # one slab per worker, a replaced worker hands its slab over to the new one
+    Metrics.store = SnapshotStore(server.worker_count())
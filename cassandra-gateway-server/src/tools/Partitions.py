@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import re
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from tools.CassandraClient import iterate_pages
+
+logger = logging.getLogger(__name__)
+
+# partition length and default format of the partition keys, by granularity
+GRANULARITIES = {
+    'day': (timedelta(days=1), '%Y-%m-%d'),
+    'hour': (timedelta(hours=1), '%Y-%m-%d %H'),
+}
+
+# a CQL string literal (skipped) or `IN $computedDates`
+PARTITIONS_IN_PATTERN = re.compile(r"'(?:[^']|'')*'|(\bIN\s+\$computedDates\b)", re.IGNORECASE)
+
+# pages fetched ahead by each partition query
+PREFETCHED_PAGES = 2
+
+
+class TooManyPartitions(ValueError):
+    """
+    The time range of a query covers more partitions than allowed.
+    """
+
+
+def check_granularity(granularity: str):
+    """
+    :param granularity: a partition granularity, from the settings
+    :raise ValueError: if the granularity is unknown
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'Unknown partition granularity {granularity!r}, expected one of: {", ".join(GRANULARITIES)}')
+
+
+def compute_partitions(start_time: int, end_time: int, granularity: str = 'day', key_format: str = None,
+                       max_partitions: int = 0):
+    """
+    Keys of the partitions covering a time range, in UTC.
+
+    :param start_time: start of the time range, in microseconds
+    :param end_time: end of the time range, in microseconds
+    :param granularity: 'day' or 'hour'
+    :param key_format: strftime format of the partition keys, the granularity default if not given
+    :param max_partitions: most partitions the time range can cover, 0 for no limit
+    :return: the partition keys, in time order
+    :raise TooManyPartitions: if the time range covers more than `max_partitions` partitions
+    """
+    length, default_format = GRANULARITIES[granularity]
+    key_format = key_format or default_format
+
+    start = datetime.fromtimestamp(start_time / 1e6, timezone.utc)
+    end = datetime.fromtimestamp(end_time / 1e6, timezone.utc)
+    if granularity == 'day':
+        partition = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        partition = start.replace(minute=0, second=0, microsecond=0)
+
+    count = (end - partition) // length + 1 if end >= partition else 0
+    if max_partitions and count > max_partitions:
+        raise TooManyPartitions(
+            f'The time range covers {count} {granularity} partitions, at most {max_partitions} can be queried'
+        )
+
+    keys = []
+    while partition <= end:
+        keys.append(partition.strftime(key_format))
+        partition += length
+    return keys
+
+
+def split_partitions(query: str):
+    """
+    Rewrite `IN $computedDates` into `= $computedDate`, so the query reads a single partition.
+
+    :param query: the query, with its macros
+    :return: the single partition query, None if the query does not select partitions by `IN $computedDates`
+    """
+    found = []
+
+    def replace(match):
+        if match.group(1) is None:
+            return match.group(0)
+        found.append(match)
+        return '= $computedDate'
+
+    single_partition = PARTITIONS_IN_PATTERN.sub(replace, query)
+    return single_partition if len(found) == 1 else None
+
+
+async def iterate_partitions(session, query, parameters_list: list, max_parallel: int = 8):
+    """
+    Execute a query once per partition, concurrently, and iterate over the result pages in the partitions order.
+
+    Each partition query fetches a few pages ahead, then waits for the pages of the previous partitions
+    to be consumed.
+
+    :param session: the cassandra session
+    :param query: the query, a statement or a string
+    :param parameters_list: parameters of the query for each partition, in time order
+    :param max_parallel: partitions queried at once
+    """
+    semaphore = asyncio.Semaphore(max_parallel)
+    queues = [asyncio.Queue(PREFETCHED_PAGES) for _ in parameters_list]
+
+    async def fetch(parameters, queue: asyncio.Queue):
+        try:
+            async with semaphore:
+                async for page in iterate_pages(session, query, parameters):
+                    await queue.put(page)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+    tasks = [asyncio.ensure_future(fetch(parameters, queue)) for parameters, queue in zip(parameters_list, queues)]
+    try:
+        for queue in queues:
+            while True:
+                page = await queue.get()
+                if page is None:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+import re
+import logging
+from cassandra.metadata import protect_name
+from tools.StatementCache import MACRO_PATTERN
+from tools.TimeSeries import fill_datapoints
+
+logger = logging.getLogger(__name__)
+
+# `SELECT timestamp, name, value FROM table WHERE ...`, the only shape aggregated by cassandra
+QUERY_SHAPE = re.compile(
+    r'^\s*SELECT\s+timestamp\s*,\s*name\s*,\s*value\s+FROM\s+(?P<table>[\w."]+)\s+WHERE\s+(?P<where>.+?)\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL
+)
+UNSUPPORTED_CLAUSES = re.compile(r'\b(GROUP\s+BY|ORDER\s+BY|PER\s+PARTITION|LIMIT|ALLOW\s+FILTERING)\b', re.IGNORECASE)
+START_PREDICATE = re.compile(r'\btimestamp\s*(>=|>)\s*\$startTime\b', re.IGNORECASE)
+END_PREDICATE = re.compile(r'\btimestamp\s*(<=|<)\s*\$endTime\b', re.IGNORECASE)
+
+# cassandra aggregate function computing each aggregation, along with `count(value)`
+PUSHDOWN_FUNCTIONS = {
+    'sum': 'sum',
+    'minimum': 'min',
+    'maximum': 'max',
+    'count': 'count',
+    'average': 'sum'
+}
+
+# merge the partial aggregates of two groups of the same interval
+PARTIAL_MERGES = {
+    'sum': lambda a, b: a + b,
+    'min': min,
+    'max': max,
+    'count': lambda a, b: a + b
+}
+
+# CQL types of the value column aggregated by cassandra, sums of the small integer types would overflow
+NUMERIC_TYPES = ('double', 'float', 'decimal', 'bigint', 'varint', 'counter', 'int', 'smallint', 'tinyint')
+OVERFLOWING_TYPES = ('int', 'smallint', 'tinyint')
+
+# queries cassandra refused to aggregate, they are aggregated by the gateway from now on
+MAX_REJECTED_QUERIES = 1024
+rejected_queries = set()
+
+
+class PushdownPlan:
+    """
+    A query rewritten to aggregate each time interval on the cassandra side.
+
+    The rewritten query is executed once per interval, `$startTime` and `$endTime` being the interval bounds.
+    Each execution answers a few rows per serie, the partial aggregates of the groups of the table,
+    which are merged by the gateway.
+    """
+
+    def __init__(self, source: str, query: str, aggregation: str, interval_ms: int,
+                 start_inclusive: bool, end_inclusive: bool):
+        self.source = source
+        self.query = query
+        self.aggregation = aggregation
+        self.function = PUSHDOWN_FUNCTIONS[aggregation]
+        self.interval_ms = interval_ms
+        self.start_inclusive = start_inclusive
+        self.end_inclusive = end_inclusive
+
+    def intervals(self, start_time: int, end_time: int, max_intervals: int):
+        """
+        Split a time range into aligned intervals.
+
+        :param start_time: start of the time range, in microseconds
+        :param end_time: end of the time range, in microseconds
+        :param max_intervals: the most intervals to query
+        :return: (start, end) of each interval, end excluded, in microseconds, None if there are too many
+        """
+        width = self.interval_ms * 1000
+        # timestamps are integers, bounds are turned into a [lower, upper) range
+        lower = start_time if self.start_inclusive else start_time + 1
+        upper = end_time + 1 if self.end_inclusive else end_time
+        if upper <= lower:
+            return []
+
+        first, last = lower // width, -(-upper // width)
+        if last - first > max_intervals:
+            return None
+        return [
+            (max(lower, interval * width), min(upper, (interval + 1) * width))
+            for interval in range(first, last)
+        ]
+
+    def _value(self, partial, count: int):
+        if self.aggregation == 'count':
+            return count
+        if self.aggregation == 'average':
+            return float(partial) / count
+        return float(partial)
+
+    def results(self, answers, fill: str = 'none', time_range: tuple = None):
+        """
+        Merge the answers of the intervals into series.
+
+        :param answers: (interval start in microseconds, rows) of each interval, rows being (name, aggregate, count)
+        :param fill: how to fill the intervals without datapoint
+        :param time_range: start and end timestamps of the time range, in milliseconds
+        :return: the series, as built by TimeserieBuilder
+        """
+        width = self.interval_ms * 1000
+        merge = PARTIAL_MERGES[self.function]
+
+        series = {}
+        for interval_start, rows in answers:
+            stamp = interval_start // width * self.interval_ms
+            for name, partial, count in rows:
+                if not count:
+                    # only empty values in this group
+                    continue
+                serie = series.setdefault(name, {})
+                if stamp in serie:
+                    previous_partial, previous_count = serie[stamp]
+                    partial = merge(previous_partial, partial)
+                    count += previous_count
+                serie[stamp] = (partial, count)
+
+        return [
+            {
+                'target': name,
+                'datapoints': fill_datapoints(
+                    [[self._value(partial, count), stamp] for stamp, (partial, count) in sorted(serie.items())],
+                    fill,
+                    self.interval_ms,
+                    time_range
+                )
+            } for name, serie in series.items()
+        ]
+
+    def reject(self):
+        """
+        Aggregate the source query on the gateway from now on.
+        """
+        if len(rejected_queries) >= MAX_REJECTED_QUERIES:
+            rejected_queries.clear()
+        rejected_queries.add(self.source)
+
+
+def plan_pushdown(query: str, aggregation: str, interval_ms: int, table, value_type: str):
+    """
+    Rewrite a query so cassandra aggregates the values of each time interval.
+
+    Only `SELECT timestamp, name, value FROM table WHERE ... timestamp > $startTime AND timestamp < $endTime`
+    queries of a table whose primary key holds the `name` column before the `timestamp` one can be rewritten.
+    Values are grouped by the primary key columns up to `name`.
+
+    :param query: the query, with its macros
+    :param aggregation: the aggregation method
+    :param interval_ms: interval between two datapoints, in milliseconds
+    :param table: metadata of the table read by the query
+    :param value_type: CQL type of the value column
+    :return: the plan, None if the query has to be aggregated by the gateway
+    """
+    if aggregation not in PUSHDOWN_FUNCTIONS or not interval_ms or table is None or query in rejected_queries:
+        return None
+    if interval_ms != int(interval_ms):
+        return None
+
+    if value_type not in NUMERIC_TYPES:
+        return None
+    if value_type in OVERFLOWING_TYPES and PUSHDOWN_FUNCTIONS[aggregation] == 'sum':
+        return None
+
+    shape = QUERY_SHAPE.match(query)
+    if not shape:
+        return None
+    where = shape.group('where')
+
+    macros = [match.group(1) for match in MACRO_PATTERN.finditer(where) if match.group(1)]
+    if macros.count('startTime') != 1 or macros.count('endTime') != 1 or UNSUPPORTED_CLAUSES.search(where):
+        return None
+
+    start_predicate = START_PREDICATE.search(where)
+    end_predicate = END_PREDICATE.search(where)
+    if not start_predicate or not end_predicate:
+        return None
+
+    primary_key = [column.name for column in table.partition_key] + [column.name for column in table.clustering_key]
+    if 'name' not in primary_key:
+        return None
+    group_by = primary_key[:max(len(table.partition_key), primary_key.index('name') + 1)]
+    if 'timestamp' in group_by:
+        return None
+
+    where = START_PREDICATE.sub('timestamp >= $startTime', where)
+    where = END_PREDICATE.sub('timestamp < $endTime', where)
+    function = PUSHDOWN_FUNCTIONS[aggregation]
+    rewritten = (
+        f'SELECT name, {function}(value), count(value) FROM {shape.group("table")} '
+        f'WHERE {where} GROUP BY {", ".join(map(protect_name, group_by))}'
+    )
+    logger.debug(f'Aggregation pushed down to cassandra: {rewritten}')
+
+    return PushdownPlan(
+        query,
+        rewritten,
+        aggregation,
+        int(interval_ms),
+        start_predicate.group(1) == '>=',
+        end_predicate.group(1) == '<='
+    )
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+from collections import OrderedDict
+from tools.StatementCache import bind_macros
+
+logger = logging.getLogger(__name__)
+
+# estimated memory used by a cached datapoint: a list, its value and its timestamp
+DATAPOINT_SIZE = 120
+# estimated memory used by a cached serie without its datapoints
+SERIE_SIZE = 200
+
+# aggregations which do not compute a value per time interval
+UNCACHED_AGGREGATIONS = ('none', 'on changes')
+
+
+class MemoryBackend:
+    """
+    LRU store of the cache entries of the current process, bounded by the estimated size of its entries.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, size: int):
+        if size > self.max_size:
+            return
+        self.remove(key)
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+class CacheEntry:
+    """
+    Aggregated series of a query over a range of complete intervals.
+    """
+
+    def __init__(self, first: int, last: int, series: dict):
+        self.first = first  # first interval
+        self.last = last  # interval after the last one
+        self.series = series  # datapoints by serie name, in time order
+
+    @property
+    def size(self):
+        return sum(SERIE_SIZE + len(datapoints) * DATAPOINT_SIZE for datapoints in self.series.values())
+
+
+def _keep_intervals(datapoints: list, interval_ms: int, first: int, last: int, inside: bool = True):
+    start, end = first * interval_ms, last * interval_ms
+    return [datapoint for datapoint in datapoints if (start <= datapoint[1] < end) == inside]
+
+
+class ResultCache:
+    """
+    Cache of aggregated series by query template, aggregation and interval.
+
+    Only complete intervals older than the freshness horizon are cached: once written, their values are not
+    expected to change. The intervals of a time range found in the cache are served from memory, only the
+    edges of the range are queried.
+    """
+
+    def __init__(self, backend, horizon_ms: int):
+        self.backend = backend
+        self.horizon_ms = horizon_ms
+
+    @staticmethod
+    def is_cacheable(target: dict, interval_ms):
+        """
+        :param target: a query target
+        :param interval_ms: interval between two datapoints, in milliseconds
+        :return: True if the target answers a value per time interval
+        """
+        return (
+            bool(interval_ms)
+            and (target.get('type') or 'timeserie') == 'timeserie'
+            and target.get('aggregation') not in UNCACHED_AGGREGATIONS
+        )
+
+    @staticmethod
+    def make_key(keyspace: str, query: str, aggregation: str, interval_ms: int, filters: tuple = ()):
+        """
+        :param keyspace: keyspace of the session the query is executed with
+        :param query: the query, with its macros
+        :param aggregation: the aggregation method
+        :param interval_ms: interval between two datapoints, in milliseconds
+        :param filters: identifies the ad hoc filters applied to the query results
+        :return: the key of the query series in the cache
+        """
+        template, _ = bind_macros(query.strip(), {'startTime': None, 'endTime': None})
+        if filters:
+            return keyspace, template, aggregation, interval_ms, filters
+        return keyspace, template, aggregation, interval_ms
+
+    @staticmethod
+    def complete_intervals(start_time: int, end_time: int, interval_ms: int):
+        """
+        :param start_time: start of the time range, in microseconds
+        :param end_time: end of the time range, in microseconds
+        :param interval_ms: interval between two datapoints, in milliseconds
+        :return: first interval fully inside the time range and the interval after the last one
+        """
+        width = interval_ms * 1000
+        # time range bounds may be excluded by the query, intervals starting at the range start are not complete
+        return start_time // width + 1, end_time // width
+
+    def lookup(self, key, start_time: int, end_time: int, interval_ms: int):
+        """
+        Find the cached part of a time range.
+
+        :param key: key of the query series
+        :param start_time: start of the time range, in microseconds
+        :param end_time: end of the time range, in microseconds
+        :param interval_ms: interval between two datapoints, in milliseconds
+        :return: the cached intervals of the range, as a CacheEntry, None if none is cached
+        """
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+
+        first, last = self.complete_intervals(start_time, end_time, interval_ms)
+        first, last = max(first, entry.first), min(last, entry.last)
+        if first >= last:
+            return None
+
+        return CacheEntry(first, last, {
+            name: _keep_intervals(datapoints, interval_ms, first, last)
+            for name, datapoints in entry.series.items()
+        })
+
+    @staticmethod
+    def edges(cached: CacheEntry, start_time: int, end_time: int, interval_ms: int):
+        """
+        Time ranges to query around the cached intervals.
+
+        :param cached: the cached intervals of the range, None if none is cached
+        :param start_time: start of the time range, in microseconds
+        :param end_time: end of the time range, in microseconds
+        :param interval_ms: interval between two datapoints, in milliseconds
+        :return: (start, end) of the time ranges to query, in microseconds
+        """
+        if cached is None:
+            return [(start_time, end_time)]
+
+        width = interval_ms * 1000
+        edges = []
+        if start_time < cached.first * width:
+            edges.append((start_time, cached.first * width))
+        if cached.last * width < end_time:
+            # one microsecond earlier, the interval start is queried whether the start bound is excluded or not
+            edges.append((cached.last * width - 1, end_time))
+        return edges
+
+    @staticmethod
+    def merge(cached: CacheEntry, edge_series: list, interval_ms: int):
+        """
+        Merge the cached intervals with the series of the queried edges.
+
+        :param cached: the cached intervals of the range, None if none is cached
+        :param edge_series: series of each queried edge, as built by TimeserieBuilder
+        :param interval_ms: interval between two datapoints, in milliseconds
+        :return: the datapoints of every serie, by serie name, in time order
+        """
+        series = {name: list(datapoints) for name, datapoints in cached.series.items()} if cached else {}
+
+        for results in edge_series:
+            for result in results:
+                datapoints = result['datapoints']
+                if cached:
+                    # queried edges overlap the cached intervals by a microsecond
+                    datapoints = _keep_intervals(datapoints, interval_ms, cached.first, cached.last, inside=False)
+                series.setdefault(result['target'], []).extend(datapoints)
+
+        for datapoints in series.values():
+            datapoints.sort(key=lambda datapoint: datapoint[1])
+        return series
+
+    def store(self, key, series: dict, start_time: int, end_time: int, interval_ms: int, now: float = None):
+        """
+        Cache the complete intervals of a time range older than the freshness horizon.
+
+        :param key: key of the query series
+        :param series: the datapoints of every serie of the range, by serie name, before any fill
+        :param start_time: start of the time range, in microseconds
+        :param end_time: end of the time range, in microseconds
+        :param interval_ms: interval between two datapoints, in milliseconds
+        :param now: current timestamp, in seconds
+        """
+        now_ms = (time.time() if now is None else now) * 1000
+        first, last = self.complete_intervals(start_time, end_time, interval_ms)
+        last = min(last, int((now_ms - self.horizon_ms) // interval_ms))
+        if first >= last:
+            return
+
+        entry = CacheEntry(first, last, {
+            name: _keep_intervals(datapoints, interval_ms, first, last)
+            for name, datapoints in series.items()
+        })
+
+        previous = self.backend.get(key)
+        if previous is not None and previous.first <= last and first <= previous.last:
+            # contiguous ranges are merged into a single one
+            names = list(previous.series) + [name for name in entry.series if name not in previous.series]
+            entry = CacheEntry(min(first, previous.first), max(last, previous.last), {
+                name: sorted(
+                    _keep_intervals(previous.series.get(name, []), interval_ms, first, last, inside=False)
+                    + entry.series.get(name, []),
+                    key=lambda datapoint: datapoint[1]
+                ) for name in names
+            })
+
+        self.backend.put(key, entry, entry.size)
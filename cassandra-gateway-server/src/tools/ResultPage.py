@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ResultPage(list):
+    """
+    Rows of a result page, as plain tuples, along with the names of their columns.
+    """
+
+    def __init__(self, column_names, rows):
+        super().__init__(rows)
+        self.column_names = list(column_names)
+
+
+def page_factory(column_names, rows):
+    """
+    Driver row factory building a ResultPage.
+
+    Rows are kept as the tuples decoded by the driver, columns are looked up by position
+    once per page instead of by attribute for every row.
+
+    :param column_names: names of the result columns
+    :param rows: the decoded rows
+    :return: the result page
+    """
+    return ResultPage(column_names, rows)
+
+
+def get_column_names(rows):
+    """
+    Names of the columns of a result page.
+
+    :param rows: a ResultPage, or a list of namedtuple rows
+    :return: the column names, an empty list if unknown
+    """
+    column_names = getattr(rows, 'column_names', None)
+    if column_names is not None:
+        return column_names
+    if rows:
+        return list(rows[0]._fields)
+    return []
+
+
+def get_column_types(statement):
+    """
+    CQL type names of the result columns of a prepared statement.
+
+    :param statement: the prepared statement
+    :return: type names by column name
+    """
+    return {
+        column[2]: getattr(column[3], 'typename', None)
+        for column in getattr(statement, 'result_metadata', None) or []
+    }
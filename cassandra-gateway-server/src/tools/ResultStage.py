@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import asyncio
+import logging
+import multiprocessing
+from array import array
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from tools.ResultPage import ResultPage, get_column_names
+
+logger = logging.getLogger(__name__)
+
+# rows rebuilt at once from the columns, by the process processing them
+PAGE_SIZE = 5000
+
+# executors of this process, created on first use as worker processes get forked before
+executors = {}
+
+
+def get_executor(kind: str, workers: int):
+    """
+    :param kind: 'thread' or 'process'
+    :param workers: threads or processes of the executor
+    :return: the executor of this process
+    """
+    key = (os.getpid(), kind)
+    executor = executors.get(key)
+    if executor is None:
+        if kind == 'process':
+            # spawned, forking a process running the driver threads is not safe
+            executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            executor = ThreadPoolExecutor(workers, thread_name_prefix='results')
+        executors[key] = executor
+    return executor
+
+
+class ColumnarRows:
+    """
+    Rows of result pages stored by columns, compact to hand over to another process.
+
+    Integer and float columns are typed arrays, text columns hold interned strings so equal values
+    are pickled once.
+    """
+
+    def __init__(self, column_names: list):
+        self.column_names = list(column_names)
+        self.columns = None
+        self.rows = 0
+
+    @staticmethod
+    def _new_column(value):
+        if isinstance(value, float):
+            return array('d')
+        if isinstance(value, int) and not isinstance(value, bool):
+            return array('q')
+        return []
+
+    def add_page(self, rows):
+        if not rows:
+            return
+        if self.columns is None:
+            self.columns = [self._new_column(value) for value in rows[0]]
+            self.text_columns = {index for index, value in enumerate(rows[0]) if isinstance(value, str)}
+
+        for index, column in enumerate(self.columns):
+            try:
+                if index in self.text_columns:
+                    column.extend(map(sys.intern, map(itemgetter(index), rows)))
+                else:
+                    column.extend(map(itemgetter(index), rows))
+                continue
+            except (TypeError, OverflowError):
+                # a null, or another type, in this column: stored as it comes from now on
+                if isinstance(column, array):
+                    column = self.columns[index] = list(column)
+                self.text_columns.discard(index)
+                del column[self.rows:]
+            column.extend(map(itemgetter(index), rows))
+        self.rows += len(rows)
+
+    def pages(self):
+        """
+        :return: an iterator over the rows, one result page at a time
+        """
+        for start in range(0, self.rows, PAGE_SIZE):
+            yield ResultPage(
+                self.column_names,
+                zip(*(column[start:start + PAGE_SIZE] for column in self.columns))
+            )
+
+
+def build_results(builder, columns: ColumnarRows):
+    """
+    Feed rows stored by columns to a builder and finish it, run by an executor.
+
+    :param builder: a TimeserieBuilder or a TableBuilder
+    :param columns: the rows
+    :return: the builder results
+    """
+    for page in columns.pages():
+        builder.add_rows(page)
+    return builder.results()
+
+
+class ResultStage:
+    """
+    Parse and aggregate the result pages of a query, off the event loop once the result gets large.
+
+    Pages are fed to the builder on the event loop until `threshold` rows are read. Then:
+    - 'thread': pages are fed to the builder by a thread of the executor, one page at a time;
+    - 'process': pages are stored by columns, then handed over with the builder to a process of the executor.
+    """
+
+    def __init__(self, builder, kind: str = 'none', threshold: int = 0, workers: int = 2):
+        """
+        :param builder: a TimeserieBuilder or a TableBuilder
+        :param kind: 'thread', 'process' or 'none' to always stay on the event loop
+        :param threshold: rows read before leaving the event loop
+        :param workers: threads or processes of the executor
+        """
+        self.builder = builder
+        self.kind = kind
+        self.threshold = threshold
+        self.workers = workers
+        self.rows = 0
+        self.columns = None
+
+    @property
+    def offloaded(self):
+        return self.kind in ('thread', 'process') and self.rows > self.threshold
+
+    async def add_rows(self, rows):
+        self.rows += len(rows)
+        if not self.offloaded:
+            self.builder.add_rows(rows)
+        elif self.kind == 'thread':
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(get_executor(self.kind, self.workers), self.builder.add_rows, rows)
+        else:
+            if self.columns is None:
+                self.columns = ColumnarRows(get_column_names(rows))
+            self.columns.add_page(rows)
+
+    async def results(self):
+        if not self.offloaded:
+            return self.builder.results()
+
+        loop = asyncio.get_event_loop()
+        executor = get_executor(self.kind, self.workers)
+        if self.columns is None:
+            return await loop.run_in_executor(executor, self.builder.results)
+        logger.debug(f'{self.columns.rows} rows processed by another process')
+        return await loop.run_in_executor(executor, build_results, self.builder, self.columns)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+import json
+import mmap
+import struct
+import hashlib
+import logging
+import multiprocessing
+from array import array
+from tools.JsonEncoder import encode
+from tools.ResultCache import CacheEntry
+
+logger = logging.getLogger(__name__)
+
+# shard layout: a header, a table of slots then a ring of records
+SHARD_HEADER = struct.Struct('<Q')  # absolute write position of the ring
+SLOT = struct.Struct('<QQI')  # key hash, absolute position of the record, length of the record
+RECORD_HEADER = struct.Struct('<I')  # key length, followed by the key then the value
+
+# slots probed for a key
+PROBES = 8
+# average record size expected, gives the number of slots of a shard
+RECORD_SIZE = 1024
+
+# encoded entry: first interval, last interval and number of series, then each serie
+ENTRY_HEADER = struct.Struct('<qqI')
+NAME_HEADER = struct.Struct('<I')  # length of the JSON encoded serie name
+NUMBERS_HEADER = struct.Struct('<Icc')  # datapoints count, typecodes of the values and of the timestamps
+JSON_HEADER = struct.Struct('<I')  # length of the JSON encoded datapoints
+NUMBERS, JSON = b'n', b'j'
+
+
+def _pack_numbers(numbers: list):
+    if all(type(number) is int for number in numbers):
+        typecode = 'q'
+    elif all(type(number) in (int, float) for number in numbers):
+        typecode = 'd'
+    else:
+        return None, None
+    try:
+        return typecode.encode(), array(typecode, numbers).tobytes()
+    except OverflowError:
+        return None, None
+
+
+def encode_entry(entry: CacheEntry):
+    """
+    Binary encoding of a cache entry, numeric datapoints are stored as arrays of 64 bits numbers.
+
+    :param entry: the cache entry
+    :return: the encoded entry
+    """
+    parts = [ENTRY_HEADER.pack(entry.first, entry.last, len(entry.series))]
+    for name, datapoints in entry.series.items():
+        encoded_name = encode(name)
+        parts.append(NAME_HEADER.pack(len(encoded_name)))
+        parts.append(encoded_name)
+
+        values_typecode, values = _pack_numbers([value for value, _ in datapoints])
+        timestamps_typecode, timestamps = _pack_numbers([timestamp for _, timestamp in datapoints])
+        if values is None or timestamps is None:
+            # text values
+            encoded_datapoints = encode(datapoints)
+            parts.extend((JSON, JSON_HEADER.pack(len(encoded_datapoints)), encoded_datapoints))
+            continue
+        parts.extend((NUMBERS, NUMBERS_HEADER.pack(len(datapoints), values_typecode, timestamps_typecode),
+                      values, timestamps))
+    return b''.join(parts)
+
+
+def decode_entry(data: bytes):
+    """
+    :param data: an entry encoded by encode_entry
+    :return: the cache entry
+    """
+    view = memoryview(data)
+    first, last, count = ENTRY_HEADER.unpack_from(view)
+    position = ENTRY_HEADER.size
+
+    series = {}
+    for _ in range(count):
+        name_length, = NAME_HEADER.unpack_from(view, position)
+        position += NAME_HEADER.size
+        name = json.loads(bytes(view[position:position + name_length]))
+        position += name_length
+
+        encoding = bytes(view[position:position + 1])
+        position += 1
+        if encoding == JSON:
+            length, = JSON_HEADER.unpack_from(view, position)
+            position += JSON_HEADER.size
+            series[name] = json.loads(bytes(view[position:position + length]))
+            position += length
+            continue
+
+        points, values_typecode, timestamps_typecode = NUMBERS_HEADER.unpack_from(view, position)
+        position += NUMBERS_HEADER.size
+        columns = []
+        for typecode in (values_typecode, timestamps_typecode):
+            column = array(typecode.decode())
+            column.frombytes(view[position:position + points * column.itemsize])
+            position += points * column.itemsize
+            columns.append(column.tolist())
+        series[name] = list(map(list, zip(*columns)))
+
+    return CacheEntry(first, last, series)
+
+
+class Shard:
+    """
+    Records of a part of the keys, written one after the other in a ring, the oldest being overwritten first.
+
+    Slots index the records by key hash, a slot is stale once its record got overwritten.
+    """
+
+    def __init__(self, memory: mmap.mmap, start: int, size: int):
+        self.memory = memory
+        self.lock = multiprocessing.Lock()
+        self.slots = max(PROBES, size // (RECORD_SIZE + SLOT.size))
+        self.slots_start = start + SHARD_HEADER.size
+        self.ring_start = self.slots_start + self.slots * SLOT.size
+        self.ring_size = start + size - self.ring_start
+
+    def _head(self):
+        return SHARD_HEADER.unpack_from(self.memory, self.slots_start - SHARD_HEADER.size)[0]
+
+    def _slot(self, index: int):
+        return SLOT.unpack_from(self.memory, self.slots_start + index * SLOT.size)
+
+    def _probe(self, key_hash: int):
+        first = key_hash % self.slots
+        return [(first + probe) % self.slots for probe in range(PROBES)]
+
+    def _is_valid(self, position: int, length: int, head: int):
+        # the ring overwrote the record once written further than a whole ring after it
+        return length and head <= position + self.ring_size
+
+    def get(self, key: bytes, key_hash: int):
+        with self.lock:
+            head = self._head()
+            for index in self._probe(key_hash):
+                slot_hash, position, length = self._slot(index)
+                if slot_hash != key_hash or not self._is_valid(position, length, head):
+                    continue
+                start = self.ring_start + position % self.ring_size
+                key_length, = RECORD_HEADER.unpack_from(self.memory, start)
+                start += RECORD_HEADER.size
+                if self.memory[start:start + key_length] != key:
+                    continue
+                return self.memory[start + key_length:start + length - RECORD_HEADER.size]
+        return None
+
+    def put(self, key: bytes, key_hash: int, value: bytes):
+        length = RECORD_HEADER.size + len(key) + len(value)
+        if length > self.ring_size:
+            return False
+
+        with self.lock:
+            head = self._head()
+            offset = head % self.ring_size
+            if offset + length > self.ring_size:
+                # records do not wrap around the end of the ring
+                head += self.ring_size - offset
+                offset = 0
+
+            start = self.ring_start + offset
+            RECORD_HEADER.pack_into(self.memory, start, len(key))
+            start += RECORD_HEADER.size
+            self.memory[start:start + len(key)] = key
+            self.memory[start + len(key):start + length - RECORD_HEADER.size] = value
+
+            # same key first, then a stale slot, then the oldest record
+            chosen = None
+            oldest = None
+            for index in self._probe(key_hash):
+                slot_hash, position, slot_length = self._slot(index)
+                if slot_hash == key_hash:
+                    chosen = index
+                    break
+                if chosen is None and not self._is_valid(position, slot_length, head + length):
+                    chosen = index
+                if oldest is None or position < oldest[1]:
+                    oldest = (index, position)
+            if chosen is None:
+                chosen = oldest[0]
+
+            SLOT.pack_into(self.memory, self.slots_start + chosen * SLOT.size, key_hash, head, length)
+            SHARD_HEADER.pack_into(self.memory, self.slots_start - SHARD_HEADER.size, head + length)
+        return True
+
+    def remove(self, key_hash: int):
+        with self.lock:
+            for index in self._probe(key_hash):
+                if self._slot(index)[0] == key_hash:
+                    SLOT.pack_into(self.memory, self.slots_start + index * SLOT.size, 0, 0, 0)
+
+    def used(self):
+        return min(self._head(), self.ring_size)
+
+    def clear(self):
+        with self.lock:
+            end = self.ring_start
+            start = self.slots_start - SHARD_HEADER.size
+            self.memory[start:end] = bytes(end - start)
+
+
+class SharedMemoryBackend:
+    """
+    Store of cache entries shared by the processes forked after its creation.
+
+    Entries live in an anonymous shared memory map, bounded to `max_size` bytes, split into shards each
+    guarded by its own lock. A shard is a ring of records: once full, the oldest records are overwritten.
+    """
+
+    def __init__(self, max_size: int, shards: int = 16):
+        shard_size = max_size // shards
+        self.memory = mmap.mmap(-1, shard_size * shards)
+        self.shards = [Shard(self.memory, index * shard_size, shard_size) for index in range(shards)]
+
+    @staticmethod
+    def _key(key):
+        encoded = repr(key).encode('utf-8')
+        # the builtin hash of str is randomized by process
+        return encoded, int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), 'little') or 1
+
+    def _shard(self, key_hash: int):
+        return self.shards[(key_hash >> 32) % len(self.shards)]
+
+    def get(self, key):
+        encoded, key_hash = self._key(key)
+        data = self._shard(key_hash).get(encoded, key_hash)
+        if data is None:
+            return None
+        return decode_entry(data)
+
+    def put(self, key, value: CacheEntry, size: int = None):
+        encoded, key_hash = self._key(key)
+        if not self._shard(key_hash).put(encoded, key_hash, encode_entry(value)):
+            logger.debug(f'Cache entry larger than a shard, not stored: {key}')
+
+    def remove(self, key):
+        _, key_hash = self._key(key)
+        self._shard(key_hash).remove(key_hash)
+
+    def clear(self):
+        for shard in self.shards:
+            shard.clear()
+
+    @property
+    def size(self):
+        return sum(shard.used() for shard in self.shards)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """
+    A call in flight, along with the number of callers waiting for it.
+    """
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Run a call once for all the concurrent callers asking for the same key.
+
+    Callers arriving while a call is in flight await its result instead of running it again.
+    The call is cancelled once every caller waiting for it got cancelled.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.executed = 0  # calls actually run
+        self.coalesced = 0  # calls answered by a call already in flight
+
+    def _land(self, key, flight: Flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+    async def run(self, key, call):
+        """
+        Run a call, or wait for the same call already in flight.
+
+        :param key: identifies the calls giving the same result, must be hashable
+        :param call: coroutine function, called without arguments
+        :return: the result of the call, shared by every concurrent caller
+        """
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = Flight(asyncio.ensure_future(call()))
+            flight.future.add_done_callback(lambda _: self._land(key, flight))
+            self.executed += 1
+        else:
+            logger.debug(f'Waiting for the same call in flight: {key}')
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            # shielded, a cancelled caller must not cancel the call shared with others
+            return await asyncio.shield(flight.future)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.future.done():
+                flight.future.cancel()
+                self._land(key, flight)
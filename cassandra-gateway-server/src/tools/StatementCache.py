@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import re
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# a CQL string literal (skipped) or a `$macro`
+MACRO_PATTERN = re.compile(r"'(?:[^']|'')*'|\$(\w+)")
+# a read query, the only kind safe to retry or to execute speculatively
+READ_PATTERN = re.compile(r'\s*SELECT\b', re.IGNORECASE)
+
+
+def bind_macros(query: str, macros: dict):
+    """
+    Turn the known `$macro` of a query into bind markers.
+
+    Macros inside CQL string literals and unknown macros are left untouched.
+
+    :param query: the query with its macros
+    :param macros: macro values by name (without the leading `$`)
+    :return: the query template with bind markers and its parameters, in the bind markers order
+    """
+    parameters = []
+
+    def replace(match):
+        name = match.group(1)
+        if name is None or name not in macros:
+            return match.group(0)
+        parameters.append(macros[name])
+        return '?'
+
+    template = MACRO_PATTERN.sub(replace, query)
+    return template, parameters
+
+
+def get_table_metadata(session, prepared):
+    """
+    Metadata of the table a prepared statement reads from.
+
+    :param session: the session the statement got prepared with
+    :param prepared: the prepared statement
+    :return: the table metadata, None if unknown
+    """
+    columns = prepared.column_metadata or prepared.result_metadata
+    if not columns:
+        return None
+    keyspace_name, table_name = columns[0][0], columns[0][1]
+    keyspace = session.cluster.metadata.keyspaces.get(keyspace_name)
+    if not keyspace:
+        return None
+    return keyspace.tables.get(table_name)
+
+
+class StatementCache:
+    """
+    LRU cache of prepared statements, keyed by keyspace and query template.
+
+    An entry is dropped as soon as the metadata of the table it reads from is replaced by a schema change.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.pending = {}
+
+    def _lookup(self, session, key):
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+
+        prepared, table = entry
+        if table is not None and get_table_metadata(session, prepared) is not table:
+            logger.debug(f'Schema changed, dropping prepared statement: {key[1]}')
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return prepared
+
+    def _store(self, session, key, prepared):
+        self.entries[key] = (prepared, get_table_metadata(session, prepared))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def prepare(self, session, template: str):
+        """
+        Return the prepared statement of a query template, preparing it if needed.
+
+        Preparation is a blocking driver call, it runs in an executor. Concurrent requests for the
+        same template share the same preparation.
+
+        :param session: the cassandra session to prepare with
+        :param template: the query template, with bind markers
+        :return: the prepared statement
+        """
+        key = (session.keyspace, template)
+
+        prepared = self._lookup(session, key)
+        if prepared:
+            return prepared
+
+        if key not in self.pending:
+            loop = asyncio.get_event_loop()
+            self.pending[key] = loop.run_in_executor(None, session.prepare, template)
+
+        future = self.pending[key]
+        try:
+            # shielded, a cancelled request must not cancel the preparation shared with others
+            prepared = await asyncio.shield(future)
+        finally:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+        # read queries can be safely retried or speculatively executed, writes (counters, lists...) cannot
+        prepared.is_idempotent = READ_PATTERN.match(template) is not None
+        self._store(session, key, prepared)
+        return prepared
+
+    def invalidate(self, session=None, template: str = None):
+        """
+        Drop one prepared statement, or all of them.
+
+        :param session: the session the statement got prepared with
+        :param template: the query template of the statement
+        """
+        if template is None:
+            self.entries.clear()
+            return
+        self.entries.pop((session.keyspace, template), None)
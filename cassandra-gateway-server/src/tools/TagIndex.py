@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import mmap
+import time
+import struct
+import asyncio
+import logging
+import multiprocessing
+from cassandra import DriverException
+from cassandra.cluster import NoHostAvailable
+from cassandra.metadata import protect_name
+from tornado import ioloop
+from tools import server
+from tools.CassandraClient import Client, iterate_pages
+
+logger = logging.getLogger(__name__)
+
+# CQL types reported as 'number' tag keys
+NUMBER_TYPES = {'tinyint', 'smallint', 'int', 'bigint', 'varint', 'float', 'double', 'decimal', 'counter'}
+
+INDEX_HEADER = struct.Struct('<QI')  # generation of the shared index, length of its JSON encoding
+# seconds between two checks for a new shared index, by the workers not refreshing it
+SHARED_INDEX_POLL_INTERVAL = 1
+
+
+def get_tables(session):
+    """
+    :param session: a cassandra session
+    :return: metadata of the tables of the session keyspace, of every non system keyspace without one
+    """
+    metadata = session.cluster.metadata
+    if session.keyspace:
+        names = [session.keyspace]
+    else:
+        names = [name for name in metadata.keyspaces if not name.startswith('system')]
+    for name in names:
+        keyspace = metadata.keyspaces.get(name)
+        if keyspace:
+            yield from keyspace.tables.values()
+
+
+def _sorted(values: set):
+    try:
+        return sorted(values)
+    except TypeError:
+        # mixed types, from tables using the same column name
+        return sorted(values, key=str)
+
+
+class IndexStore:
+    """
+    Tag index shared by the worker processes, in an anonymous shared memory map created before they get forked.
+
+    A single worker refreshes the index and writes it, the other ones read each new generation of it.
+    """
+
+    def __init__(self, size: int):
+        """
+        :param size: bytes of the shared memory map
+        """
+        self.memory = mmap.mmap(-1, size)
+        self.lock = multiprocessing.Lock()
+
+    def write(self, index: dict):
+        """
+        :param index: distinct values as text, by column name
+        :return: False if the index is too large to be shared, an empty one is shared instead
+        """
+        data = json.dumps(index, separators=(',', ':')).encode('utf-8')
+        shared = INDEX_HEADER.size + len(data) <= len(self.memory)
+        if not shared:
+            logger.warning(f'Tag index of {len(data)} bytes larger than TAG_INDEX_SHARED_SIZE, not shared')
+            data = b'{}'
+        with self.lock:
+            generation, _ = INDEX_HEADER.unpack_from(self.memory, 0)
+            self.memory[INDEX_HEADER.size:INDEX_HEADER.size + len(data)] = data
+            INDEX_HEADER.pack_into(self.memory, 0, generation + 1, len(data))
+        return shared
+
+    def read(self, known_generation: int = 0):
+        """
+        :param known_generation: generation of the index already read
+        :return: the current generation, and the index if it is a newer one, None otherwise
+        """
+        with self.lock:
+            generation, length = INDEX_HEADER.unpack_from(self.memory, 0)
+            if generation == known_generation:
+                return generation, None
+            data = self.memory[INDEX_HEADER.size:INDEX_HEADER.size + length]
+        return generation, json.loads(data)
+
+
+class TagIndex:
+    """
+    Distinct values of the partition key columns and of a few other columns (`name`) of the tables, to answer
+    tag values and template variable queries without scanning cassandra each time.
+
+    The index is rebuilt in the background at regular intervals. It is bounded: at most `max_rows` rows are read
+    per scanned table column and at most `max_values` values are kept per column.
+
+    With a store shared by the worker processes, only the first worker scans the tables, the other ones read
+    the index it publishes.
+    """
+
+    def __init__(self, columns: list, max_values: int = 10000, max_rows: int = 100000,
+                 refresh_interval: float = 300, store: IndexStore = None):
+        """
+        :param columns: columns indexed besides the partition key columns, when the tables have them
+        :param max_values: distinct values kept per column
+        :param max_rows: rows read per table column
+        :param refresh_interval: seconds between two refreshes, 0 to disable the index
+        :param store: the index shared by the worker processes, None to refresh it in each process
+        """
+        self.store = store
+        self.generation = 0  # of the shared index last read
+        self.columns = list(columns)
+        self.max_values = max_values
+        self.max_rows = max_rows
+        self.refresh_interval = refresh_interval
+        self.index = {}  # column name: distinct values, as text
+        self.refresh_time = None
+        self.refreshing = None
+        self.refresher_pid = None
+
+    def indexed_columns(self, table):
+        """
+        :param table: metadata of a table
+        :return: metadata of its partition key columns, then of its other indexed columns
+        """
+        partition_key = list(table.partition_key)
+        names = {column.name for column in partition_key}
+        return partition_key + [
+            table.columns[name] for name in self.columns if name in table.columns and name not in names
+        ]
+
+    def keys(self, session):
+        """
+        :param session: a cassandra session
+        :return: the indexed columns of the tables, as tag keys: {'type': 'string' or 'number', 'text': name}
+        """
+        keys = {}
+        for table in get_tables(session):
+            for column in self.indexed_columns(table):
+                keys[column.name] = 'number' if column.cql_type in NUMBER_TYPES else 'string'
+        return [{'type': key_type, 'text': name} for name, key_type in sorted(keys.items())]
+
+    def values(self, key: str):
+        """
+        :param key: a column name
+        :return: its distinct values as text, empty if the column is not indexed
+        """
+        return self.index.get(key, [])
+
+    async def _scan(self, session, query: str, column_names: list, values: dict):
+        rows = 0
+        pages = iterate_pages(session, query)
+        try:
+            async for page in pages:
+                for row in page:
+                    for position, name in enumerate(column_names):
+                        distinct = values.setdefault(name, set())
+                        if len(distinct) < self.max_values and row[position] is not None:
+                            distinct.add(row[position])
+                rows += len(page)
+                if rows >= self.max_rows:
+                    logger.info(f'Index of {", ".join(column_names)} truncated after {rows} rows: {query}')
+                    return
+        finally:
+            await pages.aclose()
+
+    async def refresh(self, session):
+        """
+        Rebuild the index, one table column at a time, then replace the previous one.
+
+        :param session: a cassandra session
+        """
+        started = time.monotonic()
+        values = {}
+        for table in list(get_tables(session)):
+            name = f'{protect_name(table.keyspace_name)}.{protect_name(table.name)}'
+            partition_key = [column.name for column in table.partition_key]
+            await self._scan(
+                session,
+                f'SELECT DISTINCT {", ".join(map(protect_name, partition_key))} FROM {name}',
+                partition_key,
+                values
+            )
+            for column in self.indexed_columns(table)[len(partition_key):]:
+                await self._scan(session, f'SELECT {protect_name(column.name)} FROM {name}', [column.name], values)
+
+        self.index = {column: [str(value) for value in _sorted(distinct)] for column, distinct in values.items()}
+        self.refresh_time = time.monotonic()
+        logger.info(f'Tag index of {len(self.index)} columns refreshed in {self.refresh_time - started:.3f} s')
+
+    def _refresh_in_background(self):
+        if self.refreshing and not self.refreshing.done():
+            return
+        self.refreshing = asyncio.ensure_future(self._refresh())
+
+    async def _refresh(self):
+        try:
+            await self.refresh(await Client.get_client())
+        except (OSError, DriverException, NoHostAvailable) as e:
+            logger.warning(f'Tag index not refreshed: {e}')
+            if self.store is not None and self.refresh_time is None:
+                # the other workers do not wait for an index which is not coming
+                self.store.write({})
+            return
+        if self.store is not None:
+            self.store.write(self.index)
+
+    def _load(self):
+        """
+        Read the shared index if a new generation of it was published.
+
+        :return: True once an index was read
+        """
+        generation, index = self.store.read(self.generation)
+        if index is not None:
+            self.index = index
+            self.generation = generation
+            self.refresh_time = time.monotonic()
+        return self.generation > 0
+
+    async def _wait_published(self):
+        while not self._load():
+            await asyncio.sleep(SHARED_INDEX_POLL_INTERVAL)
+
+    def start(self):
+        """
+        Refresh the index now then at regular intervals, in the background of this process,
+        or follow the index shared by the worker refreshing it. Called by every request as it is cheap.
+        """
+        if not self.refresh_interval or self.refresher_pid == os.getpid():
+            return
+        self.refresher_pid = os.getpid()
+        self.index = {}
+        self.refresh_time = None
+        self.generation = 0
+
+        if self.store is not None and server.worker_id:
+            # the first worker scans the tables for all of them
+            self.refreshing = asyncio.ensure_future(self._wait_published())
+            ioloop.PeriodicCallback(self._load, SHARED_INDEX_POLL_INTERVAL * 1000).start()
+            return
+
+        self.refreshing = asyncio.ensure_future(self._refresh())
+        ioloop.PeriodicCallback(self._refresh_in_background, self.refresh_interval * 1000).start()
+
+    async def ready(self):
+        """
+        Wait for the first refresh of this process to be done, or for the first shared index to be read.
+        """
+        if self.refresh_time is None and self.refreshing:
+            # shielded, a cancelled request must not cancel the refresh
+            await asyncio.shield(self.refreshing)
@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from operator import itemgetter
+from tools.Downsampling import downsample
+from tools.ResultPage import get_column_names
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:  # optional, vectorized aggregation engine
+    numpy = None
+
+# 'numpy' when installed, 'python' otherwise
+DEFAULT_ENGINE = 'numpy' if numpy else 'python'
+
+# CQL types decoded as python floats by the driver
+FLOAT_TYPES = ('double', 'float')
+
+# ways to fill the intervals without datapoint, anything else leaves them empty
+FILL_MODES = ('null', 'previous', 'zero')
+
+# aggregation methods reduced by numpy ufuncs, other methods are computed from sums and counts
+NUMPY_REDUCERS = {
+    'sum': 'add',
+    'minimum': 'minimum',
+    'maximum': 'maximum',
+    'and': 'logical_and',
+    'or': 'logical_or'
+}
+
+
+def compute_aggregation(points: list, method: str):
+    """
+    Aggregate values into a single one.
+
+    :param points: the values to aggregate
+    :param method: aggregation method, average if unknown
+    :return: the aggregated value
+    """
+    if method == 'sum':
+        return sum(points)
+    elif method == 'minimum':
+        return min(points)
+    elif method == 'maximum':
+        return max(points)
+    elif method == 'and':
+        return all(points)
+    elif method == 'or':
+        return any(points)
+    elif method == 'count':
+        return len(points)
+    # default is average
+    return sum(points) / len(points)
+
+
+class Aggregator:
+    """
+    Build the datapoints of a serie from its values, as they come.
+    """
+
+    def add(self, value, timestamp):
+        raise NotImplementedError
+
+    def add_page(self, values, timestamps):
+        """
+        Add the values of a whole result page then end it.
+
+        :param values: the values, in time order
+        :param timestamps: the timestamps of the values, in milliseconds
+        """
+        self._add_one_by_one(values, timestamps)
+
+    def _add_one_by_one(self, values, timestamps):
+        for value, timestamp in zip(values, timestamps):
+            self.add(value, timestamp)
+        self.end_page()
+
+    def end_page(self):
+        """
+        Called once all the values of a result page are added.
+        """
+        pass
+
+    def finish(self):
+        """
+        :return: the datapoints, [value, timestamp in milliseconds]
+        """
+        raise NotImplementedError
+
+
+class RawAggregator(Aggregator):
+    """
+    Keep every datapoint of a serie, stored by columns.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.timestamps = []
+
+    def add(self, value, timestamp):
+        self.values.append(value)
+        self.timestamps.append(timestamp)
+
+    def add_page(self, values, timestamps):
+        self.values.extend(values)
+        self.timestamps.extend(timestamps)
+        self.end_page()
+
+    def finish(self, max_points: int = None, downsampling: str = 'none'):
+        """
+        :param max_points: datapoints the panel asks for at most
+        :param downsampling: 'lttb' or 'minmax' to reduce the serie to `max_points` datapoints, see `downsample`
+        :return: the datapoints, [value, timestamp in milliseconds]
+        """
+        values, timestamps = downsample(self.values, self.timestamps, max_points, downsampling)
+        return list(map(list, zip(values, timestamps)))
+
+
+class ChangesAggregator(RawAggregator):
+    """
+    Keep the datapoints of a serie only when their value changes.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.last_value = None
+
+    def add(self, value, timestamp):
+        if value == self.last_value:
+            return
+        self.values.append(value)
+        self.timestamps.append(timestamp)
+        self.last_value = value
+
+    def add_page(self, values, timestamps):
+        # every value is compared to the previous one
+        self._add_one_by_one(values, timestamps)
+
+
+def fill_datapoints(datapoints: list, fill: str, interval_ms: int, time_range: tuple = None):
+    """
+    Give a datapoint to every interval of a serie, from the start to the end of the time range.
+
+    :param datapoints: aggregated datapoints, stamped with the start of their interval
+    :param fill: 'null', 'previous' or 'zero' to fill the empty intervals, anything else to leave them empty
+    :param interval_ms: interval between two datapoints, in milliseconds
+    :param time_range: start and end timestamps of the time range, in milliseconds
+    :return: the datapoints with empty intervals filled, in time order
+    """
+    if fill not in FILL_MODES or not datapoints:
+        return datapoints
+
+    values = {int(timestamp // interval_ms): value for value, timestamp in datapoints}
+    first = min(values)
+    last = max(values)
+    if time_range:
+        start, end = time_range
+        first = min(first, int(start // interval_ms))
+        last = max(last, int(-(-end // interval_ms)) - 1)
+
+    filled = []
+    previous = None
+    for interval in range(first, last + 1):
+        if interval in values:
+            value = previous = values[interval]
+        elif fill == 'zero':
+            value = 0
+        elif fill == 'previous':
+            value = previous
+        else:
+            value = None
+        filled.append([value, interval * interval_ms])
+    return filled
+
+
+class IntervalAggregator(Aggregator):
+    """
+    Aggregate the datapoints of a serie by time intervals, as they come.
+
+    Intervals are aligned on multiples of `interval_ms` and stamped with their start timestamp,
+    so the same data always gives the same intervals whatever the queried time range.
+    Only the values of the current interval are buffered.
+    """
+
+    def __init__(self, method: str, interval_ms: int, fill: str = 'none', time_range: tuple = None):
+        self.datapoints = []
+        self.method = method
+        self.interval_ms = interval_ms
+        self.fill = fill
+        self.time_range = time_range
+        self.interval = None
+        self.buffer = []
+        self.text_datapoints = []
+
+    def add(self, value, timestamp):
+        if isinstance(value, str):
+            # you can't aggregate str
+            self.text_datapoints.append([value, timestamp])
+            return
+
+        interval = int(timestamp // self.interval_ms)
+        if interval != self.interval:
+            self._store_interval()
+            self.interval = interval
+
+        # aggregate values in the same interval
+        self.buffer.append(value)
+
+    def _store_interval(self):
+        if self.buffer:
+            self.datapoints.append([
+                compute_aggregation(self.buffer, self.method),
+                self.interval * self.interval_ms
+            ])
+            self.buffer = []
+
+    def _finish_intervals(self, datapoints: list):
+        datapoints = fill_datapoints(datapoints, self.fill, self.interval_ms, self.time_range)
+        if self.text_datapoints:
+            datapoints = sorted(datapoints + self.text_datapoints, key=lambda datapoint: datapoint[1])
+        return datapoints
+
+    def finish(self):
+        # the last interval is complete once every value is known
+        self._store_interval()
+        return self._finish_intervals(self.datapoints)
+
+
+class NumpyIntervalAggregator(IntervalAggregator):
+    """
+    Aggregate the datapoints of a serie by time intervals, with numpy.
+
+    Values are buffered as columns and reduced one page at a time,
+    only the values of the unfinished last interval are kept from a page to the next one.
+    """
+
+    def __init__(self, method: str, interval_ms: int, fill: str = 'none', time_range: tuple = None):
+        super().__init__(method, interval_ms, fill, time_range)
+        # columns not reduced yet
+        self.timestamps = []
+        self.values = []
+        # unfinished last interval of the previous page
+        self.tail_timestamps = numpy.empty(0)
+        self.tail_values = numpy.empty(0)
+        self.chunks = []
+
+    def add(self, value, timestamp):
+        if isinstance(value, str):
+            # you can't aggregate str
+            self.text_datapoints.append([value, timestamp])
+            return
+        self.timestamps.append(timestamp)
+        self.values.append(value)
+
+    def add_page(self, values, timestamps):
+        try:
+            page_values = numpy.fromiter(values, dtype=float, count=len(values))
+        except (TypeError, ValueError):
+            # some values are str, add them one by one
+            self._add_one_by_one(values, timestamps)
+            return
+        page_timestamps = numpy.fromiter(timestamps, dtype=float, count=len(timestamps))
+        self._reduce_page(page_values, page_timestamps)
+
+    def _reduce(self, values, starts):
+        if self.method == 'count':
+            return numpy.diff(numpy.append(starts, len(values)))
+        if self.method in NUMPY_REDUCERS:
+            return getattr(numpy, NUMPY_REDUCERS[self.method]).reduceat(values, starts)
+        # default is average
+        return numpy.add.reduceat(values, starts) / numpy.diff(numpy.append(starts, len(values)))
+
+    def _reduce_intervals(self, values, timestamps):
+        intervals = numpy.floor_divide(timestamps, self.interval_ms).astype(numpy.int64)
+        # index of the first value of each interval
+        starts = numpy.append(0, numpy.flatnonzero(numpy.diff(intervals)) + 1)
+        self.chunks.append((self._reduce(values, starts), intervals[starts] * self.interval_ms))
+
+    def _reduce_page(self, values, timestamps):
+        values = numpy.concatenate((self.tail_values, values))
+        timestamps = numpy.concatenate((self.tail_timestamps, timestamps))
+        if not len(timestamps):
+            return
+
+        intervals = numpy.floor_divide(timestamps, self.interval_ms)
+        # the last interval may go on in the next page
+        last_start = numpy.flatnonzero(intervals != intervals[-1])
+        last_start = last_start[-1] + 1 if len(last_start) else 0
+
+        if last_start:
+            self._reduce_intervals(values[:last_start], timestamps[:last_start])
+
+        # keep the unfinished last interval for the next page
+        self.tail_values = values[last_start:]
+        self.tail_timestamps = timestamps[last_start:]
+
+    def end_page(self):
+        if self.values:
+            self._reduce_page(numpy.array(self.values, dtype=float), numpy.array(self.timestamps, dtype=float))
+            self.values = []
+            self.timestamps = []
+
+    def finish(self):
+        self.end_page()
+
+        # the last interval is complete once every value is known
+        if len(self.tail_values):
+            self._reduce_intervals(self.tail_values, self.tail_timestamps)
+            self.tail_values = numpy.empty(0)
+            self.tail_timestamps = numpy.empty(0)
+
+        datapoints = [
+            [value, timestamp]
+            for aggregated, timestamps in self.chunks
+            for value, timestamp in zip(aggregated.tolist(), timestamps.tolist())
+        ]
+        return self._finish_intervals(datapoints)
+
+
+def make_aggregator(aggregation: str, interval_ms: int, engine: str = DEFAULT_ENGINE, fill: str = 'none',
+                    time_range: tuple = None):
+    """
+    Build the aggregator of a serie.
+
+    :param aggregation: aggregation method asked by the target
+    :param interval_ms: interval between two aggregated datapoints, in milliseconds
+    :param engine: 'numpy' to aggregate time intervals with numpy when installed, 'python' otherwise
+    :param fill: how empty intervals are filled: 'none', 'null', 'previous' or 'zero'
+    :param time_range: start and end timestamps of the queried time range, in milliseconds
+    :return: a new aggregator
+    """
+    if aggregation == 'none':
+        return RawAggregator()
+    if aggregation == 'on changes':
+        # aggregate by duplicate value
+        return ChangesAggregator()
+    # aggregate by time intervals
+    if engine == 'numpy' and numpy:
+        return NumpyIntervalAggregator(aggregation, interval_ms, fill, time_range)
+    return IntervalAggregator(aggregation, interval_ms, fill, time_range)
+
+
+class TimeserieBuilder:
+    """
+    Build Grafana timeseries from result pages, one page at a time.
+
+    Rows are parsed and aggregated as soon as they are fed, so pages can be released right after.
+    Pages are decoded by columns, a serie gets all its values of a page at once.
+    Series which are not aggregated by time intervals are downsampled to `max_points` datapoints once complete.
+    """
+
+    def __init__(self, aggregation: str = 'none', interval_ms: int = None, engine: str = DEFAULT_ENGINE,
+                 fill: str = 'none', time_range: tuple = None, value_type: str = None, max_points: int = None,
+                 downsampling: str = 'none'):
+        self.aggregation = aggregation
+        self.interval_ms = interval_ms
+        self.engine = engine
+        self.fill = fill
+        self.time_range = time_range
+        self.max_points = max_points
+        self.downsampling = downsampling
+        # CQL type of the value column, values of a float type need no conversion
+        self.float_values = value_type in FLOAT_TYPES
+        self.series = {}
+
+    def _decode_values(self, values):
+        if self.float_values:
+            return values
+        try:
+            return list(map(float, values))
+        except (ValueError, TypeError):
+            pass
+
+        decoded = []
+        for value in values:
+            try:
+                decoded.append(float(value))
+            except (ValueError, TypeError):
+                decoded.append(str(value))
+        return decoded
+
+    def _get_aggregator(self, name):
+        aggregator = self.series.get(name)
+        if aggregator is None:
+            aggregator = self.series[name] = make_aggregator(
+                self.aggregation,
+                self.interval_ms,
+                self.engine,
+                self.fill,
+                self.time_range
+            )
+        return aggregator
+
+    def add_rows(self, rows):
+        if not rows:
+            return
+
+        column_names = get_column_names(rows)
+        get_timestamp, get_name, get_value = (
+            itemgetter(column_names.index(column)) for column in ('timestamp', 'name', 'value')
+        )
+
+        names = list(map(get_name, rows))
+        if names.count(names[0]) == len(names):
+            # a single serie in this page
+            series = {names[0]: rows}
+        else:
+            series = {}
+            for name, row in zip(names, rows):
+                serie_rows = series.get(name)
+                if serie_rows is None:
+                    serie_rows = series[name] = []
+                serie_rows.append(row)
+
+        for name, serie_rows in series.items():
+            values = list(map(get_value, serie_rows))
+            if None in values:
+                # skip rows without value
+                serie_rows = [row for row in serie_rows if get_value(row) is not None]
+                if not serie_rows:
+                    continue
+                values = list(map(get_value, serie_rows))
+
+            self._get_aggregator(name).add_page(
+                self._decode_values(values),
+                # convert our timestamp in microsecond into a millisecond one
+                [get_timestamp(row) / 1000 for row in serie_rows]
+            )
+
+    def _finish(self, aggregator):
+        if isinstance(aggregator, RawAggregator):
+            return aggregator.finish(self.max_points, self.downsampling)
+        return aggregator.finish()
+
+    def results(self):
+        return [
+            {
+                'target': name,
+                'datapoints': self._finish(aggregator)  # an entry is: [ value, timestamp in milliseconds ]
+            } for name, aggregator in self.series.items()
+        ]
+
+
+class TableBuilder:
+    """
+    Build a Grafana table from result pages, one page at a time.
+    """
+
+    def __init__(self):
+        self.columns = []
+        self.rows = []
+
+    def add_rows(self, rows):
+        if not rows:
+            return
+
+        if not self.columns:
+            self.columns = get_column_names(rows)
+
+        if 'timestamp' not in self.columns:
+            self.rows.extend(map(list, rows))
+            return
+
+        timestamp_column = self.columns.index('timestamp')
+        for row in rows:
+            value_list = list(row)
+            value_list[timestamp_column] = int(value_list[timestamp_column]) / 1000
+            self.rows.append(value_list)
+
+    def results(self):
+        return [{
+            'columns': [
+                {
+                    'text': column,
+                    'type': 'string'
+                } for column in self.columns
+            ],
+            'rows': self.rows,
+            'type': 'table'
+        }]
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import time
+import select
+import signal
+import asyncio
 import logging
 import configparser
 from tornado import httpserver, ioloop, netutil, process, web
@@ -17,50 +22,326 @@ if 'SERVER' not in config:
 settings = config['SERVER']
 port = settings.getint('HTTP_PORT', fallback=80)
 fork = settings.getboolean('FORK', fallback=False)
+workers = settings.getint('WORKERS', fallback=0)  # forked worker processes, 0 for one per CPU
+drain_timeout = settings.getfloat('DRAIN_TIMEOUT', fallback=30)  # in seconds, to finish in-flight requests
+ready_timeout = settings.getfloat('READY_TIMEOUT', fallback=60)  # in seconds, for a restarted worker to be ready
+reuse_port = settings.getboolean('REUSE_PORT', fallback=False)  # another instance may bind the port meanwhile
+max_restarts = settings.getint('MAX_RESTARTS', fallback=100)  # crashed workers restarted, then the server exits
 
-servers = []
+# in a worker: its id, from 0 to the worker count, None when not forked
+worker_id = None
+# set once the worker stops accepting connections, to finish its in-flight requests before exiting
+draining = False
+# seconds from the worker start (the process start when not forked) until it accepted connections
+ready_time = None
 
 
-def start_http(app: web.Application, http_port: int = port, use_fork: bool = fork):
+def worker_count():
     """
-    Create app instance(s) binding a port.
+    :return: worker processes serving requests
+    """
+    if not fork or not hasattr(os, 'fork'):
+        return 1
+    return workers or process.cpu_count()
 
-    :param app: the app to execute in server instances
-    :param http_port: port to bind
-    :param use_fork: fork or not to use more than one CPU (process)
+
+def process_start():
     """
-    http_socket = netutil.bind_sockets(http_port)  # HTTP socket
-    if use_fork:
-        try:  # try to create threads
-            process.fork_processes(0)  # fork
-        except KeyboardInterrupt:  # except KeyboardInterrupt to "properly" exit
-            ioloop.IOLoop.current().stop()
-            exit(0)
-        except AttributeError:  # OS without fork() support ...
-            logger.warning('Can not fork, continuing with only one thread ...')
-            # do nothing and continue without multi-threading
+    :return: time.monotonic() when this process started, from the start time the OS reports (Linux),
+             now when it is unknown
+    """
+    try:
+        with open('/proc/self/stat') as stat:
+            # the start time is the 22nd field, counted after the command name which may hold spaces
+            start_ticks = int(stat.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as uptime:
+            uptime_seconds = float(uptime.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return time.monotonic()
+    age = uptime_seconds - start_ticks / os.sysconf('SC_CLK_TCK')
+    return time.monotonic() - max(age, 0)
 
-    logger.info('Start an HTTP request handler on port : ' + str(http_port))
-    server = httpserver.HTTPServer(app)
-    server.add_sockets(http_socket)  # bind http port
 
-    global servers
-    servers.append((server, ioloop.IOLoop.current()))
+async def drain(server: httpserver.HTTPServer, in_flight, timeout: float = drain_timeout):
+    """
+    Stop accepting connections, then wait for the in-flight requests to be answered.
 
-    # try to stay forever alive to satisfy user's requests, except on KeyboardInterrupt to "properly" exit
-    try:
-        ioloop.IOLoop.current().start()
-    except KeyboardInterrupt:
-        server.close_all_connections()
-        server.stop()
-        ioloop.IOLoop.current().stop()
+    :param server: the HTTP server of this process
+    :param in_flight: callable returning the requests being served
+    :param timeout: seconds to wait for the requests
+    :return: requests still in flight after the timeout
+    """
+    global draining
+    draining = True
+    server.stop()
+
+    deadline = time.monotonic() + timeout
+    while in_flight() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
 
+    remaining = in_flight()
+    if remaining:
+        logger.warning(f'{remaining} request(s) still in flight after {timeout} s, closing their connections')
+    # idle keep-alive connections are closed too
+    await server.close_all_connections()
+    return remaining
 
-def stop_all():
+
+def _serve(app: web.Application, sockets: list, started: float, warm_up=None, in_flight=None, on_stop=None,
+           ready_fd: int = None):
     """
-    Take care of stopping all server process properly
+    Serve requests in the current process until SIGTERM or SIGINT, then drain.
+
+    The worker warms up before accepting connections: the other workers keep serving the shared sockets meanwhile.
     """
-    for server, loop in servers:
-        server.close_all_connections()
-        server.stop()
+    global ready_time
+    loop = ioloop.IOLoop.current()
+    server = httpserver.HTTPServer(app)
+
+    async def start():
+        global ready_time
+        if warm_up:
+            try:
+                await warm_up()
+            except Exception as e:
+                # served anyway, requests connect on their own and /health reports the failure
+                logger.warning(f'Warm up failed: {e}')
+        server.add_sockets(sockets)
+        ready_time = time.monotonic() - started
+        logger.info(f'Worker {worker_id or 0} ready to serve on port {sockets[0].getsockname()[1]}, '
+                    f'{ready_time:.3f} s after start')
+        if ready_fd is not None:
+            os.write(ready_fd, f'{os.getpid()}\n'.encode())
+
+    async def stop():
+        if draining:
+            return
+        logger.info(f'Worker {worker_id or 0} draining')
+        await drain(server, in_flight or (lambda: 0))
+        if on_stop:
+            on_stop()
         loop.stop()
+
+    asyncio_loop = asyncio.get_event_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        asyncio_loop.add_signal_handler(signum, lambda: asyncio.ensure_future(stop()))
+    if hasattr(signal, 'SIGHUP'):
+        # restarts are handled by the supervisor
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    loop.add_callback(start)
+    loop.start()
+
+
+class Supervisor:
+    """
+    Fork the worker processes and keep them running, in the process started first.
+
+    - a crashed worker is forked again with the same id;
+    - SIGTERM or SIGINT: every worker drains, then the supervisor exits;
+    - SIGHUP: workers are replaced one at a time, each new worker takes over once ready,
+      the listening sockets stay open in between so no connection is refused.
+    """
+
+    def __init__(self, count: int):
+        self.count = count
+        self.children = {}  # pid: worker id
+        self.retiring = set()  # pids of the replaced workers, draining
+        self.signals = []
+        self.restarts = 0
+        self.ready_read, self.ready_write = os.pipe()
+        self.ready_buffer = b''
+        self.pending = []  # worker ids to replace
+        self.replacing = None  # (worker id, old pid, new pid, deadline)
+        self.stopping = False
+
+    def _spawn(self, task: int):
+        """
+        :return: True in the forked worker
+        """
+        pid = os.fork()
+        if pid == 0:
+            global worker_id
+            worker_id = task
+            os.close(self.ready_read)
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            return True
+        self.children[pid] = task
+        return False
+
+    def _on_signal(self, signum, _):
+        self.signals.append(signum)
+
+    def _handle_signals(self):
+        while self.signals:
+            signum = self.signals.pop(0)
+            if signum == signal.SIGHUP and not self.stopping:
+                logger.info('Restarting the workers one at a time')
+                self.pending = sorted(set(self.children.values()))
+            elif signum in (signal.SIGTERM, signal.SIGINT) and not self.stopping:
+                self._stop()
+
+    def _stop(self):
+        """
+        Make every worker drain, they exit once their in-flight requests are answered.
+        """
+        logger.info(f'Stopping, {len(self.children)} worker(s) draining')
+        self.stopping = True
+        self.pending = []
+        for pid in self.children:
+            self._kill(pid)
+
+    def _wait_children(self):
+        """
+        Wait for every worker to exit.
+        """
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                return
+            self.children.pop(pid, None)
+
+    @staticmethod
+    def _kill(pid: int):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _read_ready(self, timeout: float):
+        """
+        :return: pids of the workers which got ready
+        """
+        readable, _, _ = select.select([self.ready_read], [], [], timeout)
+        if not readable:
+            return []
+        self.ready_buffer += os.read(self.ready_read, 4096)
+        *lines, self.ready_buffer = self.ready_buffer.split(b'\n')
+        return [int(line) for line in lines]
+
+    def _reap(self):
+        """
+        :return: True in a worker forked again
+        """
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                return False
+            task = self.children.pop(pid, None)
+            if task is None:
+                continue
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                logger.info(f'Replaced worker {task} (pid {pid}) exited')
+                continue
+            if self.replacing and self.replacing[2] == pid:
+                logger.error(f'Worker {task} exited before being ready, restart aborted')
+                self.replacing = None
+                self.pending = []
+                continue
+            if self.stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            logger.warning(f'Worker {task} (pid {pid}) exited with code {code}, forking it again')
+            self.restarts += 1
+            if self.restarts > max_restarts:
+                logger.error(f'{self.restarts} workers crashed, more than MAX_RESTARTS')
+                # the other workers must not be left behind, orphaned
+                self._stop()
+                self._wait_children()
+                raise RuntimeError('Too many workers crashed')
+            if self._spawn(task):
+                return True
+        return False
+
+    def _replace_next(self):
+        """
+        :return: True in the new worker
+        """
+        if self.replacing:
+            task, old_pid, new_pid, deadline = self.replacing
+            if time.monotonic() > deadline:
+                logger.error(f'New worker {task} not ready after {ready_timeout} s, restart aborted')
+                self._kill(new_pid)
+                self.replacing = None
+                self.pending = []
+            return False
+        if not self.pending:
+            return False
+
+        task = self.pending.pop(0)
+        old_pid = next((pid for pid, child in self.children.items() if child == task and pid not in self.retiring),
+                       None)
+        if self._spawn(task):
+            return True
+        new_pid = next(pid for pid, child in self.children.items() if child == task and pid != old_pid)
+        self.replacing = (task, old_pid, new_pid, time.monotonic() + ready_timeout)
+        return False
+
+    def run(self, started: float):
+        """
+        Fork the workers, then supervise them until they all exited.
+
+        :param started: time.monotonic() when the server started
+        :return: the id of the worker, only in the forked workers, the supervisor exits
+        """
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, self._on_signal)
+
+        for task in range(self.count):
+            if self._spawn(task):
+                return task
+
+        starting = set(self.children)
+        while self.children:
+            self._handle_signals()
+            for pid in self._read_ready(0.2):
+                if pid in starting:
+                    starting.discard(pid)
+                    if not starting:
+                        logger.info(f'{self.count} workers ready, {time.monotonic() - started:.3f} s after start')
+                if self.replacing and self.replacing[2] == pid:
+                    task, old_pid = self.replacing[:2]
+                    logger.info(f'Worker {task} replaced, pid {old_pid} draining')
+                    if old_pid is not None:
+                        self.retiring.add(old_pid)
+                        self._kill(old_pid)
+                    self.replacing = None
+            if self._reap() or self._replace_next():
+                return worker_id
+
+        logger.info('Stopped')
+        sys.exit(0)
+
+
+def start_http(app: web.Application, http_port: int = port, use_fork: bool = fork, warm_up=None, in_flight=None,
+               on_stop=None, started: float = None):
+    """
+    Serve an app on a port, by one or more worker processes, until SIGTERM or SIGINT.
+
+    :param app: the app to execute in server instances
+    :param http_port: port to bind
+    :param use_fork: fork or not to use more than one CPU (process)
+    :param warm_up: coroutine function run by each worker before accepting connections
+    :param in_flight: callable returning the requests being served, waited for before exiting
+    :param on_stop: called by each worker once its requests are answered
+    :param started: time.monotonic() when the server started, to report the time to be ready
+    """
+    started = started if started is not None else time.monotonic()
+    http_socket = netutil.bind_sockets(http_port, reuse_port=reuse_port)  # HTTP socket
+
+    ready_fd = None
+    if use_fork:
+        if hasattr(os, 'fork'):
+            supervisor = Supervisor(worker_count())
+            supervisor.run(started)
+            # forked worker
+            ready_fd = supervisor.ready_write
+            started = time.monotonic()
+        else:  # OS without fork() support ...
+            logger.warning('Can not fork, continuing with only one process ...')
+
+    logger.info('Start an HTTP request handler on port : ' + str(http_port))
+    _serve(app, http_socket, started, warm_up, in_flight, on_stop, ready_fd)
@@ -44,7 +44,37 @@ describe('GenericDatasource', function() {
         });
     });
 
-    it ('should return empty metric result list, no search atm.', function(done) {
+    it('should turn data frames back into series when columnar responses are enabled', function(done) {
+        var ds = new Datasource({jsonData: {columnarResponse: true}}, ctx.$q, ctx.backendSrv, ctx.templateSrv);
+        ctx.backendSrv.datasourceRequest = function(request) {
+            expect(request.data.format).to.equal('frames');
+            return ctx.$q.when({
+                _request: request,
+                data: [
+                    {
+                        refId: 'A',
+                        schema: {name: 'X', refId: 'A', fields: [{name: 'time', type: 'time'}, {name: 'value', type: 'number'}]},
+                        data: {values: [[1000, 2000], [1, 2]]}
+                    }
+                ]
+            });
+        };
+
+        ctx.templateSrv.replace = function(data) {
+            return data;
+        }
+
+        ds.query({targets: ['hits']}).then(function(result) {
+            expect(result.data).to.have.length(1);
+            var series = result.data[0];
+            expect(series.target).to.equal('X');
+            expect(series.refId).to.equal('A');
+            expect(series.datapoints).to.deep.equal([[1, 1000], [2, 2000]]);
+            done();
+        });
+    });
+
+    it ('should return the metric values found by the server', function(done) {
         ctx.backendSrv.datasourceRequest = function(request) {
             return ctx.$q.when({
                 _request: request,
@@ -60,8 +90,11 @@ describe('GenericDatasource', function() {
             return data;
         }
 
-        ctx.ds.metricFindQuery({target: null}).then(function(result) {
-            expect(result).to.have.length(0);
+        ctx.ds.metricFindQuery('name').then(function(result) {
+            expect(result).to.have.length(3);
+            expect(result[0].text).to.equal('metric_0');
+            expect(result[0].value).to.equal('metric_0');
+            expect(result[2].text).to.equal('metric_2');
             done();
         });
     });
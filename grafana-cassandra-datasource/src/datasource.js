@@ -11,6 +11,8 @@ export class GenericDatasource {
     this.templateSrv = templateSrv;
     this.withCredentials = instanceSettings.withCredentials;
     this.headers = {'Content-Type': 'application/json'};
+    // ask for data frames, the values of each serie by columns, lighter to send and to parse
+    this.columnar = !!(instanceSettings.jsonData && instanceSettings.jsonData.columnarResponse);
     if (typeof instanceSettings.basicAuth === 'string' && instanceSettings.basicAuth.length > 0) {
       this.headers['Authorization'] = instanceSettings.basicAuth;
     }
@@ -33,13 +35,46 @@ export class GenericDatasource {
       query.adhocFilters = [];
     }
 
+    if (!this.columnar) {
+      return this.doRequest({
+        url: this.url + '/query',
+        data: query,
+        method: 'POST'
+      });
+    }
+
+    query.format = 'frames';
     return this.doRequest({
       url: this.url + '/query',
       data: query,
       method: 'POST'
+    }).then(response => {
+      response.data = _.map(response.data, frame => this.frameToResult(frame));
+      return response;
     });
   }
 
+  frameToResult(frame) {
+    // a data frame of the gateway, back into the serie or table the panels expect
+    var fields = frame.schema.fields;
+    var columns = frame.data.values;
+    var result;
+
+    if (frame.error !== undefined) {
+      result = {target: frame.schema.name, datapoints: [], error: frame.error};
+    } else if (fields.length === 2 && fields[0].type === 'time' && fields[0].name === 'time') {
+      result = {target: frame.schema.name, datapoints: _.zip(columns[1], columns[0])};
+    } else {
+      result = {
+        type: 'table',
+        columns: _.map(fields, field => ({text: field.name, type: field.type})),
+        rows: _.zip.apply(_, columns)
+      };
+    }
+    result.refId = frame.refId;
+    return result;
+  }
+
   testDatasource() {
     // used by data source configuration page to make sure the connection is working
     return this.doRequest({
@@ -78,9 +113,17 @@ export class GenericDatasource {
   }
 
   metricFindQuery(query) {
-    // No metric suggestion atm. in this datasource
-    return new Promise(function(resolve, reject) {
-        resolve([]);
+    // used by template variables: the values of a column, or the column names for an empty query
+    var target = this.templateSrv.replace(query || '', null, 'regex');
+
+    return this.doRequest({
+      url: this.url + '/search',
+      method: 'POST',
+      data: {target: target}
+    }).then(result => {
+      return _.map(result.data, value => {
+        return {text: value, value: value};
+      });
     });
   }
 
@@ -104,7 +147,9 @@ export class GenericDatasource {
         refId: target.refId,
         hide: target.hide,
         type: target.type || 'timeserie',
-        aggregation: target.aggregation || 'average'
+        aggregation: target.aggregation || 'average',
+        fill: target.fill || 'none',
+        downsampling: target.downsampling || 'lttb'
       };
     });
 
@@ -10,6 +10,8 @@ export class GenericDatasourceQueryCtrl extends QueryCtrl {
     this.target.target = this.target.target || 'write your cassandra query here';
     this.target.type = this.target.type || 'timeserie';
     this.target.aggregation = this.target.aggregation || 'average';
+    this.target.fill = this.target.fill || 'none';
+    this.target.downsampling = this.target.downsampling || 'lttb';
   }
 
   getOptions(query) {